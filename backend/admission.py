@@ -0,0 +1,146 @@
+"""
+Priority-aware admission control for the expensive endpoints (Whisper / Claude).
+
+A fixed number of slots can run heavy work at once. Requests that find
+every slot busy wait in one queue ordered by priority class, so an
+emergency call is served before an ongoing call, and both go ahead of ad-hoc
+tool traffic. Each class has a bounded queue and a deadline. A request that
+finds its queue full or is still waiting when its deadline passes is shed
+with 429 and a Retry-After estimate, so an overloaded worker does not
+build up an unbounded backlog. Non-emergency traffic is also rate limited
+per client with a token bucket.
+"""
+
+from typing import Dict, Optional
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+from metrics import Counter, Gauge
+
+PRIORITY_EMERGENCY = 0
+PRIORITY_ONGOING = 1
+PRIORITY_TOOL = 2
+PRIORITY_NAMES = {PRIORITY_EMERGENCY: "emergency", PRIORITY_ONGOING: "ongoing", PRIORITY_TOOL: "tool"}
+
+ADMISSION_REJECTED = Counter("sosai_admission_rejected_total", "Requests shed by admission control", ("priority", "reason"))
+ADMISSION_QUEUED = Gauge("sosai_admission_queue_depth", "Requests waiting for a processing slot", ("priority",))
+ADMISSION_WAIT = Counter("sosai_admission_wait_seconds_total", "Time spent waiting for a processing slot", ("priority",))
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Per-client rate limiter: `rate` requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: Dict[str, list] = {}  # client -> [tokens, last_refill]
+
+    def allow(self, client: str) -> Optional[int]:
+        """None if the request may proceed, otherwise seconds until a token is available"""
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                # Drop clients whose bucket has refilled completely; they carry no state
+                full = [c for c, (tokens, last) in self._buckets.items()
+                        if tokens + (now - last) * self.rate >= self.burst]
+                for c in full:
+                    del self._buckets[c]
+            bucket = self._buckets[client] = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return None
+        bucket[0] = tokens
+        return max(1, math.ceil((1 - tokens) / self.rate))
+
+
+class AdmissionController:
+    def __init__(self, slots: int, queue_limits: Dict[int, int], deadlines: Dict[int, float], rate_limiter: TokenBucket):
+        self.slots = slots
+        self.queue_limits = queue_limits
+        self.deadlines = deadlines
+        self.rate_limiter = rate_limiter
+        self.in_use = 0
+        self.service_time = 1.0  # moving average of seconds per admitted request
+        self._waiters = []  # heap of (priority, seq, future)
+        self._queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self._seq = itertools.count()
+
+    def queued(self, priority: Optional[int] = None) -> int:
+        if priority is None:
+            return sum(self._queued.values())
+        return self._queued[priority]
+
+    def _retry_after(self, ahead: int) -> int:
+        return max(1, math.ceil((ahead + 1) * self.service_time / max(self.slots, 1)))
+
+    def _reject(self, priority: int, reason: str, retry_after: int):
+        ADMISSION_REJECTED.inc(priority=PRIORITY_NAMES[priority], reason=reason)
+        raise Overloaded(reason, retry_after)
+
+    def _set_queued(self, priority: int, delta: int):
+        self._queued[priority] += delta
+        ADMISSION_QUEUED.set(self._queued[priority], priority=PRIORITY_NAMES[priority])
+
+    async def acquire(self, priority: int, client: str):
+        """Wait for a processing slot; raises Overloaded when the request is shed"""
+        if priority != PRIORITY_EMERGENCY:
+            wait = self.rate_limiter.allow(client)
+            if wait is not None:
+                self._reject(priority, "rate_limited", wait)
+
+        if self.in_use < self.slots and not self._waiters:
+            self.in_use += 1
+            return
+
+        ahead = sum(self._queued[p] for p in self._queued if p <= priority)
+        if self._queued[priority] >= self.queue_limits[priority]:
+            self._reject(priority, "queue_full", self._retry_after(ahead))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._set_queued(priority, 1)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.deadlines[priority])
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up on it
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                self.release(0.0)
+                raise
+            future.cancel()
+            self._set_queued(priority, -1)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(priority, "deadline", self._retry_after(ahead))
+            raise
+        finally:
+            ADMISSION_WAIT.inc(time.monotonic() - started, priority=PRIORITY_NAMES[priority])
+
+    def release(self, elapsed: float):
+        if elapsed > 0:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+        while self._waiters:
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._set_queued(priority, -1)
+            future.set_result(True)  # the slot passes straight to the next waiter
+            return
+        self.in_use -= 1
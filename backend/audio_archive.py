@@ -0,0 +1,418 @@
+"""
+Content-addressed archive of call recordings.
+
+Uploaded audio is stored once per SHA-256 of its bytes under
+<root>/objects/<first two hex chars>/<hash>.<ext>, so the same recording
+uploaded twice takes no extra space. A background thread transcodes every new
+file to Opus (speech-tuned, AUDIO_OPUS_BITRATE) with ffmpeg and then removes
+the original. The channel layout is kept, so a dual-channel recording can
+still be reprocessed per speaker. Playback goes through HTTP Range requests (see
+/audio/{sha256} in main.py).
+
+Several workers may share the archive, so no step relies on a process lock.
+Files are written under a temporary name and renamed into place. A blob row
+is only created or revived by a conditional write, and an upload that loses
+the race is treated as a duplicate. A transcoded file replaces the original
+in the catalog first; the original is unlinked `retire_seconds` later, so
+playback requests that already resolved its path can still open it. Playback
+records access times in memory and writes them in batches every
+`access_flush_seconds`, keeping writes off the Range request path.
+
+The archive enforces a disk budget after every store or transcode and every
+`budget_seconds`. Blobs older than `max_age_days` are evicted, then the least
+recently played ones until the total fits in `max_bytes`. The total is summed
+from the database, so it covers what every worker stored, and a blob is
+evicted by a conditional write, so two workers never evict (or count) it
+twice. Evicted blobs keep their database row (duration, sizes) with path set
+to NULL, so reports still account for them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread, Timer
+from typing import Callable, Dict, Optional
+import hashlib
+import os
+import shutil
+import subprocess
+import time
+import uuid
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from metrics import Counter, Gauge
+from models import AudioBlob, AudioRecording
+
+ARCHIVE_BYTES = Gauge("sosai_audio_archive_bytes", "Bytes of audio stored in the archive")
+ARCHIVE_SECONDS = Gauge("sosai_audio_archive_audio_seconds", "Seconds of audio stored in the archive")
+ARCHIVE_BYTES_PER_HOUR = Gauge("sosai_audio_archive_bytes_per_call_hour", "Archive storage cost per hour of call audio")
+ARCHIVE_EVENTS = Counter("sosai_audio_archive_events_total", "Archive operations", ("event",))
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AudioArchive:
+    def __init__(
+        self,
+        root: str,
+        session_factory: Callable,
+        max_bytes: int,
+        max_age_days: float,
+        opus_bitrate: str = "24k",
+        transcode: bool = True,
+        access_flush_seconds: float = 60.0,
+        retire_seconds: float = 60.0,
+        budget_seconds: float = 600.0
+    ):
+        self.root = os.path.abspath(root)
+        self.session_factory = session_factory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.opus_bitrate = opus_bitrate
+        self.transcode_enabled = transcode and shutil.which("ffmpeg") is not None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-transcode")
+        self.access_flush_seconds = access_flush_seconds
+        self.retire_seconds = retire_seconds
+        self.budget_seconds = budget_seconds
+        self._stop = Event()
+        self._budget_thread = None
+        self._lock = Lock()
+        self._accessed: Dict[str, datetime] = {}  # sha256 -> last playback, not yet written
+        self._accessed_flushed_at = time.monotonic()
+        self._retired: Dict[str, Timer] = {}  # superseded file -> pending unlink
+        self.total_bytes = 0
+        self.total_seconds = 0.0
+        ARCHIVE_BYTES.set_function(lambda: self.total_bytes)
+        ARCHIVE_SECONDS.set_function(lambda: self.total_seconds)
+        ARCHIVE_BYTES_PER_HOUR.set_function(self.bytes_per_call_hour)
+
+    def absolute(self, relative_path: str) -> str:
+        return os.path.join(self.root, relative_path)
+
+    def _relative(self, sha256: str, extension: str) -> str:
+        return os.path.join("objects", sha256[:2], f"{sha256}{extension}")
+
+    def _partial(self, target: str) -> str:
+        """A temporary name next to `target`, unique across threads and workers"""
+        return f"{target}.{uuid.uuid4().hex}.part"
+
+    # -------- Startup --------
+    def start(self):
+        """Load totals and resume transcoding of blobs left in their original codec"""
+        db = self.session_factory()
+        try:
+            self._rebuild_totals(db)
+            pending = [
+                sha256 for (sha256,) in
+                db.query(AudioBlob.sha256).filter(AudioBlob.codec == "original", AudioBlob.path.isnot(None))
+            ]
+        finally:
+            db.close()
+        if self.transcode_enabled:
+            for sha256 in pending:
+                self._executor.submit(self._transcode, sha256)
+        elif not shutil.which("ffmpeg"):
+            print("ffmpeg not found: archived audio is kept in its original format")
+        if self.budget_seconds and self._budget_thread is None:
+            self._stop.clear()
+            self._budget_thread = Thread(target=self._run_budget, name="audio-budget", daemon=True)
+            self._budget_thread.start()
+
+    def _run_budget(self):
+        # Age limits apply even when nothing is uploaded, and other workers' uploads count too
+        while not self._stop.wait(self.budget_seconds):
+            try:
+                self.enforce_budget()
+            except Exception as e:
+                print(f"Audio archive budget check failed: {e}")
+
+    def _rebuild_totals(self, db):
+        stored, seconds = db.query(
+            func.coalesce(func.sum(AudioBlob.stored_size), 0),
+            func.coalesce(func.sum(AudioBlob.duration), 0.0)
+        ).filter(AudioBlob.path.isnot(None)).one()
+        with self._lock:
+            self.total_bytes = int(stored)
+            self.total_seconds = float(seconds)
+
+    def bytes_per_call_hour(self) -> float:
+        with self._lock:
+            return self.total_bytes / (self.total_seconds / 3600) if self.total_seconds else 0.0
+
+    def stop(self):
+        self._stop.set()
+        if self._budget_thread is not None:
+            self._budget_thread.join()
+            self._budget_thread = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.flush_access()
+        except Exception as e:
+            print(f"Could not save audio access times: {e}")
+        with self._lock:
+            retired = list(self._retired.items())
+        for path, timer in retired:  # no request will open them any more
+            timer.cancel()
+            self._unlink_retired(path)
+
+    # -------- Store --------
+    def store(
+        self,
+        path: str,
+        filename: Optional[str],
+        duration: float,
+        session_id: Optional[int] = None,
+        message_id: Optional[int] = None
+    ) -> str:
+        """
+        Archive the file at `path` (it is moved, the caller must not reuse it)
+        and link it to a session. Returns the content hash.
+        """
+        sha256 = file_sha256(path)
+        extension = os.path.splitext(filename or "")[1].lower() or ".bin"
+        relative = self._relative(sha256, extension)
+        db = self.session_factory()
+        try:
+            blob = db.get(AudioBlob, sha256)
+            new_blob = False
+            if blob is None or blob.path is None:
+                size = self._place(path, relative)
+                new_blob = self._claim(db, sha256, relative, size, duration, revive=blob is not None)
+                if not new_blob:
+                    # Another upload of the same bytes won: keep its file, drop ours unless it is the same one
+                    db.expire_all()
+                    blob = db.get(AudioBlob, sha256)
+                    if blob is None or blob.path != relative:
+                        os.unlink(self.absolute(relative))
+            else:
+                os.unlink(path)
+            if new_blob:
+                ARCHIVE_EVENTS.inc(event="stored")
+            else:
+                ARCHIVE_EVENTS.inc(event="deduplicated")
+                self._touch(sha256)
+            if session_id:
+                db.add(AudioRecording(session_id=session_id, message_id=message_id, sha256=sha256, filename=filename))
+            db.commit()
+        finally:
+            db.close()
+
+        if new_blob:
+            with self._lock:
+                self.total_bytes += size
+                self.total_seconds += duration or 0.0
+            if self.transcode_enabled:
+                self._executor.submit(self._transcode, sha256)
+            else:
+                self._executor.submit(self.enforce_budget)
+        return sha256
+
+    def _place(self, path: str, relative: str) -> int:
+        """Move a file to `relative` with an atomic rename, so readers never see it half written"""
+        target = self.absolute(relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self._cancel_retire(target)
+        partial = self._partial(target)
+        shutil.move(path, partial)
+        os.replace(partial, target)
+        return os.path.getsize(target)
+
+    def _claim(self, db, sha256: str, relative: str, size: int, duration: float, revive: bool) -> bool:
+        """Point the blob row at a newly placed file; False if another upload already did"""
+        now = datetime.utcnow()
+        values = {
+            "path": relative, "codec": "original", "original_size": size, "stored_size": size,
+            "duration": duration, "created_at": now, "last_accessed_at": now, "evicted_at": None,
+        }
+        if revive:
+            # An evicted blob comes back only if its path is still NULL when we write
+            return db.query(AudioBlob).filter(
+                AudioBlob.sha256 == sha256, AudioBlob.path.is_(None)
+            ).update(values, synchronize_session=False) == 1
+        try:
+            db.add(AudioBlob(sha256=sha256, **values))
+            db.flush()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+
+    # -------- Transcode --------
+    def _transcode(self, sha256: str):
+        db = self.session_factory()
+        try:
+            blob = db.get(AudioBlob, sha256)
+            if blob is None or blob.path is None or blob.codec != "original":
+                return
+            original = blob.path
+            source = self.absolute(original)
+            relative = self._relative(sha256, ".opus")
+            target = self.absolute(relative)
+            partial = self._partial(target)
+            result = subprocess.run(
+                ["ffmpeg", "-nostdin", "-v", "error", "-y", "-i", source, "-vn",
+                 "-c:a", "libopus", "-b:a", self.opus_bitrate, "-application", "voip", "-f", "ogg", partial],
+                capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                ARCHIVE_EVENTS.inc(event="transcode_failed")
+                print(f"Transcoding {sha256} failed, keeping the original: {result.stderr.strip()[-300:]}")
+                if os.path.exists(partial):
+                    os.unlink(partial)
+                return
+            os.replace(partial, target)
+            size = os.path.getsize(target)
+            saved = blob.stored_size - size
+            # Only if the row still points at the original (another worker may have transcoded or evicted it)
+            switched = db.query(AudioBlob).filter(
+                AudioBlob.sha256 == sha256, AudioBlob.path == original
+            ).update({"path": relative, "codec": "opus", "stored_size": size}, synchronize_session=False)
+            db.commit()
+            if not switched:
+                db.expire_all()
+                blob = db.get(AudioBlob, sha256)
+                if blob is None or blob.path != relative:
+                    os.unlink(target)
+                return
+            if source != target:
+                self._retire(source)
+            with self._lock:
+                self.total_bytes -= saved
+            ARCHIVE_EVENTS.inc(event="transcoded")
+        except Exception as e:
+            ARCHIVE_EVENTS.inc(event="transcode_failed")
+            print(f"Transcoding {sha256} failed: {e}")
+        finally:
+            db.close()
+        self.enforce_budget()
+
+    def _retire(self, path: str):
+        """Unlink a superseded file once requests that already resolved its path have opened it"""
+        timer = Timer(self.retire_seconds, self._unlink_retired, (path,))
+        timer.daemon = True
+        with self._lock:
+            self._retired[path] = timer
+        timer.start()
+
+    def _cancel_retire(self, path: str):
+        with self._lock:
+            timer = self._retired.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _unlink_retired(self, path: str):
+        with self._lock:
+            self._retired.pop(path, None)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # -------- Eviction --------
+    def enforce_budget(self) -> int:
+        """Evict blobs past the age limit, then least recently used ones over the size budget"""
+        self.flush_access()  # least recently played is judged on current access times
+        db = self.session_factory()
+        evicted = []
+        try:
+            stored = db.query(AudioBlob.sha256, AudioBlob.path, AudioBlob.stored_size).filter(AudioBlob.path.isnot(None))
+            if self.max_age_days:
+                cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+                for blob in stored.filter(AudioBlob.created_at < cutoff).all():
+                    if self._evict(db, blob):
+                        evicted.append(blob.path)
+            if self.max_bytes:
+                # The whole archive as every worker left it, not this worker's share
+                total = db.query(func.coalesce(func.sum(AudioBlob.stored_size), 0)).filter(AudioBlob.path.isnot(None)).scalar()
+                for blob in stored.order_by(AudioBlob.last_accessed_at).all() if total > self.max_bytes else []:
+                    if total <= self.max_bytes:
+                        break
+                    if self._evict(db, blob):
+                        evicted.append(blob.path)
+                        total -= blob.stored_size or 0
+            db.commit()
+            self._rebuild_totals(db)
+        finally:
+            db.close()
+        # Files go only once their rows no longer point at them
+        for path in evicted:
+            try:
+                os.unlink(self.absolute(path))
+            except FileNotFoundError:
+                pass
+        if evicted:
+            ARCHIVE_EVENTS.inc(len(evicted), event="evicted")
+        return len(evicted)
+
+    def _evict(self, db, blob) -> bool:
+        """Detach the blob from its file; False if another worker transcoded or evicted it first"""
+        return db.query(AudioBlob).filter(
+            AudioBlob.sha256 == blob.sha256, AudioBlob.path == blob.path
+        ).update({"path": None, "evicted_at": datetime.utcnow()}, synchronize_session=False) == 1
+
+    # -------- Playback --------
+    def open_blob(self, db, sha256: str) -> Optional[AudioBlob]:
+        """The stored blob for playback (None if unknown or evicted); marks it as recently used"""
+        blob = db.get(AudioBlob, sha256)
+        if blob is None or blob.path is None:
+            return None
+        self._touch(sha256)
+        return blob
+
+    def _touch(self, sha256: str):
+        """Note a playback in memory; the access times are written in one batch, off the request"""
+        now = time.monotonic()
+        with self._lock:
+            self._accessed[sha256] = datetime.utcnow()
+            due = now - self._accessed_flushed_at >= self.access_flush_seconds
+            if due:
+                self._accessed_flushed_at = now
+        if due:
+            try:
+                self._executor.submit(self.flush_access)
+            except RuntimeError:
+                pass  # shutting down: stop() writes them
+
+    def flush_access(self) -> int:
+        """Write the noted access times in one UPDATE batch"""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+            self._accessed_flushed_at = time.monotonic()
+        if not accessed:
+            return 0
+        db = self.session_factory()
+        try:
+            db.execute(update(AudioBlob), [
+                {"sha256": sha256, "last_accessed_at": at} for sha256, at in accessed.items()
+            ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for sha256, at in accessed.items():
+                    self._accessed.setdefault(sha256, at)
+            raise
+        finally:
+            db.close()
+        return len(accessed)
+
+    def report(self) -> dict:
+        per_hour = self.bytes_per_call_hour()
+        with self._lock:
+            return {
+                "stored_bytes": self.total_bytes,
+                "audio_hours": round(self.total_seconds / 3600, 3),
+                "bytes_per_call_hour": round(per_hour) if per_hour else None,
+                "max_bytes": self.max_bytes,
+                "max_age_days": self.max_age_days,
+                "transcoding": self.transcode_enabled,
+            }
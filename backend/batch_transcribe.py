@@ -0,0 +1,146 @@
+"""
+Batch offline transcription of call recordings.
+
+Walks a directory (or reads a manifest) of recordings and runs them through
+main.process_audio_file in a process pool with one Whisper model per worker.
+Results are streamed to a JSONL file, one line per recording as soon as it is
+done, so an interrupted run can simply be restarted: recordings that already
+have a successful line in the output are skipped.
+
+Usage (from backend/):
+    python batch_transcribe.py /data/calls --output transcripts.jsonl --workers 4
+    python batch_transcribe.py --manifest calls.txt --output transcripts.jsonl --summarize english
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import argparse
+import json
+import os
+import sys
+import time
+
+AUDIO_EXTENSIONS = {".mp3", ".m4a", ".wav", ".ogg", ".opus", ".flac", ".webm", ".mp4"}
+
+
+# -------- Input discovery --------
+def find_recordings(directory: str) -> list:
+    recordings = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                recordings.append(os.path.abspath(os.path.join(root, name)))
+    return sorted(recordings)
+
+
+def read_manifest(manifest: str) -> list:
+    """Manifest lines are either a plain path or a JSON object with a "path" key"""
+    base = os.path.dirname(os.path.abspath(manifest))
+    recordings = []
+    with open(manifest) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            recordings.append(os.path.abspath(os.path.join(base, path)))
+    return recordings
+
+
+def completed_paths(output: str) -> set:
+    """Paths that already have a successful result in the output file"""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by an interruption
+            if record.get("status") == "ok":
+                done.add(record["path"])
+    return done
+
+
+# -------- Worker --------
+def _init_worker(torch_threads: int):
+    import main
+    main.configure_torch_threads(torch_threads)
+    main.get_whisper_model()
+
+
+def _transcribe(path: str, target_language: str, summarize: bool) -> dict:
+    import main
+
+    record = {"path": path, "worker_pid": os.getpid(), "model": main.WHISPER_MODEL}
+    started = time.perf_counter()
+    try:
+        result = main.process_audio_file(path, target_language, summarize=summarize)
+        elapsed = time.perf_counter() - started
+        record.update(
+            status="ok",
+            transcript=result["transcript"],
+            summary=result["summary"],
+            language=result["language"],
+            duration_s=round(result["duration"], 2),
+            processing_s=round(elapsed, 2),
+            rtf=round(elapsed / result["duration"], 3) if result["duration"] else None,
+        )
+    except Exception as e:
+        record.update(status="error", error=str(e), processing_s=round(time.perf_counter() - started, 2))
+    record["completed_at"] = datetime.now().isoformat()
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch transcription of call recordings")
+    parser.add_argument("directory", nargs="?", help="Directory to scan for recordings")
+    parser.add_argument("--manifest", help="File listing recordings (paths or JSON lines with a path)")
+    parser.add_argument("--output", default="transcripts.jsonl")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--summarize", metavar="LANGUAGE",
+                        help="Also summarize each transcript with Claude into LANGUAGE")
+    args = parser.parse_args()
+
+    if bool(args.directory) == bool(args.manifest):
+        parser.error("pass either a directory or --manifest")
+
+    recordings = find_recordings(args.directory) if args.directory else read_manifest(args.manifest)
+    done = completed_paths(args.output)
+    pending = [path for path in dict.fromkeys(recordings) if path not in done]
+    print(f"{len(recordings)} recordings, {len(recordings) - len(pending)} already done, {len(pending)} to transcribe")
+    if not pending:
+        return
+
+    torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    ok = failed = 0
+    started = time.perf_counter()
+    audio_seconds = 0.0
+    with open(args.output, "a") as out, ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_init_worker, initargs=(torch_threads,)
+    ) as pool:
+        futures = [
+            pool.submit(_transcribe, path, args.summarize or "english", bool(args.summarize))
+            for path in pending
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if record["status"] == "ok":
+                ok += 1
+                audio_seconds += record["duration_s"]
+                print(f"[{ok + failed}/{len(pending)}] {record['path']}  "
+                      f"{record['duration_s']}s audio in {record['processing_s']}s (RTF {record['rtf']})")
+            else:
+                failed += 1
+                print(f"[{ok + failed}/{len(pending)}] {record['path']}  ERROR {record['error']}", file=sys.stderr)
+
+    wall = time.perf_counter() - started
+    print(f"Done: {ok} ok, {failed} failed, {audio_seconds:.0f}s of audio in {wall:.0f}s "
+          f"(overall RTF {wall / audio_seconds:.3f})" if audio_seconds else f"Done: {ok} ok, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
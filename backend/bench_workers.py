@@ -0,0 +1,172 @@
+"""
+Throughput and memory vs. gunicorn worker count on one node.
+
+For each worker count a fresh gunicorn (gunicorn.conf.py, preloaded model)
+is started on a throwaway database with Claude replaced by the local fake,
+the benchmark.py scenario is driven against it, and the total RSS and PSS
+(proportional set size, which splits shared copy-on-write pages between the
+processes that share them) of the master and its workers are sampled.
+
+Usage (from backend/, Linux only because memory is read from /proc):
+    python bench_workers.py --workers 1 2 4 --concurrency 8 --calls 32 --output workers.json
+"""
+
+from datetime import datetime
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmark import DEFAULT_AUDIO, _free_port, run_call, run_level
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_app():
+    """gunicorn entry point: the real app with Claude swapped for the fake"""
+    import main
+    from fake_claude import FakeClaude
+    from metrics import InstrumentedClient
+
+    main.claude = InstrumentedClient(FakeClaude(latency=float(os.getenv("BENCH_CLAUDE_LATENCY", "0.5"))))
+    return main.app
+
+
+# -------- Process memory --------
+def _children(pid: int) -> list:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def _read_kb(path: str, field: str) -> int:
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def process_memory(master_pid: int) -> dict:
+    pids = [master_pid] + _children(master_pid)
+    rss = sum(_read_kb(f"/proc/{pid}/status", "VmRSS") for pid in pids)
+    pss = sum(_read_kb(f"/proc/{pid}/smaps_rollup", "Pss") for pid in pids)
+    return {"processes": len(pids), "rss_mb": round(rss / 1024, 1), "pss_mb": round(pss / 1024, 1)}
+
+
+# -------- Server --------
+def seed_database(database_url: str, agents: int):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base, UserAgent
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([
+        UserAgent(fullname=f"Bench Agent {i}", sex="female", hospital_location="Paris", status="available", language="french")
+        for i in range(agents)
+    ])
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+def start_server(workers: int, whisper_model: str, claude_latency: float, agents: int):
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='sosai-workers-'), 'bench.db')}"
+    seed_database(database_url, agents)
+
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        WHISPER_MODEL=whisper_model,
+        WEB_CONCURRENCY=str(workers),
+        BIND=f"127.0.0.1:{port}",
+        BENCH_CLAUDE_LATENCY=str(claude_latency),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "bench_workers:create_app()"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 300
+    consecutive_ready = 0
+    # Every worker warms up on its own, so require several ready answers in a row
+    while consecutive_ready < workers * 3:
+        if time.time() > deadline or process.poll() is not None:
+            process.terminate()
+            raise RuntimeError(f"gunicorn with {workers} workers did not become ready")
+        try:
+            ready = requests.get(f"{base_url}/health/ready", timeout=2).status_code == 200
+        except requests.RequestException:
+            ready = False
+        consecutive_ready = consecutive_ready + 1 if ready else 0
+        time.sleep(0.05 if ready else 0.5)
+    return process, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput / memory vs. worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=32)
+    parser.add_argument("--audio", nargs="+", default=DEFAULT_AUDIO)
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--claude-latency", type=float, default=0.5)
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+
+    runs = []
+    for workers in args.workers:
+        process, base_url = start_server(workers, args.whisper_model, args.claude_latency, args.calls + workers + 1)
+        try:
+            idle = process_memory(process.pid)
+            for i in range(workers):
+                run_call(base_url, args.audio[0], -1 - i)
+            level = run_level(base_url, args.audio, args.concurrency, args.calls)
+            loaded = process_memory(process.pid)
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+        runs.append({"workers": workers, "memory_idle": idle, "memory_after_load": loaded, **level})
+        print(f"workers={workers:<2} {level['throughput_calls_per_s']:>7.2f} calls/s  "
+              f"p95={level['stages']['end_to_end']['p95_ms']}ms  "
+              f"RSS={loaded['rss_mb']}MB PSS={loaded['pss_mb']}MB")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(),
+            "config": {
+                "whisper_model": args.whisper_model,
+                "claude_latency_s": args.claude_latency,
+                "concurrency": args.concurrency,
+                "calls": args.calls,
+                "cpu_count": os.cpu_count(),
+            },
+            "runs": runs,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
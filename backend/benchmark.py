@@ -0,0 +1,252 @@
+"""
+Offline latency / throughput benchmark for the call pipeline.
+
+Runs the backend in-process on a throwaway SQLite database with Claude replaced
+by fake_claude.FakeClaude, then drives concurrent virtual calls through
+/start-call -> /send-message -> /process-audio -> /live-feed using the bundled
+recordings. Reports p50/p95/p99 per stage for each concurrency level and writes
+everything to JSON so runs can be compared.
+
+Usage (from backend/):
+    python benchmark.py --concurrency 1 2 4 8 --calls 16 --output bench.json
+    python benchmark.py --compare bench.json --output bench_new.json
+    python benchmark.py --url http://localhost:8000   # against a running server
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import json
+import math
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_AUDIO = [
+    os.path.join(ROOT_DIR, "test.mp3"),
+    os.path.join(ROOT_DIR, "Bakyt_145Main street.m4a"),
+]
+STAGES = ["start_call", "send_message", "process_audio", "live_feed"]
+
+
+# -------- Statistics --------
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile (values need not be sorted)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+# -------- In-process server --------
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(claude_latency: float, claude_jitter: float, whisper_model: str, agents: int) -> str:
+    """Import the app against a temporary database and serve it from a background thread"""
+    db_dir = tempfile.mkdtemp(prefix="sosai-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    os.environ["WHISPER_MODEL"] = whisper_model
+
+    import uvicorn
+    import main
+    from fake_claude import FakeClaude
+    from metrics import InstrumentedClient
+    from models import UserAgent
+
+    main.claude = InstrumentedClient(FakeClaude(latency=claude_latency, jitter=claude_jitter))
+
+    main.init_database()
+    db = main.SessionLocal()
+    db.add_all([
+        UserAgent(fullname=f"Bench Agent {i}", sex="female", hospital_location="Paris", status="available", language="french")
+        for i in range(agents)
+    ])
+    db.commit()
+    db.close()
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("Benchmark server did not start")
+
+
+# -------- Scenario --------
+def run_call(base_url: str, audio_path: str, index: int) -> dict:
+    """One virtual call; returns {stage: seconds} or {"error": ...}"""
+    timings = {}
+    http = requests.Session()
+    try:
+        started = time.perf_counter()
+        response = http.post(f"{base_url}/start-call", json={
+            "fullname": f"Bench Caller {index}",
+            "phone_number": f"+100000{index:04d}",
+            "language": "english",
+            "location": "145 Main street",
+            "sex": "male",
+        })
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+        timings["start_call"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        http.post(f"{base_url}/send-message", json={
+            "session_id": session_id,
+            "sender_type": "caller",
+            "message": "My father is unconscious and not breathing",
+        }).raise_for_status()
+        timings["send_message"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with open(audio_path, "rb") as f:
+            http.post(
+                f"{base_url}/process-audio",
+                params={"session_id": session_id, "target_language": "french"},
+                files={"audio_file": (os.path.basename(audio_path), f)},
+            ).raise_for_status()
+        timings["process_audio"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        http.get(f"{base_url}/live-feed/{session_id}").raise_for_status()
+        timings["live_feed"] = time.perf_counter() - started
+    except Exception as e:
+        timings["error"] = str(e)
+    finally:
+        http.close()
+    return timings
+
+
+def run_level(base_url: str, audio_files: list, concurrency: int, calls: int) -> dict:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda i: run_call(base_url, audio_files[i % len(audio_files)], i),
+            range(calls),
+        ))
+    wall = time.perf_counter() - started
+
+    completed = [r for r in results if "error" not in r]
+    stages = {stage: summarize([r[stage] for r in completed if stage in r]) for stage in STAGES}
+    stages["end_to_end"] = summarize([sum(r[s] for s in STAGES) for r in completed])
+    return {
+        "concurrency": concurrency,
+        "calls": calls,
+        "completed": len(completed),
+        "errors": [r["error"] for r in results if "error" in r][:5],
+        "wall_s": round(wall, 3),
+        "throughput_calls_per_s": round(len(completed) / wall, 3) if wall else 0.0,
+        "stages": stages,
+    }
+
+
+# -------- Comparison --------
+def compare(previous: dict, current: dict, threshold: float) -> list:
+    """Return human-readable regressions of p95 latency / throughput beyond threshold (fraction)"""
+    regressions = []
+    old_levels = {level["concurrency"]: level for level in previous.get("levels", [])}
+    for level in current["levels"]:
+        old = old_levels.get(level["concurrency"])
+        if not old:
+            continue
+        for stage, stats in level["stages"].items():
+            before = old["stages"].get(stage, {}).get("p95_ms")
+            if before and stats["p95_ms"] > before * (1 + threshold):
+                regressions.append(f"c={level['concurrency']} {stage} p95 {before}ms -> {stats['p95_ms']}ms")
+        before = old.get("throughput_calls_per_s")
+        if before and level["throughput_calls_per_s"] < before * (1 - threshold):
+            regressions.append(f"c={level['concurrency']} throughput {before}/s -> {level['throughput_calls_per_s']}/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline call pipeline benchmark")
+    parser.add_argument("--url", help="Benchmark an already running server instead of an in-process one")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--calls", type=int, default=16, help="Calls per concurrency level")
+    parser.add_argument("--audio", nargs="+", default=DEFAULT_AUDIO)
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--claude-latency", type=float, default=0.5, help="Fake Claude latency in seconds")
+    parser.add_argument("--claude-jitter", type=float, default=0.1)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Previous results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression (fraction)")
+    args = parser.parse_args()
+
+    total_calls = args.calls * len(args.concurrency)
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        base_url = start_local_server(args.claude_latency, args.claude_jitter, args.whisper_model, total_calls + 1)
+
+    # Warm-up call so one-off model loading is not attributed to the first level
+    run_call(base_url, args.audio[0], -1)
+
+    levels = []
+    for concurrency in args.concurrency:
+        level = run_level(base_url, args.audio, concurrency, args.calls)
+        levels.append(level)
+        e2e = level["stages"]["end_to_end"]
+        print(f"c={concurrency:<3} {level['throughput_calls_per_s']:>7.2f} calls/s  "
+              f"p50={e2e['p50_ms']}ms p95={e2e['p95_ms']}ms p99={e2e['p99_ms']}ms  "
+              f"errors={level['calls'] - level['completed']}")
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "url": args.url,
+            "whisper_model": args.whisper_model,
+            "claude_latency_s": None if args.url else args.claude_latency,
+            "claude_jitter_s": None if args.url else args.claude_jitter,
+            "audio": [os.path.basename(a) for a in args.audio],
+            "calls_per_level": args.calls,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "levels": levels,
+        "throughput_curve": [[level["concurrency"], level["throughput_calls_per_s"]] for level in levels],
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
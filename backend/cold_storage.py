@@ -0,0 +1,300 @@
+"""
+Hot/cold tiering of completed calls.
+
+Completed sessions older than a threshold are moved out of the SQLite
+database into zstd-compressed Parquet files, one directory per table and per
+call day:
+
+    <root>/<table>/day=YYYY-MM-DD/part-<first id>-<last id>.parquet
+
+Each batch is written to disk first. Then, in one short transaction, its rows
+are removed from the hot tables (and from the full-text index) and recorded
+in archived_session. That table is the catalog the read path uses to find
+the partition of a session, and stats.CallStats counts it so the dashboard
+totals do not drop. A batch interrupted before the commit is simply written
+again by the next run, and the reader ignores duplicate rows. A call's event
+log moves with it; its snapshot is dropped, since the log is complete.
+
+Run it from cron (from backend/):
+    python cold_storage.py --older-than-days 30 --batch-size 500 --output archive
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import time
+
+from sqlalchemy import JSON, func, text
+
+from metrics import Counter
+from models import (
+    ArchivedSession, AudioRecording, ChatMessage, ChatSession, ChatSessionGuide, SessionEvent, SessionSnapshot,
+    TranscriptSegment, UserCaller,
+)
+from search import unindex_messages
+
+ARCHIVED_SESSIONS = Counter("sosai_archived_sessions_total", "Completed sessions moved to cold storage")
+ARCHIVE_READS = Counter("sosai_cold_storage_reads_total", "Sessions loaded back from cold storage")
+
+# Archived table -> (model, column holding the session id). user_caller rows
+# are joined through chat_session and stored with an extra session_id column.
+TABLES = {
+    "chat_session": (ChatSession, "id"),
+    "user_caller": (UserCaller, "session_id"),
+    "chat_message": (ChatMessage, "session_id"),
+    "transcript_segment": (TranscriptSegment, "session_id"),
+    "chat_session_guide": (ChatSessionGuide, "session_id"),
+    "audio_recording": (AudioRecording, "session_id"),
+    "session_event": (SessionEvent, "session_id"),
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Cold storage needs pyarrow (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+def _row(model, row, encode_json: bool = True) -> dict:
+    values = {}
+    for column in model.__table__.columns:
+        value = getattr(row, column.key)
+        if encode_json and isinstance(column.type, JSON) and value is not None:
+            value = json.dumps(value)  # Parquet stores JSON columns as text
+        values[column.name] = value
+    return values
+
+
+def _schema(pa, model, extra_session_id: bool = False):
+    """Arrow schema from the SQLAlchemy columns, so all-NULL columns keep their type"""
+    types = {int: pa.int64(), float: pa.float64(), bool: pa.bool_(), str: pa.string(), datetime: pa.timestamp("us")}
+    fields = []
+    for column in model.__table__.columns:
+        python_type = str if isinstance(column.type, JSON) else column.type.python_type
+        fields.append(pa.field(column.name, types[python_type]))
+    if extra_session_id:
+        fields.append(pa.field("session_id", pa.int64()))
+    return pa.schema(fields)
+
+
+class ColdStorage:
+    def __init__(self, root: str, session_factory: Callable):
+        self.root = os.path.abspath(root)
+        self.session_factory = session_factory
+
+    def _partition(self, table: str, day: str) -> str:
+        return os.path.join(self.root, table, f"day={day}")
+
+    # -------- Archive --------
+    def archive(self, older_than_days: float, batch_size: int = 500, max_batches: Optional[int] = None) -> dict:
+        """Move completed sessions that ended more than `older_than_days` ago, one batch per transaction"""
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        archived = batches = 0
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            db = self.session_factory()
+            try:
+                pinned = self._pinned_sessions(db)
+                query = db.query(ChatSession).filter(
+                    ChatSession.status == "completed",
+                    ChatSession.ended_at < cutoff,
+                    ChatSession.id > last_id
+                )
+                if pinned:
+                    query = query.filter(ChatSession.id.notin_(pinned))
+                sessions = query.order_by(ChatSession.id).limit(batch_size).all()
+                if not sessions:
+                    break
+                last_id = sessions[-1].id
+                archived += self._archive_batch(db, sessions)
+                batches += 1
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+        return {"archived_sessions": archived, "batches": batches, "cutoff": cutoff.isoformat()}
+
+    def _pinned_sessions(self, db) -> set:
+        """
+        Sessions holding the highest id of an archived table. Without
+        AUTOINCREMENT SQLite hands out max(id) + 1, so deleting the newest rows
+        would let new calls reuse ids that are already in the archive.
+        """
+        pinned = {db.query(func.max(ChatSession.id)).scalar()}
+        for model in (ChatMessage, TranscriptSegment, ChatSessionGuide, AudioRecording):
+            pinned.add(db.query(model.session_id).order_by(model.id.desc()).limit(1).scalar())
+        newest_caller = db.query(func.max(UserCaller.id)).scalar()
+        pinned.update(session_id for (session_id,) in db.query(ChatSession.id).filter(ChatSession.user_caller_id == newest_caller))
+        return pinned - {None}
+
+    def _archive_batch(self, db, sessions: List[ChatSession]) -> int:
+        pa, pq = _pyarrow()
+        session_ids = [session.id for session in sessions]
+        day_of = {session.id: (session.started_at or session.ended_at).date().isoformat() for session in sessions}
+        caller_session = {session.user_caller_id: session.id for session in sessions if session.user_caller_id}
+
+        rows: Dict[str, List[dict]] = {"chat_session": [_row(ChatSession, session) for session in sessions]}
+        rows["user_caller"] = [
+            dict(_row(UserCaller, caller), session_id=caller_session[caller.id])
+            for caller in db.query(UserCaller).filter(UserCaller.id.in_(list(caller_session)))
+        ]
+        for table in ("chat_message", "transcript_segment", "chat_session_guide", "audio_recording", "session_event"):
+            model = TABLES[table][0]
+            rows[table] = [_row(model, row) for row in db.query(model).filter(model.session_id.in_(session_ids))]
+
+        # 1. Files first: nothing is deleted until the batch is safely on disk
+        name = f"part-{session_ids[0]}-{session_ids[-1]}.parquet"
+        for table, (model, key) in TABLES.items():
+            by_day: Dict[str, List[dict]] = {}
+            for row in rows[table]:
+                by_day.setdefault(day_of[row[key]], []).append(row)
+            schema = _schema(pa, model, extra_session_id=table == "user_caller")
+            for day, day_rows in by_day.items():
+                day_rows.sort(key=lambda row: (row[key], row["id"]))  # tight row-group stats for session lookups
+                directory = self._partition(table, day)
+                os.makedirs(directory, exist_ok=True)
+                partial = os.path.join(directory, name + ".part")
+                pq.write_table(pa.Table.from_pylist(day_rows, schema=schema), partial, compression="zstd")
+                with open(partial, "rb+") as f:
+                    os.fsync(f.fileno())
+                os.replace(partial, os.path.join(directory, name))
+
+        # 2. One transaction: forget the rows in the hot database and catalog them
+        unindex_messages(db, [(row["id"], row["message"]) for row in rows["chat_message"]])
+        for table in ("session_event", "transcript_segment", "audio_recording", "chat_session_guide", "chat_message"):
+            model = TABLES[table][0]
+            db.query(model).filter(model.session_id.in_(session_ids)).delete(synchronize_session=False)
+        db.query(SessionSnapshot).filter(SessionSnapshot.session_id.in_(session_ids)).delete(synchronize_session=False)
+        db.query(ChatSession).filter(ChatSession.id.in_(session_ids)).delete(synchronize_session=False)
+        still_used = {
+            caller_id for (caller_id,) in
+            db.query(ChatSession.user_caller_id).filter(ChatSession.user_caller_id.in_(list(caller_session))).distinct()
+        }
+        db.query(UserCaller).filter(UserCaller.id.in_(list(set(caller_session) - still_used))).delete(synchronize_session=False)
+
+        messages_per_session: Dict[int, int] = {}
+        for row in rows["chat_message"]:
+            messages_per_session[row["session_id"]] = messages_per_session.get(row["session_id"], 0) + 1
+        now = datetime.utcnow()
+        db.add_all([
+            ArchivedSession(
+                session_id=session.id,
+                day=day_of[session.id],
+                user_agent_id=session.user_agent_id,
+                started_at=session.started_at,
+                ended_at=session.ended_at,
+                handle_seconds=(session.ended_at - session.started_at).total_seconds() if session.started_at else None,
+                message_count=messages_per_session.get(session.id, 0),
+                archived_at=now
+            )
+            for session in sessions
+        ])
+        db.commit()
+        ARCHIVED_SESSIONS.inc(len(sessions))
+        return len(sessions)
+
+    # -------- Read path --------
+    def load_session(self, db, session_id: int) -> Optional[dict]:
+        """An archived session with all of its rows, or None if it was never archived"""
+        entry = db.get(ArchivedSession, session_id)
+        if entry is None:
+            return None
+        pa, pq = _pyarrow()
+        tables = {}
+        for table, (model, key) in TABLES.items():
+            directory = self._partition(table, entry.day)
+            found: Dict[int, dict] = {}  # by primary key: a re-run batch may have written a row twice
+            for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+                if name.endswith(".parquet"):
+                    for row in pq.read_table(os.path.join(directory, name), filters=[(key, "=", session_id)]).to_pylist():
+                        found[row["id"]] = row
+            json_columns = [column.name for column in model.__table__.columns if isinstance(column.type, JSON)]
+            for row in found.values():
+                for column in json_columns:
+                    row[column] = json.loads(row[column]) if row[column] is not None else None
+            tables[table] = [found[key] for key in sorted(found)]
+        ARCHIVE_READS.inc()
+        return _session_record(tables, storage="archive", archived_at=entry.archived_at)
+
+    def report(self, db) -> dict:
+        count, oldest, newest = db.query(
+            func.count(ArchivedSession.session_id), func.min(ArchivedSession.day), func.max(ArchivedSession.day)
+        ).one()
+        size = 0
+        for directory, _, files in os.walk(self.root):
+            size += sum(os.path.getsize(os.path.join(directory, name)) for name in files if name.endswith(".parquet"))
+        return {"archived_sessions": count, "oldest_day": oldest, "newest_day": newest, "bytes": size, "root": self.root}
+
+
+def load_hot_session(db, session_id: int) -> Optional[dict]:
+    """The same record as ColdStorage.load_session, read from the live tables"""
+    session = db.get(ChatSession, session_id)
+    if session is None:
+        return None
+    tables = {"chat_session": [_row(ChatSession, session)]}
+    caller = db.get(UserCaller, session.user_caller_id) if session.user_caller_id else None
+    tables["user_caller"] = [_row(UserCaller, caller)] if caller else []
+    for table in ("chat_message", "transcript_segment", "chat_session_guide", "audio_recording", "session_event"):
+        model = TABLES[table][0]
+        tables[table] = [
+            _row(model, row, encode_json=False)
+            for row in db.query(model).filter(model.session_id == session_id).order_by(model.id)
+        ]
+    return _session_record(tables, storage="hot")
+
+
+def _session_record(tables: Dict[str, List[dict]], storage: str, archived_at: Optional[datetime] = None) -> dict:
+    session = dict(tables["chat_session"][0]) if tables["chat_session"] else {}
+    caller = tables["user_caller"][0] if tables["user_caller"] else None
+    guide = tables["chat_session_guide"][0] if tables["chat_session_guide"] else None
+    return {
+        "session": session,
+        "caller": {k: v for k, v in caller.items() if k != "session_id"} if caller else None,
+        "messages": sorted(tables["chat_message"], key=lambda m: (m["created_at"] or datetime.min, m["id"])),
+        "segments": sorted(tables["transcript_segment"], key=lambda s: (s["message_id"] or 0, s["start_time"] or 0.0)),
+        "guide": guide,
+        "recordings": [dict(r, url=f"/audio/{r['sha256']}") for r in tables["audio_recording"]],
+        "events": sorted(tables["session_event"], key=lambda e: e["id"]),
+        "storage": storage,
+        "archived_at": archived_at,
+    }
+
+
+# -------- CLI --------
+def main():
+    parser = argparse.ArgumentParser(description="Move completed calls from the hot database to Parquet cold storage")
+    parser.add_argument("--older-than-days", type=float, default=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")))
+    parser.add_argument("--batch-size", type=int, default=500, help="Sessions per file and per delete transaction")
+    parser.add_argument("--max-batches", type=int, default=None)
+    parser.add_argument("--output", default=os.getenv("COLD_STORAGE_DIR", "archive"))
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./emergency_call.db"))
+    parser.add_argument("--vacuum", action="store_true", help="Give freed pages back to the filesystem afterwards")
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(bind=engine, tables=[
+        ArchivedSession.__table__, SessionEvent.__table__, SessionSnapshot.__table__
+    ])
+    storage = ColdStorage(args.output, sessionmaker(bind=engine))
+    started = time.perf_counter()
+    result = storage.archive(args.older_than_days, args.batch_size, args.max_batches)
+    print(f"Archived {result['archived_sessions']} session(s) in {result['batches']} batch(es) "
+          f"to {storage.root} in {time.perf_counter() - started:.1f}s")
+    if args.vacuum and result["archived_sessions"] and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+        print("Database vacuumed")
+
+
+if __name__ == "__main__":
+    main()
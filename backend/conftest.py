@@ -0,0 +1,27 @@
+"""Shared fixtures: the full app module on a throwaway database"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    """main.py imported against a temporary SQLite file (skipped where Whisper is not installed)"""
+    pytest.importorskip("whisper")
+    root = tmp_path_factory.mktemp("app")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{root / 'app.db'}",
+        "AUDIO_ARCHIVE_DIR": str(root / "uploads"),
+        "COLD_STORAGE_DIR": str(root / "archive"),
+        "ANTHROPIC_API_KEY": "",  # never reach the real API from tests
+    })
+    # Loaded by path: the repository root has an unrelated main.py of its own
+    spec = importlib.util.spec_from_file_location("main", os.path.join(os.path.dirname(__file__), "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["main"] = module
+    spec.loader.exec_module(module)
+    module.init_database()
+    return module
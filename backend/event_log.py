@@ -0,0 +1,277 @@
+"""
+Append-only event log of each call.
+
+Every change to a session is appended to session_event in the same
+transaction as the write it describes: call_started, agent_assigned,
+message_added, status_changed, suggestions_updated and call_ended. Events are
+never updated. chat_session.status and chat_session_guide are still
+maintained as read models for the existing queries, but their history now
+lives in the log.
+
+The current state of a session is its latest snapshot (session_snapshot)
+plus a replay of the few events after it. A new snapshot is saved whenever a
+read had to replay at least SNAPSHOT_EVERY events, and when a call ends.
+The whole log can be replayed to rebuild read models; `python event_log.py
+stats` recomputes the dashboard aggregates from it.
+
+Events are ordered by their id, i.e. by when they were persisted. A message
+held in the write-behind queue (session_store) may therefore follow the
+status change it triggered; its payload keeps its own created_at.
+"""
+
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+import argparse
+import copy
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models import ChatMessage, ChatSession, ChatSessionGuide, SessionEvent, SessionSnapshot, UserAgent, UserCaller
+
+SNAPSHOT_EVERY = int(os.getenv("EVENT_SNAPSHOT_EVERY", "50"))
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+# -------- Writes --------
+def event_row(session_id: int, type: str, payload: dict, at: Optional[datetime] = None) -> dict:
+    return {"session_id": session_id, "type": type, "payload": _jsonable(payload), "created_at": at or datetime.utcnow()}
+
+
+def append(db: Session, session_id: int, type: str, payload: dict, at: Optional[datetime] = None):
+    """Append one event inside the caller's transaction"""
+    db.execute(insert(SessionEvent), [event_row(session_id, type, payload, at)])
+
+
+def append_rows(db: Session, rows: List[dict]):
+    """Append several event_row()s in one multi-row INSERT"""
+    if rows:
+        db.execute(insert(SessionEvent), rows)
+
+
+def message_event(message) -> dict:
+    """event_row for a ChatMessage that has been flushed (it needs its id)"""
+    return event_row(message.session_id, "message_added", {
+        "message_id": message.id,
+        "sender_type": message.sender_type,
+        "message": message.message,
+        "confidence_score": message.confidence_score,
+        "unresolved": message.unresolved,
+        "created_at": message.created_at,
+    }, at=message.created_at)
+
+
+# -------- State --------
+def empty_state(session_id: int) -> dict:
+    return {
+        "session_id": session_id,
+        "status": None,
+        "caller": None,
+        "agent": None,
+        "started_at": None,
+        "ended_at": None,
+        "messages": [],
+        "question_suggestions": None,
+        "department_suggestions": None,
+    }
+
+
+def apply(state: dict, type: str, payload: dict, at: Optional[str] = None) -> dict:
+    """Fold one event into a session state (in place); unknown event types are ignored"""
+    if type == "call_started":
+        state.update(status=payload.get("status", "ongoing"), caller=payload.get("caller"), started_at=at)
+    elif type == "agent_assigned":
+        state["agent"] = payload
+    elif type == "message_added":
+        state["messages"].append(payload)
+    elif type == "status_changed":
+        state["status"] = payload["status"]
+    elif type == "suggestions_updated":
+        state["question_suggestions"] = payload.get("question_suggestions")
+        state["department_suggestions"] = payload.get("department_suggestions")
+    elif type == "call_ended":
+        state.update(status="completed", ended_at=payload.get("ended_at") or at)
+    return state
+
+
+def load_state(db: Session, session_id: int) -> Tuple[Optional[dict], int, Optional[int]]:
+    """(state, events replayed, last event id); state is None when the session has no events"""
+    snapshot = db.get(SessionSnapshot, session_id)
+    last_id = snapshot.last_event_id if snapshot else 0
+    state = copy.deepcopy(snapshot.state) if snapshot else empty_state(session_id)
+    events = (
+        db.query(SessionEvent)
+        .filter(SessionEvent.session_id == session_id, SessionEvent.id > last_id)
+        .order_by(SessionEvent.id)
+        .all()
+    )
+    if snapshot is None and not events:
+        return None, 0, None
+    for event in events:
+        apply(state, event.type, event.payload or {}, event.created_at.isoformat() if event.created_at else None)
+        last_id = event.id
+    return state, len(events), last_id
+
+
+def save_snapshot(db: Session, session_id: int, state: dict, last_event_id: int):
+    snapshot = db.get(SessionSnapshot, session_id)
+    if snapshot is None:
+        db.add(SessionSnapshot(session_id=session_id, last_event_id=last_event_id, state=state))
+    elif last_event_id > snapshot.last_event_id:
+        snapshot.last_event_id, snapshot.state, snapshot.created_at = last_event_id, state, datetime.utcnow()
+
+
+def snapshot_session(db: Session, session_id: int, force: bool = False) -> Optional[dict]:
+    """Current state, saving a snapshot (uncommitted) when the replay was long or `force` is set"""
+    state, replayed, last_id = load_state(db, session_id)
+    if state is not None and replayed and (force or replayed >= SNAPSHOT_EVERY):
+        save_snapshot(db, session_id, state, last_id)
+    return state
+
+
+# -------- Replay --------
+def replay(db: Session, batch_size: int = 1000) -> Iterable[SessionEvent]:
+    """Every event in append order"""
+    last_id = 0
+    while True:
+        batch = db.query(SessionEvent).filter(SessionEvent.id > last_id).order_by(SessionEvent.id).limit(batch_size).all()
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
+
+
+def project_stats(events: Iterable[SessionEvent]) -> dict:
+    """Dashboard aggregates (see stats.CallStats) rebuilt from the log alone"""
+    status = {}
+    handled, handle_time = 0, 0.0
+    for event in events:
+        payload = event.payload or {}
+        if event.type == "call_started":
+            status[event.session_id] = payload.get("status", "ongoing")
+        elif event.type == "status_changed":
+            status[event.session_id] = payload["status"]
+        elif event.type == "call_ended":
+            status[event.session_id] = "completed"
+            handled += 1
+            if payload.get("handle_seconds") is not None:
+                handle_time += payload["handle_seconds"]
+    by_status = {}
+    for value in status.values():
+        by_status[value] = by_status.get(value, 0) + 1
+    return {"sessions_by_status": by_status, "handled_calls": handled, "handle_time_total": round(handle_time, 3)}
+
+
+# -------- Backfill --------
+def init_event_log(session_factory, batch_size: int = 500):
+    """Give sessions created before the log existed a synthetic history, once"""
+    db = session_factory()
+    try:
+        if db.query(SessionEvent.id).first() is not None or db.query(ChatSession.id).first() is None:
+            return
+        last_id = backfilled = 0
+        while True:
+            sessions = db.query(ChatSession).filter(ChatSession.id > last_id).order_by(ChatSession.id).limit(batch_size).all()
+            if not sessions:
+                break
+            last_id = sessions[-1].id
+            ids = [s.id for s in sessions]
+            callers = {c.id: c for c in db.query(UserCaller).filter(UserCaller.id.in_([s.user_caller_id for s in sessions]))}
+            agents = {a.id: a for a in db.query(UserAgent).filter(UserAgent.id.in_([s.user_agent_id for s in sessions]))}
+            messages = {}
+            for message in db.query(ChatMessage).filter(ChatMessage.session_id.in_(ids)).order_by(ChatMessage.created_at, ChatMessage.id):
+                messages.setdefault(message.session_id, []).append(message)
+            guides = {g.session_id: g for g in db.query(ChatSessionGuide).filter(ChatSessionGuide.session_id.in_(ids))}
+            rows = []
+            for session in sessions:
+                rows.extend(session_history(
+                    session, callers.get(session.user_caller_id), agents.get(session.user_agent_id),
+                    messages.get(session.id, []), guides.get(session.id)
+                ))
+            append_rows(db, rows)
+            db.commit()
+            backfilled += len(sessions)
+        print(f"Event log backfilled for {backfilled} existing session(s)")
+    finally:
+        db.close()
+
+
+def session_history(session: ChatSession, caller, agent, messages: List[ChatMessage], guide) -> List[dict]:
+    """Synthetic events reproducing a session's current rows"""
+    started_at = session.started_at or datetime.utcnow()
+    rows = [
+        event_row(session.id, "call_started", {"status": "ongoing", "caller": caller_payload(caller)}, at=started_at),
+        event_row(session.id, "agent_assigned", agent_payload(agent, session.user_agent_id), at=started_at),
+    ]
+    rows += [message_event(message) for message in messages]
+    if guide is not None:
+        rows.append(event_row(session.id, "suggestions_updated", {
+            "question_suggestions": guide.question_suggestions,
+            "department_suggestions": guide.department_suggestions,
+        }))
+    if session.status == "completed":
+        handle_seconds = (session.ended_at - started_at).total_seconds() if session.ended_at else None
+        rows.append(event_row(session.id, "call_ended", {"ended_at": session.ended_at, "handle_seconds": handle_seconds},
+                              at=session.ended_at))
+    elif session.status and session.status != "ongoing":
+        rows.append(event_row(session.id, "status_changed", {"status": session.status}))
+    return rows
+
+
+def caller_payload(caller) -> Optional[dict]:
+    if caller is None:
+        return None
+    return {
+        "id": caller.id, "fullname": caller.fullname, "language": caller.language,
+        "location": caller.location, "phone_number": caller.phone_number, "sex": caller.sex,
+    }
+
+
+def agent_payload(agent, agent_id: Optional[int] = None, distance_km: Optional[float] = None) -> dict:
+    if agent is None:
+        return {"agent_id": agent_id}
+    return {
+        "agent_id": agent.id, "fullname": agent.fullname, "language": agent.language,
+        "hospital_location": agent.hospital_location, "distance_km": distance_km,
+    }
+
+
+# -------- CLI --------
+def main():
+    parser = argparse.ArgumentParser(description="Replay the session event log")
+    parser.add_argument("command", choices=["stats", "snapshot"],
+                        help="stats: aggregates rebuilt from the log; snapshot: snapshot every session")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./emergency_call.db"))
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    db = sessionmaker(bind=create_engine(args.database_url))()
+    try:
+        if args.command == "stats":
+            print(project_stats(replay(db)))
+        else:
+            session_ids = [sid for (sid,) in db.query(SessionEvent.session_id).distinct()]
+            for i, session_id in enumerate(session_ids, 1):
+                snapshot_session(db, session_id, force=True)
+                if i % 500 == 0:
+                    db.commit()
+            db.commit()
+            print(f"Snapshots written for {len(session_ids)} session(s)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Local stand-in for the Anthropic client, used by the benchmark and simulation
+scripts so the call pipeline can be exercised offline with a controllable
+Claude latency.
+"""
+
+from types import SimpleNamespace
+import json
+import random
+import time
+
+
+class _FakeMessages:
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+
+    def create(self, model: str, max_tokens: int, messages: list, tools: list = None, system=None, **kwargs):
+        self.calls += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        prompt = messages[-1]["content"]
+        if not isinstance(prompt, str):
+            prompt = " ".join(block.get("text", "") for block in prompt if isinstance(block, dict))
+        if isinstance(system, list):
+            system = " ".join(block.get("text", "") for block in system)
+        instructions = system or ""
+
+        if tools:
+            name = (kwargs.get("tool_choice") or {}).get("name") or tools[0]["name"]
+            content = [SimpleNamespace(
+                type="tool_use", id=f"toolu_{self.calls}", name=name, input=self._tool_input(name, prompt)
+            )]
+            output_text = json.dumps(content[0].input)
+        else:
+            output_text = self._text(instructions + prompt)
+            content = [SimpleNamespace(type="text", text=output_text)]
+
+        cached = len(instructions) // 4 if self.calls > 1 else 0
+        usage = SimpleNamespace(
+            input_tokens=len(prompt) // 4 + 1,
+            output_tokens=len(output_text) // 4 + 1,
+            cache_read_input_tokens=cached,
+            cache_creation_input_tokens=len(instructions) // 4 - cached,
+        )
+        return SimpleNamespace(content=content, usage=usage, model=model, stop_reason="end_turn")
+
+    @staticmethod
+    def _tool_input(name: str, prompt: str) -> dict:
+        if name == "record_translations":
+            payload = json.loads(prompt[prompt.index("["):])
+            return {"translations": [{"id": item["id"], "text": f"[fr] {item['text']}"} for item in payload]}
+        if name == "record_summary":
+            return {"items": ["Caller reports an emergency", "Address was given", "Ambulance requested"]}
+        if name == "record_agent_suggestions":
+            return {"items": [
+                {"category": "reassurance", "suggestion": "Help is on the way.", "priority": 9, "reasoning": "Calm the caller"},
+                {"category": "location", "suggestion": "Can you confirm the address?", "priority": 8, "reasoning": "Dispatch needs it"},
+            ]}
+        if name == "record_recommendations":
+            return {"items": [
+                {"type": "advice", "priority": "high", "title": "Add Location", "content": "Include the street address.", "confidence": 90},
+                {"type": "protocol", "priority": "medium", "title": "Scene Safety", "content": "Confirm the scene is safe.", "confidence": 80},
+            ]}
+        if name.endswith("_fixes"):
+            return {"fixes": []}
+        return {}
+
+    @staticmethod
+    def _text(prompt: str) -> str:
+        return "- Caller reports an emergency\n- Address was given\n- Ambulance requested"
+
+
+class _FakeModels:
+    def list(self, **kwargs):
+        return []
+
+
+class FakeClaude:
+    """Duck-typed replacement for anthropic.Anthropic with configurable latency (seconds)"""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1):
+        self.messages = _FakeMessages(latency, jitter)
+        self.models = _FakeModels()
@@ -0,0 +1,292 @@
+"""
+Offline geocoding and nearest-agent routing.
+
+Free-text locations (caller.location, agent.hospital_location) are resolved
+against a local gazetteer CSV (name, lat, lon, kind), with no network access.
+Results are cached per normalized string. Available agents are kept in a
+grid index (fixed-size lat/lon cells) per language. A nearest-neighbour query
+only scans rings of cells around the caller until no closer cell can exist,
+so routing cost does not grow with the size of the agent pool. Longitude cells
+wrap around at ±180°, so the antimeridian is not a search boundary. Hospitals
+from the gazetteer are kept in the same kind of index.
+"""
+
+from functools import lru_cache
+from itertools import islice
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import csv
+import math
+import re
+import unicodedata
+
+EARTH_RADIUS_KM = 6371.0
+CELL_DEGREES = 0.5
+MAX_RINGS = 60  # beyond ~30 degrees the index falls back to a full scan
+
+Point = Tuple[float, float]
+
+_COORDINATES_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[,; ]\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+def haversine_km(a: Point, b: Point) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and punctuation: "Hôpital Saint-Louis" -> "hopital saint louis" """
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+# -------- Gazetteer --------
+class Gazetteer:
+    def __init__(self, places: Iterable[dict] = ()):
+        self.places: Dict[str, dict] = {}  # normalized name -> {"name", "lat", "lon", "kind"}
+        for place in places:
+            self.places[normalize(place["name"])] = place
+        self.max_words = max((len(key.split()) for key in self.places), default=0)
+        self.geocode = lru_cache(maxsize=50000)(self._geocode)
+
+    @classmethod
+    def load(cls, path: str) -> "Gazetteer":
+        try:
+            with open(path, newline="", encoding="utf-8") as f:
+                places = [
+                    {"name": row["name"], "lat": float(row["lat"]), "lon": float(row["lon"]),
+                     "kind": (row.get("kind") or "place").strip()}
+                    for row in csv.DictReader(f)
+                ]
+        except FileNotFoundError:
+            print(f"Gazetteer {path} not found, geocoding disabled")
+            places = []
+        print(f"Gazetteer loaded: {len(places)} places")
+        return cls(places)
+
+    def _geocode(self, location: str) -> Optional[Point]:
+        """Coordinates for "lat, lon" or the longest gazetteer name found in the text"""
+        if not location:
+            return None
+        match = _COORDINATES_RE.match(location)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return lat, lon
+        words = normalize(location).split()
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            # Later words first: in "12 rue de Rivoli, Paris" the city comes last
+            for start in range(len(words) - size, -1, -1):
+                place = self.places.get(" ".join(words[start:start + size]))
+                if place:
+                    return place["lat"], place["lon"]
+        return None
+
+    def of_kind(self, kind: str) -> List[dict]:
+        return [place for place in self.places.values() if place["kind"] == kind]
+
+
+# -------- Spatial index --------
+class GridIndex:
+    """Points bucketed into CELL_DEGREES cells; supports O(1) add/remove and ring-search nearest queries"""
+
+    def __init__(self, cell_degrees: float = CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.columns = math.ceil(360 / cell_degrees)  # longitude cells per full turn
+        self.points: Dict[object, Point] = {}
+        self.cells: Dict[Tuple[int, int], Set[object]] = {}
+
+    def _cell(self, point: Point) -> Tuple[int, int]:
+        return math.floor(point[0] / self.cell_degrees), math.floor(point[1] / self.cell_degrees) % self.columns
+
+    def __len__(self):
+        return len(self.points)
+
+    def add(self, key, point: Point):
+        self.remove(key)
+        self.points[key] = point
+        self.cells.setdefault(self._cell(point), set()).add(key)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is not None:
+            cell = self._cell(point)
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def _ring(self, center: Tuple[int, int], r: int):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, (cj + dj) % self.columns
+            yield ci + r, (cj + dj) % self.columns
+        for di in range(-r + 1, r):
+            yield ci + di, (cj - r) % self.columns
+            yield ci + di, (cj + r) % self.columns
+
+    def nearest(self, point: Point, k: int = 1, accept: Optional[Callable] = None) -> List[Tuple[float, object]]:
+        """Up to k (distance_km, key) pairs, closest first, optionally filtered by accept(key)"""
+        if not self.points:
+            return []
+        center = self._cell(point)
+        found: List[Tuple[float, object]] = []
+        seen: Set[Tuple[int, int]] = set()  # wide rings overlap themselves once they wrap
+        for r in range(MAX_RINGS + 1):
+            for cell in self._ring(center, r):
+                if cell in seen:
+                    continue
+                seen.add(cell)
+                for key in self.cells.get(cell, ()):
+                    if accept is None or accept(key):
+                        found.append((haversine_km(point, self.points[key]), key))
+            found.sort(key=lambda item: item[0])
+            del found[k:]
+            # Anything outside the rings searched so far is at least r cells away
+            lat_edge = min(89.0, abs(point[0]) + (r + 1) * self.cell_degrees)
+            reach_km = r * self.cell_degrees * 111.2 * math.cos(math.radians(lat_edge))
+            if len(found) == k and found[-1][0] <= reach_km:
+                return found
+        # Sparse index or very distant points: scan everything
+        found = [
+            (haversine_km(point, p), key) for key, p in self.points.items()
+            if accept is None or accept(key)
+        ]
+        found.sort(key=lambda item: item[0])
+        return found[:k]
+
+
+# -------- Agent routing --------
+def _language(language: Optional[str]) -> str:
+    return normalize(language or "") or "unknown"
+
+
+class AgentDirectory:
+    """
+    Available agents indexed by language and hospital location. Kept in sync
+    by the endpoints that change agent status; the database stays the source
+    of truth, so a stale entry only costs a retry when claiming the agent.
+    Each process only sees its own updates: with several workers, start() a
+    periodic reload so agents freed by another worker become routable here.
+    """
+
+    def __init__(self, gazetteer: Gazetteer):
+        self.gazetteer = gazetteer
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.by_language: Dict[str, GridIndex] = {}
+        self.unlocated: Dict[str, Set[int]] = {}  # agents whose hospital could not be geocoded
+        self.languages: Dict[int, str] = {}
+
+    def rebuild(self, agents: Iterable):
+        with self._lock:
+            self._reset()
+            for agent in agents:
+                self._update(agent.id, agent.status, agent.language, agent.hospital_location)
+
+    def start(self, load: Callable[[], Iterable], refresh_seconds: float):
+        """Rebuild from `load()` (the available agents) every `refresh_seconds`"""
+        if refresh_seconds and self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, args=(load, refresh_seconds), name="agent-directory", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, load, refresh_seconds: float):
+        while not self._stop.wait(refresh_seconds):
+            try:
+                self.rebuild(load())
+            except Exception as e:
+                print(f"Agent directory refresh failed: {e}")
+
+    def update(self, agent):
+        """Record the agent's current status (only available agents are routable)"""
+        with self._lock:
+            self._update(agent.id, agent.status, agent.language, agent.hospital_location)
+
+    def _update(self, agent_id: int, status: str, language: str, hospital_location: str):
+        self._discard(agent_id)
+        if status != "available":
+            return
+        language = _language(language)
+        self.languages[agent_id] = language
+        point = self.gazetteer.geocode(hospital_location or "")
+        if point is None:
+            self.unlocated.setdefault(language, set()).add(agent_id)
+        else:
+            self.by_language.setdefault(language, GridIndex()).add(agent_id, point)
+
+    def _discard(self, agent_id: int):
+        language = self.languages.pop(agent_id, None)
+        if language is None:
+            return
+        if language in self.by_language:
+            self.by_language[language].remove(agent_id)
+        self.unlocated.get(language, set()).discard(agent_id)
+
+    def discard(self, agent_id: int):
+        with self._lock:
+            self._discard(agent_id)
+
+    def available(self) -> int:
+        with self._lock:
+            return len(self.languages)
+
+    def _nearest_in(self, languages: Iterable[str], point: Optional[Point], limit: int) -> List[Tuple[int, Optional[float]]]:
+        found = []
+        for language in languages:
+            index = self.by_language.get(language)
+            if index is not None:
+                if point is None:
+                    found.extend((None, agent_id) for agent_id in islice(index.points, limit))
+                else:
+                    found.extend(index.nearest(point, limit))
+            found.extend((None, agent_id) for agent_id in islice(self.unlocated.get(language, ()), limit))
+        found.sort(key=lambda item: (item[0] is None, item[0] or 0.0))
+        return [(agent_id, None if d is None else round(d, 1)) for d, agent_id in found[:limit]]
+
+    def candidates(self, location: str, language: str, limit: int = 3) -> List[Tuple[int, Optional[float]]]:
+        """
+        Up to `limit` (agent_id, distance_km) pairs: the nearest agents speaking
+        the caller's language first, then the nearest of any other language.
+        Distance is None when either side could not be geocoded.
+        """
+        point = self.gazetteer.geocode(location or "")
+        wanted = _language(language)
+        with self._lock:
+            result = self._nearest_in([wanted], point, limit)
+            if len(result) < limit:
+                others = set(self.languages.values()) - {wanted}
+                result += self._nearest_in(others, point, limit - len(result))
+            return result
+
+
+class HospitalIndex:
+    def __init__(self, gazetteer: Gazetteer):
+        self.gazetteer = gazetteer
+        self.hospitals = gazetteer.of_kind("hospital")
+        self.index = GridIndex()
+        for i, hospital in enumerate(self.hospitals):
+            self.index.add(i, (hospital["lat"], hospital["lon"]))
+
+    def nearest(self, location: str, k: int = 3) -> Optional[List[dict]]:
+        """Closest hospitals to a free-text location, or None if it cannot be geocoded"""
+        point = self.gazetteer.geocode(location or "")
+        if point is None:
+            return None
+        return [
+            dict(self.hospitals[i], distance_km=round(distance, 1))
+            for distance, i in self.index.nearest(point, k)
+        ]
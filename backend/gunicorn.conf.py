@@ -0,0 +1,41 @@
+"""
+Gunicorn configuration for running the backend with several worker processes.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app (and the Whisper weights) are loaded once in the master process and
+then forked, so all workers share the model pages copy-on-write instead of
+each loading its own copy. Each worker gets an equal share of the cores for
+torch's thread pool.
+
+Environment:
+    WEB_CONCURRENCY   number of worker processes (default 1)
+    TORCH_THREADS     torch threads per worker (default cpu_count // workers)
+    BIND              listen address (default 0.0.0.0:8000)
+"""
+
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+
+torch_threads = int(os.getenv("TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked
+    import main
+    main.preload_shared_model()
+    # Keep the garbage collector from touching (and so copying) the inherited objects
+    gc.freeze()
+    server.log.info(f"Whisper model preloaded; {workers} workers x {torch_threads} torch threads")
+
+
+def post_fork(server, worker):
+    import main
+    main.configure_torch_threads(torch_threads)
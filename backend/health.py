@@ -0,0 +1,47 @@
+"""
+Probe helpers for the liveness / readiness endpoints.
+
+Every dependency check runs with a hard timeout, and the expensive ones
+(e.g. a round trip to the Claude API) are cached for a few seconds so
+frequent orchestrator probes stay cheap.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from threading import Lock
+from typing import Callable
+import time
+
+_probe_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="health-probe")
+
+
+def run_with_timeout(check: Callable[[], dict], timeout: float) -> dict:
+    """Run a probe returning {"status": ...}; a timeout or exception becomes an unhealthy result"""
+    started = time.perf_counter()
+    future = _probe_pool.submit(check)
+    try:
+        result = future.result(timeout=timeout)
+    except FutureTimeout:
+        result = {"status": "unhealthy", "error": f"timed out after {timeout}s"}
+    except Exception as e:
+        result = {"status": "unhealthy", "error": str(e)}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+class CachedProbe:
+    """Caches the result of a probe for `ttl` seconds"""
+
+    def __init__(self, check: Callable[[], dict], ttl: float, timeout: float):
+        self.check = check
+        self.ttl = ttl
+        self.timeout = timeout
+        self._result = None
+        self._checked_at = 0.0
+        self._lock = Lock()
+
+    def __call__(self) -> dict:
+        with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at > self.ttl:
+                self._result = run_with_timeout(self.check, self.timeout)
+                self._checked_at = time.monotonic()
+            return dict(self._result, cached_for_s=round(time.monotonic() - self._checked_at, 1))
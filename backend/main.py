@@ -15,6 +15,9 @@ def read_root():
     return {"message": "Emergency Call App Backend is running"}
 """
 
+import time
+_import_started = time.perf_counter()
+
 from typing import List, Optional
 
 from models import ChatSessionGuide
@@ -24,20 +27,53 @@ from models import ChatMessage
 
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
-from sqlalchemy import create_engine
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import create_engine, text, insert
 from sqlalchemy.orm import sessionmaker, Session
-from models import Base, UserCaller, UserAgent, ChatSession
-from pydantic import BaseModel
+from models import Base, UserCaller, UserAgent, ChatSession, TranscriptSegment, AudioRecording, SessionEvent
+from pydantic import BaseModel, Field
 import random
-import whisper
 import os
-from anthropic import Anthropic
 from dotenv import load_dotenv
 from typing import Union, List
 import tempfile
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import math
+import mimetypes
+import secrets
+from translation import translate_texts, translation_cache
+from fastapi import Request
+from fastapi.responses import PlainTextResponse, JSONResponse, FileResponse, Response
+from metrics import (
+    InstrumentedClient, REQUEST_DURATION, INFLIGHT_REQUESTS, ACTIVE_SESSIONS,
+    begin_trace, end_trace, new_trace_id, render_metrics, stage, inflight, INFLIGHT_JOBS,
+    STARTUP_PHASE, TRANSCRIPTS_TRIMMED, TRANSCRIPT_TOKENS_DROPPED
+)
+from health import CachedProbe, run_with_timeout
+from search import init_search_index, index_messages, search_messages
+from stats import CallStats
+from admission import (
+    AdmissionController, Overloaded, TokenBucket,
+    PRIORITY_EMERGENCY, PRIORITY_ONGOING, PRIORITY_TOOL
+)
+from starlette.concurrency import run_in_threadpool
+from prompts import cached_system, trim_transcript
+from structured import StructuredOutputError, generate_items, items_tool
+from geo import AgentDirectory, Gazetteer, HospitalIndex
+from session_store import SessionStore
+from protocols import ProtocolIndex, protocol_context
+from audio_archive import AudioArchive
+from cold_storage import ColdStorage, load_hot_session
+from profiling import MemoryTracer, ProfilerBusy, SamplingProfiler, SlowRequestLog
+import event_log
+from sharding import next_session_id
+import threading
+import contextvars
+import copy
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv(dotenv_path="../.env")  # Load .env from parent directory
 
@@ -45,21 +81,128 @@ load_dotenv(dotenv_path="../.env")  # Load .env from parent directory
 CLAUDE_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CLAUDE_MODEL = "claude-3-haiku-20240307"
 MAX_TOKENS = 300
+TRACE_LOG = os.getenv("TRACE_LOG", "0") == "1"  # print per-stage timings for every request
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))  # keep the stage breakdown of slower requests, 0 = off
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # enables the /admin diagnostics endpoints (sent as X-Admin-Token)
+TRANSCRIPT_TOKEN_BUDGET = int(os.getenv("TRANSCRIPT_TOKEN_BUDGET", "3000"))  # max transcript tokens per prompt
+TRANSLATE_BATCH_MAX_ITEMS = int(os.getenv("TRANSLATE_BATCH_MAX_ITEMS", "50"))  # per /translate-batch request
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_DOWNLOAD_ROOT = os.getenv("WHISPER_DOWNLOAD_ROOT")  # weights baked into the image live here
+WHISPER_WARMUP = os.getenv("WHISPER_WARMUP", "1") == "1"
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))  # intra-op threads per process, 0 = torch default
+
+# -------- Readiness Thresholds --------
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT", "2.0"))  # seconds
+READY_MAX_BACKLOG = int(os.getenv("READY_MAX_BACKLOG", "8"))  # in-flight transcription + Claude jobs
+READY_MAX_CLAUDE_ERROR_RATE = float(os.getenv("READY_MAX_CLAUDE_ERROR_RATE", "0.5"))
+
+# -------- Admission Control --------
+# Heavy work (Whisper / Claude) runs in at most ADMISSION_SLOTS requests at once per worker;
+# queue limits and deadlines are per priority class: emergency, ongoing, tool
+def _per_priority(name: str, default: str, cast):
+    values = [cast(v) for v in os.getenv(name, default).split(",")]
+    return {PRIORITY_EMERGENCY: values[0], PRIORITY_ONGOING: values[1], PRIORITY_TOOL: values[2]}
+
+admission = AdmissionController(
+    slots=int(os.getenv("ADMISSION_SLOTS", "2")),
+    queue_limits=_per_priority("ADMISSION_QUEUE_LIMITS", "32,16,8", int),
+    deadlines=_per_priority("ADMISSION_DEADLINES", "60,30,10", float),
+    rate_limiter=TokenBucket(
+        rate=float(os.getenv("RATE_LIMIT_PER_MINUTE", "60")) / 60,
+        burst=int(os.getenv("RATE_LIMIT_BURST", "10"))
+    )
+)
+# Addresses (or CIDRs) of the reverse proxies whose X-Forwarded-For is believed; the rate limit is per caller, not per proxy
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "127.0.0.1")
+
+# -------- Dashboard Stats --------
+call_stats = CallStats(resync_seconds=float(os.getenv("STATS_RESYNC_SECONDS", "300")))
+
+# -------- Geo Routing --------
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.csv"))
+ROUTING_CANDIDATES = int(os.getenv("ROUTING_CANDIDATES", "5"))  # agents tried per routing attempt
+# The directory is per worker: with several, reload it this often so agents freed elsewhere are seen
+AGENT_REFRESH_SECONDS = float(os.getenv(
+    "AGENT_REFRESH_SECONDS", "0" if int(os.getenv("WEB_CONCURRENCY", "1")) <= 1 else "2"
+))
+gazetteer = Gazetteer.load(GAZETTEER_PATH)
+agent_directory = AgentDirectory(gazetteer)
+hospital_index = HospitalIndex(gazetteer)
+
+# -------- Protocol Retrieval --------
+PROTOCOLS_DIR = os.getenv("PROTOCOLS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "protocols"))
+PROTOCOL_MATCHES = int(os.getenv("PROTOCOL_MATCHES", "3"))  # protocols returned per transcript segment
+protocol_index = ProtocolIndex.load(PROTOCOLS_DIR)
 
 if CLAUDE_API_KEY:
-    claude = Anthropic(api_key=CLAUDE_API_KEY)
+    # Imported lazily: deployments without a key never pay for the SDK import
+    from anthropic import Anthropic
+    claude = InstrumentedClient(Anthropic(api_key=CLAUDE_API_KEY))
 else:
     claude = None
 
+# -------- Regional Sharding --------
+# Behind shard_router.py every region runs its own backend; SHARD_INDEX puts the
+# shard in the session ids it hands out (0 = unsharded, ids unchanged)
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+
 # -------- Database Setup --------
-DATABASE_URL = "sqlite:///./emergency_call.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./emergency_call.db")
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)
+
+# -------- Active Session Store --------
+# Live calls are served from memory and their messages written behind in batches.
+# Each worker keeps its own copy, so it is off by default with several workers
+# unless requests for a session always reach the same worker (SESSION_AFFINITY=1).
+ACTIVE_SESSION_CACHE = os.getenv(
+    "ACTIVE_SESSION_CACHE",
+    "1" if int(os.getenv("WEB_CONCURRENCY", "1")) <= 1 or os.getenv("SESSION_AFFINITY") == "1" else "0"
+) == "1"
+session_store = SessionStore(
+    session_factory=SessionLocal,
+    enabled=ACTIVE_SESSION_CACHE,
+    flush_interval=float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2")),  # seconds of chat at risk on a crash
+    max_pending=int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))
+)
+
+# -------- Audio Archive --------
+# Call recordings are kept (deduplicated, transcoded to Opus) for QA replay and reprocessing
+AUDIO_ARCHIVE = os.getenv("AUDIO_ARCHIVE", "1") == "1"
+AUDIO_ACCEL_REDIRECT = os.getenv("AUDIO_ACCEL_REDIRECT")  # e.g. /protected-audio/ to let nginx sendfile playback
+audio_archive = AudioArchive(
+    root=os.getenv("AUDIO_ARCHIVE_DIR", "uploads"),
+    session_factory=SessionLocal,
+    max_bytes=int(float(os.getenv("AUDIO_ARCHIVE_MAX_GB", "20")) * 1024 ** 3),
+    max_age_days=float(os.getenv("AUDIO_ARCHIVE_MAX_AGE_DAYS", "90")),
+    opus_bitrate=os.getenv("AUDIO_OPUS_BITRATE", "24k"),
+    budget_seconds=float(os.getenv("AUDIO_ARCHIVE_BUDGET_SECONDS", "600"))
+)
+
+# -------- Cold Storage --------
+# Completed calls older than ARCHIVE_AFTER_DAYS are moved to Parquet files by `python cold_storage.py` (cron)
+cold_storage = ColdStorage(os.getenv("COLD_STORAGE_DIR", "archive"), SessionLocal)
+
+# -------- Startup --------
+startup_phases = {}  # phase -> seconds
+
+def record_startup_phase(phase: str, seconds: float):
+    startup_phases[phase] = round(seconds, 3)
+    STARTUP_PHASE.set(seconds, phase=phase)
+    print(f"Startup phase {phase}: {seconds * 1000:.0f}ms")
+
+def init_database():
+    """Create missing tables (run at startup rather than at import time)"""
+    Base.metadata.create_all(bind=engine)
+    init_search_index(engine)
+    event_log.init_event_log(SessionLocal)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    started = time.perf_counter()
+    init_database()
+    record_startup_phase("database", time.perf_counter() - started)
     try:
         db = SessionLocal()
         if db.query(UserAgent).count() == 0:
@@ -72,11 +215,26 @@ async def lifespan(app: FastAPI):
             )
             db.add(agent)
             db.commit()
+        started = time.perf_counter()
+        call_stats.rebuild(db)
+        agent_directory.rebuild(available_agents(db))
+        record_startup_phase("stats", time.perf_counter() - started)
         db.close()
     except Exception as e:
         print(f"Startup error: {e}")
+    session_store.start()
+    call_stats.start(SessionLocal)
+    agent_directory.start(load_available_agents, AGENT_REFRESH_SECONDS)
+    if AUDIO_ARCHIVE:
+        audio_archive.start()
+    # Load and warm up Whisper in the background; /health/ready flips once it is done
+    threading.Thread(target=preload_whisper_model, daemon=True).start()
     yield
-    # Shutdown (nothing to do here)
+    # Shutdown: persist messages still waiting in the write-behind queue
+    session_store.stop()
+    call_stats.stop()
+    agent_directory.stop()
+    audio_archive.stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -88,37 +246,206 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Behind nginx, request.client becomes the caller from X-Forwarded-For, only when the peer is a trusted proxy
+app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=TRUSTED_PROXIES)
+
+# -------- Metrics & tracing middleware --------
+slow_requests = SlowRequestLog(SLOW_REQUEST_MS)
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    # Clients may pass X-Trace-Id on every request of a call to follow it across stages
+    trace_id = request.headers.get("x-trace-id") or new_trace_id()
+    token = begin_trace(trace_id)
+    INFLIGHT_REQUESTS.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        INFLIGHT_REQUESTS.dec()
+        trace = end_trace(token)
+        route = request.scope.get("route")
+        REQUEST_DURATION.observe(
+            elapsed,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status
+        )
+    response.headers["X-Trace-Id"] = trace_id
+    if slow_requests.threshold is not None and elapsed >= slow_requests.threshold and not request.url.path.startswith("/admin/"):
+        slow_requests.record(request.method, request.url.path, route.path if route else "unmatched", status, elapsed, trace)
+    if trace["stages"]:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={duration * 1000:.1f}" for name, duration in trace["stages"]
+        )
+    # Token usage of every Claude call made while serving this request
+    claude_calls = trace.get("claude_calls", [])
+    if claude_calls:
+        response.headers["X-Claude-Tokens"] = ", ".join(
+            f"{call['model']};input={call['input']};cache_read={call['cache_read']};"
+            f"cache_write={call['cache_write']};output={call['output']}"
+            for call in claude_calls
+        )
+    if TRACE_LOG:
+        stages = " ".join(f"{name}={duration * 1000:.1f}ms" for name, duration in trace["stages"])
+        print(f"[trace {trace_id}] {request.method} {request.url.path} {status} {elapsed * 1000:.1f}ms {stages}")
+        for call in claude_calls:
+            print(f"[trace {trace_id}] claude {call}")
+    return response
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics in text exposition format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+ACTIVE_SESSIONS.set_function(lambda: call_stats.active_sessions)
+
+# -------- Admin diagnostics --------
+profiler = SamplingProfiler()
+memory_tracer = MemoryTracer()
+
+def require_admin(request: Request):
+    """The /admin endpoints only exist when ADMIN_TOKEN is set, and require it in X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+def admin_profile(seconds: float = 10.0, interval_ms: float = 5.0, include_idle: bool = False):
+    """Sample this worker's threads for `seconds`; returns folded stacks for flamegraph.pl / speedscope"""
+    try:
+        result = profiler.profile(seconds, max(1.0, interval_ms) / 1000, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(result["folded"] + "\n", headers={
+        "X-Profile-Samples": str(result["samples"]),
+        "X-Profile-Seconds": str(result["seconds"]),
+        "X-Worker-Pid": str(os.getpid()),
+    })
+
+@app.post("/admin/tracemalloc/start", dependencies=[Depends(require_admin)])
+def admin_tracemalloc_start(frames: int = 10):
+    """Start tracing allocations (slows allocation-heavy code while on) and take the baseline"""
+    memory_tracer.start(min(frames, 50))
+    return {"tracing": True, "baseline_at": memory_tracer.baseline_at, "worker_pid": os.getpid()}
+
+@app.get("/admin/tracemalloc/diff", dependencies=[Depends(require_admin)])
+def admin_tracemalloc_diff(limit: int = 20, group_by: str = "lineno", filename: Optional[str] = None, rebase: bool = False):
+    """Allocation growth since the baseline, e.g. filename=main.py to watch the upload path"""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return memory_tracer.diff(max(1, min(limit, 200)), group_by, filename, rebase)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/tracemalloc/stop", dependencies=[Depends(require_admin)])
+def admin_tracemalloc_stop():
+    memory_tracer.stop()
+    return {"tracing": False}
+
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+def admin_slow_requests(limit: int = 50, route: Optional[str] = None):
+    """Most recent requests slower than SLOW_REQUEST_MS in this worker, with their stage breakdown"""
+    return {
+        "threshold_ms": SLOW_REQUEST_MS or None,
+        "worker_pid": os.getpid(),
+        "requests": slow_requests.recent(max(1, min(limit, 200)), route),
+    }
 
 # Add a simple root endpoint
 @app.get("/")
 def read_root():
     return {"message": "Emergency Call Backend is running", "status": "ok"}
 
-# Health check endpoint for monitoring
-@app.get("/health")
-def health_check():
-    """Health check endpoint for load balancers and monitoring"""
+# -------- Health Checks --------
+def check_database() -> dict:
+    db = SessionLocal()
     try:
-        # Test database connection
-        db = next(get_db())
-        db.execute("SELECT 1")
-        db_status = "healthy"
-    except Exception as e:
-        db_status = f"unhealthy: {str(e)}"
-    
-    # Test Claude API availability
-    claude_status = "healthy" if CLAUDE_API_KEY else "missing_api_key"
-    
+        db.execute(text("SELECT 1"))
+        return {"status": "healthy"}
+    finally:
+        db.close()
+
+def check_claude_reachable() -> dict:
+    claude.models.list(limit=1)
+    return {"status": "healthy"}
+
+claude_probe = CachedProbe(check_claude_reachable, ttl=30.0, timeout=5.0)
+
+def check_claude() -> dict:
+    if not claude:
+        return {"status": "missing_api_key"}
+    result = claude_probe()
+    error_rate = claude.recent_error_rate()
+    result["recent_error_rate"] = error_rate
+    if result["status"] == "healthy" and error_rate is not None and error_rate > READY_MAX_CLAUDE_ERROR_RATE:
+        result["status"] = "degraded"
+    return result
+
+def check_whisper() -> dict:
+    return {
+        "status": "healthy" if whisper_state["warm"] else "loading",
+        "model": WHISPER_MODEL,
+        "loaded": whisper_state["loaded"],
+        "warm": whisper_state["warm"],
+        "error": whisper_state["error"],
+    }
+
+def check_backlog() -> dict:
+    transcriptions = INFLIGHT_JOBS.value(kind="transcription")
+    claude_calls = INFLIGHT_JOBS.value(kind="claude")
+    queued = admission.queued()
+    backlog = int(transcriptions + claude_calls) + queued
     return {
-        "status": "healthy" if db_status == "healthy" and claude_status == "healthy" else "unhealthy",
+        "status": "healthy" if backlog <= READY_MAX_BACKLOG else "saturated",
+        "inflight_requests": int(INFLIGHT_REQUESTS.value()),
+        "inflight_transcriptions": int(transcriptions),
+        "inflight_claude_requests": int(claude_calls),
+        "queued": {
+            "emergency": admission.queued(PRIORITY_EMERGENCY),
+            "ongoing": admission.queued(PRIORITY_ONGOING),
+            "tool": admission.queued(PRIORITY_TOOL),
+        },
+        "limit": READY_MAX_BACKLOG,
+    }
+
+def readiness_report() -> dict:
+    services = {
+        "database": run_with_timeout(check_database, READY_DB_TIMEOUT),
+        "claude_api": check_claude(),
+        "whisper": check_whisper(),
+        "queue": check_backlog(),
+    }
+    ready = all(service["status"] == "healthy" for service in services.values())
+    return {
+        "status": "healthy" if ready else "unhealthy",
         "timestamp": datetime.now().isoformat(),
-        "services": {
-            "database": db_status,
-            "claude_api": claude_status,
-            "whisper": "available"
-        }
+        "services": services,
+        "startup": startup_phases
     }
 
+@app.get("/health/live")
+def liveness():
+    """Cheap liveness probe: the process is up and serving requests"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+@app.get("/health/ready")
+def readiness():
+    """Readiness probe: 503 while a dependency is down or the worker is saturated"""
+    report = readiness_report()
+    return JSONResponse(report, status_code=200 if report["status"] == "healthy" else 503)
+
+# Health check endpoint for monitoring
+@app.get("/health")
+def health_check():
+    """Health check endpoint for load balancers and monitoring"""
+    return readiness_report()
+
 # -------- Dependency --------
 def get_db():
     db = SessionLocal()
@@ -127,6 +454,42 @@ def get_db():
     finally:
         db.close()
 
+@asynccontextmanager
+async def admitted(request: Request, priority: int):
+    """Hold an admission slot for the duration of the request, or fail fast with 429"""
+    client = request.client.host if request.client else "unknown"
+    try:
+        await admission.acquire(priority, client)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({e.reason}), please retry",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        admission.release(time.perf_counter() - started)
+
+async def admit_tool(request: Request):
+    """Ad-hoc tool endpoints (translation, transcription tests, recommendations): lowest priority"""
+    async with admitted(request, PRIORITY_TOOL):
+        yield
+
+def session_status(session_id: int) -> Optional[str]:
+    session = session_store.get(session_id)
+    return session.status if session else None
+
+async def admit_session_audio(request: Request, session_id: int = None):
+    """Audio for a live call is prioritized by the call's status"""
+    priority = PRIORITY_TOOL
+    if session_id:
+        status = await run_in_threadpool(session_status, session_id)
+        priority = PRIORITY_EMERGENCY if status == "emergency" else PRIORITY_ONGOING if status else PRIORITY_TOOL
+    async with admitted(request, priority):
+        yield
+
 # -------- Request Schema --------
 class StartCallRequest(BaseModel):
     fullname: str
@@ -142,6 +505,51 @@ class StartCallResponse(BaseModel):
     agent_language: str
     caller_name: str
     message: str
+    agent_hospital: Optional[str] = None
+    distance_km: Optional[float] = None
+
+def available_agents(db: Session):
+    """Routing columns of the available agents, enough to rebuild the agent directory"""
+    return db.query(
+        UserAgent.id, UserAgent.status, UserAgent.language, UserAgent.hospital_location
+    ).filter(UserAgent.status == "available").all()
+
+def load_available_agents():
+    db = SessionLocal()
+    try:
+        return available_agents(db)
+    finally:
+        db.close()
+
+def claim_nearest_agent(db: Session, location: str, language: str):
+    """
+    Nearest available agent for the caller, preferring their language. The agent
+    is claimed with a conditional UPDATE so two calls (or two workers) never get
+    the same one; returns (agent, distance_km) or (None, None).
+    """
+    reloaded = False
+    for attempt in range(3):
+        with stage("routing"):
+            candidates = agent_directory.candidates(location, language, limit=ROUTING_CANDIDATES)
+        if not candidates:
+            # Nothing routable here. Agents freed by another worker arrive with the next
+            # refresh; reload now only if the database actually has some
+            if reloaded or db.query(UserAgent.id).filter(UserAgent.status == "available").first() is None:
+                break
+            agent_directory.rebuild(available_agents(db))
+            reloaded = True
+            continue
+        for agent_id, distance_km in candidates:
+            claimed = db.query(UserAgent).filter(
+                UserAgent.id == agent_id, UserAgent.status == "available"
+            ).update({"status": "occupied"}, synchronize_session=False)
+            db.commit()
+            agent_directory.discard(agent_id)
+            if claimed:
+                call_stats.agent_status_changed("available", "occupied")
+                return db.get(UserAgent, agent_id), distance_km
+        # Every candidate was stale (taken by another worker) and is now discarded: try the next nearest
+    return None, None
 
 # -------- Route: Start a Call --------
 @app.post("/start-call", response_model=StartCallResponse)
@@ -158,31 +566,41 @@ def start_call(data: StartCallRequest, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(caller)
 
-    # 2. Find available agent
-    agent = db.query(UserAgent).filter(UserAgent.status == "available").first()
+    # 2. Find and assign (mark as occupied) the nearest available agent
+    agent, distance_km = claim_nearest_agent(db, data.location, data.language)
     if not agent:
         raise HTTPException(status_code=503, detail="No available agents at the moment")
 
-    # 3. Assign agent (mark as occupied)
-    agent.status = "occupied"
-    db.commit()
-
     # 4. Create chat session
     session = ChatSession(
         user_caller_id=caller.id,
         user_agent_id=agent.id,
         status="ongoing"
     )
+    if SHARD_INDEX:
+        session.id = next_session_id(ChatSession, SHARD_INDEX)
     db.add(session)
-    db.commit()
+    db.flush()
+    event_log.append_rows(db, [
+        event_log.event_row(session.id, "call_started", {"status": session.status, "caller": event_log.caller_payload(caller)},
+                            at=session.started_at),
+        event_log.event_row(session.id, "agent_assigned", event_log.agent_payload(agent, distance_km=distance_km),
+                            at=session.started_at),
+    ])
+    with stage("db_commit"):
+        db.commit()
     db.refresh(session)
+    call_stats.call_started(session.status)
+    session_store.add(session, caller.language, agent.language)
 
     return StartCallResponse(
         session_id=session.id,
         agent_name=agent.fullname,
         agent_language=agent.language,
         caller_name=caller.fullname,
-        message="Call started and assigned to available agent"
+        message="Call started and assigned to available agent",
+        agent_hospital=agent.hospital_location,
+        distance_km=distance_km
     )
 
 
@@ -200,35 +618,90 @@ class SendMessageRequest(BaseModel):
 
 
 @app.post("/send-message")
-def send_message(data: SendMessageRequest, db: Session = Depends(get_db)):
-    # Check that session exists
-    session = db.query(ChatSession).filter(ChatSession.id == data.session_id).first()
+def send_message(data: SendMessageRequest):
+    # Check that session exists (served from memory while the call is active)
+    session = session_store.get(data.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Chat session not found")
 
-    # Save message
-    chat_msg = ChatMessage(
-        session_id=data.session_id,
+    # Save message (queued for the next write-behind flush, indexed for search there)
+    session_store.append_message(
+        session,
         sender_type=data.sender_type,
         message=data.message,
         confidence_score=data.confidence_score,
         unresolved=data.unresolved
     )
-    db.add(chat_msg)
-    db.commit()
     
     
     if detect_emergency_keywords(data.message):
         # Mark session as high priority or trigger ambulance dispatch logic
-        session = db.query(ChatSession).filter(ChatSession.id == data.session_id).first()
-        if session:
-            session.status = "emergency"
-            db.commit()
+        if session.status != "emergency":
+            previous_status = session.status
+            session_store.set_status(session.id, "emergency")
+            call_stats.session_status_changed(previous_status, "emergency")
 
+    # Protocols relevant to what the caller just said, without a Claude round trip
+    protocols = []
+    if data.sender_type == "caller":
+        with stage("protocol_search"):
+            protocols = protocol_index.search(data.message, k=PROTOCOL_MATCHES)
 
-    return {"message": "Message stored successfully"}
+    return {"message": "Message stored successfully", "protocols": protocols}
 
 
+# -------- Route: End a Call --------
+@app.post("/end-call/{session_id}")
+def end_call(session_id: int, db: Session = Depends(get_db)):
+    """Mark a call completed and release its agent"""
+    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    if session.status == "completed":
+        return {"message": "Call already ended"}
+
+    previous_status = session.status
+    session.status = "completed"
+    session.ended_at = datetime.utcnow()
+    agent = db.query(UserAgent).filter(UserAgent.id == session.user_agent_id).first()
+    previous_agent_status = agent.status if agent else None
+    if agent:
+        agent.status = "available"
+    session_store.end(session_id)  # queued messages go into the log before call_ended
+    event_log.append(db, session_id, "call_ended", {
+        "ended_at": session.ended_at, "handle_seconds": (session.ended_at - session.started_at).total_seconds()
+    }, at=session.ended_at)
+    with stage("db_commit"):
+        db.commit()
+    event_log.snapshot_session(db, session_id, force=True)  # the final state of the call
+    db.commit()
+
+    call_stats.call_ended(previous_status, (session.ended_at - session.started_at).total_seconds())
+    if agent:
+        call_stats.agent_status_changed(previous_agent_status, "available")
+        agent_directory.update(agent)
+    return {"message": "Call ended", "session_id": session_id}
+
+# -------- Dashboard Stats Endpoint --------
+@app.get("/stats")
+def get_stats():
+    """Live call / agent aggregates for the dashboards, served from memory"""
+    return call_stats.snapshot()
+
+# -------- Nearest Hospitals Endpoint --------
+@app.get("/nearest-hospitals")
+def nearest_hospitals(location: str, limit: int = 3):
+    """Closest hospitals to a free-text location or "lat, lon", resolved offline"""
+    hospitals = hospital_index.nearest(location, max(1, min(limit, 20)))
+    if hospitals is None:
+        raise HTTPException(status_code=404, detail="Location not found in gazetteer")
+    return {"location": location, "hospitals": hospitals}
+
+# -------- Protocol Search Endpoint --------
+@app.get("/protocols/search")
+def search_protocols(q: str, k: int = 3):
+    """Emergency protocols matching a transcript excerpt, from the local index"""
+    return {"query": q, "protocols": protocol_index.search(q, k=max(1, min(k, 10)))}
 
 
 # ----------------------------------------------------------------------------
@@ -249,22 +722,33 @@ class LiveFeedResponse(BaseModel):
 
 @app.get("/live-feed/{session_id}", response_model=LiveFeedResponse)
 def get_live_feed(session_id: int, db: Session = Depends(get_db)):
-    messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at).all()
-    session_guide = db.query(ChatSessionGuide).filter(ChatSessionGuide.session_id == session_id).first()
+    session = session_store.get(session_id, with_tail=True)
+    if session and session.complete:
+        messages = list(session.messages)
+        question_suggestions = session.question_suggestions
+    else:
+        # Very long calls keep only a tail in memory: read the full history from the database
+        session_store.flush(session_id)
+        messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at).all()
+        messages = [
+            {"sender_type": m.sender_type, "message": m.message, "confidence_score": m.confidence_score, "unresolved": m.unresolved}
+            for m in messages
+        ]
+        question_suggestions = session.question_suggestions if session else None
 
     msg_list = [
         ChatMessageOut(
-            sender_type=msg.sender_type,
-            message=msg.message,
-            confidence_score=msg.confidence_score,
-            unresolved=msg.unresolved
+            sender_type=msg["sender_type"],
+            message=msg["message"],
+            confidence_score=msg["confidence_score"],
+            unresolved=msg["unresolved"]
         )
         for msg in messages
     ]
 
     suggestions = []
-    if session_guide and session_guide.question_suggestions:
-        suggestions = [q["question"] for q in session_guide.question_suggestions if q["status"] == "not_asked"]
+    if question_suggestions:
+        suggestions = [q["question"] for q in question_suggestions if q["status"] == "not_asked"]
 
     return LiveFeedResponse(
         session_id=session_id,
@@ -303,7 +787,12 @@ def update_suggestions(data: UpdateSuggestionsRequest, db: Session = Depends(get
         )
         db.add(session_guide)
 
+    event_log.append(db, data.session_id, "suggestions_updated", {
+        "question_suggestions": session_guide.question_suggestions,
+        "department_suggestions": session_guide.department_suggestions
+    })
     db.commit()
+    session_store.set_guide(data.session_id, session_guide.question_suggestions)
     return {"message": "Suggestions updated"}
 
 
@@ -318,39 +807,241 @@ def update_suggestions(data: UpdateSuggestionsRequest, db: Session = Depends(get
 # ----------------------------------------------------------------------------
 # AI Processing Functions
 
+_whisper_model = None
+_whisper_lock = threading.Lock()
+_whisper_replicas = []  # idle model trees sharing _whisper_model's weights
+whisper_state = {"loaded": False, "warm": False, "error": None}
+
+def get_whisper_model():
+    """Load the Whisper model once per process and reuse it"""
+    global _whisper_model
+    if _whisper_model is None:
+        with _whisper_lock:
+            if _whisper_model is None:
+                # whisper pulls in torch; only import it when a model is actually needed
+                with stage("model_load"):
+                    import whisper
+                    if TORCH_THREADS:
+                        configure_torch_threads(TORCH_THREADS)
+                    _whisper_model = whisper.load_model(WHISPER_MODEL, download_root=WHISPER_DOWNLOAD_ROOT)
+                whisper_state["loaded"] = True
+    return _whisper_model
+
+@contextmanager
+def whisper_instance():
+    """
+    A Whisper model for one transcription. Decoding installs kv-cache hooks on
+    the model's modules, so two transcriptions must never share a module tree.
+    Replicas reuse the loaded weight tensors, so each one costs almost no memory.
+    """
+    model = get_whisper_model()
+    with _whisper_lock:
+        replica = _whisper_replicas.pop() if _whisper_replicas else None
+    if replica is None:
+        shared = list(model.parameters()) + list(model.buffers()) if hasattr(model, "parameters") else []
+        replica = copy.deepcopy(model, {id(tensor): tensor for tensor in shared})
+    try:
+        yield replica
+    finally:
+        with _whisper_lock:
+            _whisper_replicas.append(replica)
+
+def configure_torch_threads(threads: int):
+    """Cap torch's intra-op thread pool so several workers on one node don't oversubscribe the cores"""
+    import torch
+    torch.set_num_threads(max(1, threads))
+
+def preload_shared_model():
+    """
+    Load Whisper in the parent process before workers fork (see gunicorn.conf.py).
+    The weights are then shared copy-on-write between all workers instead of
+    every worker holding its own copy.
+    """
+    configure_torch_threads(1)  # don't start a thread pool in the parent before forking
+    get_whisper_model()
+
+def warm_up_whisper_model():
+    """Run one inference on a second of silence so the first real call doesn't pay for lazy init"""
+    import numpy as np
+    model = get_whisper_model()
+    with stage("whisper_warmup"):
+        model.transcribe(np.zeros(16000, dtype=np.float32), fp16=False)
+    whisper_state["warm"] = True
+
+def preload_whisper_model():
+    try:
+        started = time.perf_counter()
+        get_whisper_model()
+        record_startup_phase("model_load", time.perf_counter() - started)
+        if WHISPER_WARMUP:
+            started = time.perf_counter()
+            warm_up_whisper_model()
+            record_startup_phase("warmup", time.perf_counter() - started)
+        else:
+            whisper_state["warm"] = True
+    except Exception as e:
+        whisper_state["error"] = str(e)
+        print(f"Whisper preload error: {e}")
+
+WHISPER_SAMPLE_RATE = 16000
+LOW_CONFIDENCE_THRESHOLD = float(os.getenv("LOW_CONFIDENCE_THRESHOLD", "0.5"))
+
+def segment_confidence(segment: dict) -> float:
+    """Whisper segment confidence: mean token probability, discounted by the no-speech probability"""
+    probability = math.exp(min(0.0, segment.get("avg_logprob", 0.0)))
+    return round(probability * (1.0 - segment.get("no_speech_prob", 0.0)), 4)
+
+def compact_segments(whisper_result: dict) -> List[dict]:
+    return [
+        {
+            "start": round(segment["start"], 2),
+            "end": round(segment["end"], 2),
+            "text": segment["text"].strip(),
+            "confidence": segment_confidence(segment)
+        }
+        for segment in whisper_result.get("segments", [])
+        if segment["text"].strip()
+    ]
+
+def transcript_confidence(segments: List[dict]) -> Optional[float]:
+    """Duration-weighted mean of the segment confidences"""
+    total = sum(max(s["end"] - s["start"], 0.01) for s in segments)
+    if not segments or not total:
+        return None
+    return round(sum(s["confidence"] * max(s["end"] - s["start"], 0.01) for s in segments) / total, 4)
+
+def transcribe_samples(audio) -> dict:
+    """Full Whisper result for 16 kHz mono samples (text, segments, language) plus their duration in seconds"""
+    with whisper_instance() as model, stage("whisper_inference"), inflight("transcription"):
+        result = model.transcribe(audio)
+    whisper_state["warm"] = True
+    result["duration"] = len(audio) / WHISPER_SAMPLE_RATE
+    return result
+
+def run_whisper(audio_path: str) -> dict:
+    """Full Whisper result for a file, downmixed to mono"""
+    import whisper
+    with stage("decode"):
+        audio = whisper.load_audio(audio_path)
+    return transcribe_samples(audio)
+
+# -------- Dual-channel recordings --------
+# Phone systems record the caller and the dispatcher on separate channels:
+# left/right map to these speakers (empty STEREO_CHANNEL_SPEAKERS = always downmix)
+STEREO_CHANNEL_SPEAKERS = [s.strip() for s in os.getenv("STEREO_CHANNEL_SPEAKERS", "caller,agent").split(",") if s.strip()]
+SILENT_CHANNEL_DBFS = float(os.getenv("SILENT_CHANNEL_DBFS", "-50"))  # quieter channels are not transcribed
+
+def probe_channel_count(audio_path: str) -> int:
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=channels", "-of", "csv=p=0", audio_path],
+            capture_output=True, text=True, timeout=10
+        )
+        return int(result.stdout.strip() or 1)
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return 1
+
+def decode_channels(audio_path: str, channels: int) -> list:
+    """Each channel as 16 kHz float32 samples (whisper.load_audio always downmixes)"""
+    import numpy as np
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-threads", "0", "-i", audio_path, "-f", "s16le", "-ac", str(channels),
+         "-acodec", "pcm_s16le", "-ar", str(WHISPER_SAMPLE_RATE), "-"],
+        capture_output=True, check=True
+    )
+    samples = np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+    return [np.ascontiguousarray(samples[channel::channels]) for channel in range(channels)]
+
+def _rms(samples) -> float:
+    import numpy as np
+    return float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+
+def split_speaker_channels(audio_path: str) -> Optional[list]:
+    """
+    (speaker, samples) for each channel of a two-channel recording that has
+    speech, or None when the file should be transcribed as one mono track
+    (mono input, the same signal on both channels, or nothing audible).
+    """
+    if len(STEREO_CHANNEL_SPEAKERS) < 2 or probe_channel_count(audio_path) != 2:
+        return None
+    with stage("decode"):
+        left, right = decode_channels(audio_path, 2)
+    loudest = max(_rms(left), _rms(right))
+    if not loudest or _rms(left - right) <= 0.1 * loudest:
+        return None
+    floor = 10 ** (SILENT_CHANNEL_DBFS / 20)
+    active = [
+        (speaker, samples)
+        for speaker, samples in zip(STEREO_CHANNEL_SPEAKERS, (left, right))
+        if _rms(samples) > floor
+    ]
+    return active or None
+
+def transcribe_channels(channels: list) -> list:
+    """Transcribe every speaker's channel in parallel; returns (speaker, whisper result) pairs"""
+    with ThreadPoolExecutor(max_workers=len(channels), thread_name_prefix="whisper-channel") as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, transcribe_samples, samples)
+            for _, samples in channels
+        ]
+        return [(speaker, future.result()) for (speaker, _), future in zip(channels, futures)]
+
+def interleave_turns(channel_results: list) -> List[dict]:
+    """Merge the channels' segments by start time; consecutive segments of one speaker form a turn"""
+    tagged = sorted(
+        (
+            (segment, speaker, result.get("language"))
+            for speaker, result in channel_results
+            for segment in compact_segments(result)
+        ),
+        key=lambda item: (item[0]["start"], item[0]["end"])
+    )
+    turns = []
+    for segment, speaker, language in tagged:
+        if turns and turns[-1]["speaker"] == speaker:
+            turns[-1]["segments"].append(segment)
+        else:
+            turns.append({"speaker": speaker, "language": language, "segments": [segment]})
+    for turn in turns:
+        turn["text"] = " ".join(segment["text"] for segment in turn["segments"])
+        turn["start"] = turn["segments"][0]["start"]
+        turn["end"] = turn["segments"][-1]["end"]
+        turn["confidence"] = transcript_confidence(turn["segments"])
+    return turns
+
 def transcribe_audio(audio_path: str) -> str:
     """Transcribe audio using Whisper"""
-    model = whisper.load_model("base")
-    result = model.transcribe(audio_path)
-    return result["text"]
+    return run_whisper(audio_path)["text"]
+
+SUMMARY_TOOL = items_tool(
+    "record_summary",
+    "Record the key points of the transcript, one point per item, in the requested language.",
+    {"type": "string", "minLength": 1},
+)
 
 def summarize_text_with_claude(text: str, target_language: str = "french") -> list:
     """Summarize and translate text using Claude"""
     if not claude:
         raise HTTPException(status_code=500, detail="Claude API not configured")
     
-    response = claude.messages.create(
-        model=CLAUDE_MODEL,
-        max_tokens=MAX_TOKENS,
-        messages=[
-            {
-                "role": "user",
-                "content": (
-                    f"This is a transcript of a voice message:\n\n{text}\n\n"
-                    f"Please summarize the key points in bullet points. "
-                    f"Then, translate the summary into {target_language}. "
-                    f"Only output the translated bullet points."
-                )
-            }
-        ]
-    )
-    
-    summary_text = response.content[0].text.strip()
-    summary_lines = [line.strip("-• ").strip() for line in summary_text.splitlines() if line.strip()]
-    return summary_lines
+    text = fit_transcript(text, "summary")
+    try:
+        return generate_items(
+            claude,
+            CLAUDE_MODEL,
+            MAX_TOKENS,
+            SUMMARY_TOOL,
+            (
+                f"This is a transcript of a voice message:\n\n{text}\n\n"
+                f"Summarize the key points and translate them into {target_language}. "
+                f"Record only the translated points."
+            )
+        )
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
 def translate_with_claude(text: Union[str, List[str]], target_language: str) -> List[str]:
-    """Translate text using Claude"""
+    """Translate text using Claude, one output per input message"""
     if not claude:
         raise HTTPException(status_code=500, detail="Claude API not configured")
     
@@ -359,33 +1050,40 @@ def translate_with_claude(text: Union[str, List[str]], target_language: str) ->
     else:
         text_list = text
 
-    joined_text = "\n".join(f"- {t}" for t in text_list)
-
-    prompt = (
-        f"Translate the following messages into {target_language}. "
-        f"Preserve the tone and meaning as much as possible. Output only the translations:\n\n"
-        f"{joined_text}"
-    )
-
-    response = claude.messages.create(
-        model=CLAUDE_MODEL,
-        max_tokens=MAX_TOKENS,
-        messages=[{"role": "user", "content": prompt}]
-    )
-
-    output = response.content[0].text.strip()
-    translated_lines = [line.strip("-• ").strip() for line in output.splitlines() if line.strip()]
-    return translated_lines
+    results = translate_texts(claude, CLAUDE_MODEL, text_list, target_language)
+    failed = [error for translated, _, error in results if translated is None]
+    if failed:
+        raise HTTPException(status_code=502, detail=f"{len(failed)} of {len(results)} message(s) not translated: {failed[0]}")
+    return [translated for translated, _, _ in results]
 
-def process_audio_file(audio_path: str, target_language: str = "french") -> dict:
+def process_audio_file(audio_path: str, target_language: str = "french", summarize: bool = True) -> dict:
     """Complete audio processing pipeline"""
-    transcript = transcribe_audio(audio_path)
-    summary = summarize_text_with_claude(transcript, target_language)
+    channels = split_speaker_channels(audio_path)
+    if channels is None:
+        whisper_result = run_whisper(audio_path)
+        transcript = whisper_result["text"]
+        language = whisper_result.get("language")
+        duration = whisper_result["duration"]
+        segments = compact_segments(whisper_result)
+        turns = None
+    else:
+        channel_results = transcribe_channels(channels)
+        turns = interleave_turns(channel_results)
+        transcript = "\n".join(f"{turn['speaker'].capitalize()}: {turn['text']}" for turn in turns)
+        languages = {speaker: result.get("language") for speaker, result in channel_results}
+        language = languages.get("caller") or channel_results[0][1].get("language")
+        duration = max(result["duration"] for _, result in channel_results)
+        segments = [segment for turn in turns for segment in turn["segments"]]
+    summary = summarize_text_with_claude(transcript, target_language) if summarize else []
     
     return {
         "transcript": transcript,
         "summary": summary,
-        "target_language": target_language
+        "target_language": target_language,
+        "language": language,
+        "duration": duration,
+        "segments": segments,
+        "turns": turns  # per-speaker turns of a dual-channel recording, None for mono
     }
 
 # ----------------------------------------------------------------------------
@@ -413,60 +1111,138 @@ class AudioProcessRequest(BaseModel):
     session_id: int
     target_language: Optional[str] = "french"
 
+class TranscriptSegmentOut(BaseModel):
+    start: float
+    end: float
+    text: str
+    confidence: float
+    low_confidence: bool = False
+
+class ProtocolMatch(BaseModel):
+    id: str
+    title: str
+    priority: str
+    steps: List[str]
+    score: float
+    matched: List[str]
+
+class SpeakerTurn(BaseModel):
+    speaker: str
+    start: float
+    end: float
+    text: str
+    confidence: Optional[float] = None
+
 class AudioProcessResponse(BaseModel):
     session_id: int
     transcript: str
     summary: List[str]
     target_language: str
     message: str
+    confidence: Optional[float] = None
+    segments: List[TranscriptSegmentOut] = []
+    protocols: List[ProtocolMatch] = []
+    audio_sha256: Optional[str] = None
+    turns: List[SpeakerTurn] = []  # dual-channel recordings only
 
 @app.post("/process-audio", response_model=AudioProcessResponse)
 async def process_audio(
     audio_file: UploadFile = File(...),
     session_id: int = None,
     target_language: str = "french",
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    _admission: None = Depends(admit_session_audio)
 ):
     """Process audio file: transcribe, summarize, and optionally save to session"""
     
     # Validate session if provided
     if session_id:
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+        session = session_store.get(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
     
     # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
+    with stage("upload_read"), tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
         content = await audio_file.read()
         temp_file.write(content)
         temp_audio_path = temp_file.name
+    audio_sha256 = None
     
     try:
-        # Process the audio
-        result = process_audio_file(temp_audio_path, target_language)
+        # Process the audio (off the event loop, so other requests keep flowing)
+        result = await run_in_threadpool(process_audio_file, temp_audio_path, target_language)
+        segments = result["segments"]
+        confidence = transcript_confidence(segments)
+        # Protocols are matched on what the caller says, not on the dispatcher's questions
+        caller_text = (
+            " ".join(turn["text"] for turn in result["turns"] if turn["speaker"] == "caller")
+            if result["turns"] else result["transcript"]
+        )
         
-        # If session_id provided, save transcript as a message
+        # If session_id provided, save the transcript: one message per speaker turn
+        # for dual-channel recordings, otherwise a single caller message
         if session_id:
-            transcript_message = ChatMessage(
-                session_id=session_id,
-                sender_type="caller",
-                message=result["transcript"],
-                confidence_score=0.9,  # Default confidence for Whisper
-                unresolved=False
-            )
-            db.add(transcript_message)
+            turns = result["turns"] or [{
+                "speaker": "caller", "text": result["transcript"], "segments": segments,
+                "language": result["language"], "confidence": confidence, "start": None
+            }]
+            recorded_at = datetime.utcnow() - timedelta(seconds=result["duration"])
+            transcript_messages = []
+            for turn in turns:
+                message = ChatMessage(
+                    session_id=session_id,
+                    sender_type=turn["speaker"],
+                    message=turn["text"],
+                    confidence_score=turn["confidence"],
+                    unresolved=False
+                )
+                if turn["start"] is not None:
+                    message.created_at = recorded_at + timedelta(seconds=turn["start"])  # keeps the spoken order
+                transcript_messages.append(message)
+            db.add_all(transcript_messages)
+            db.flush()  # assigns the message ids for the segments
             
-            # Save summary as AI message
+            # Store the segments in one multi-row INSERT
+            if segments:
+                db.execute(insert(TranscriptSegment), [
+                    {
+                        "session_id": session_id,
+                        "message_id": message.id,
+                        "start_time": segment["start"],
+                        "end_time": segment["end"],
+                        "text": segment["text"],
+                        "confidence": segment["confidence"]
+                    }
+                    for turn, message in zip(turns, transcript_messages)
+                    for segment in turn["segments"]
+                ])
+            
+            # Save summary as AI message (it can't be more reliable than the transcript it summarizes)
             summary_text = "\n".join(f"• {point}" for point in result["summary"])
             summary_message = ChatMessage(
                 session_id=session_id,
                 sender_type="ai",
                 message=f"Summary:\n{summary_text}",
-                confidence_score=0.95,
+                confidence_score=confidence,
                 unresolved=False
             )
             db.add(summary_message)
-            db.commit()
+            db.flush()
+            event_log.append_rows(db, [event_log.message_event(m) for m in transcript_messages + [summary_message]])
+            index_messages(db, [
+                (message.id, message.message, turn["language"]) for turn, message in zip(turns, transcript_messages)
+            ] + [(summary_message.id, summary_message.message, target_language)])
+            with stage("db_commit"):
+                db.commit()
+            session_store.add_persisted(session_id, transcript_messages + [summary_message])
+            
+            # Keep the recording for replay (moves the temp file into the archive)
+            if AUDIO_ARCHIVE:
+                with stage("audio_archive"):
+                    audio_sha256 = await run_in_threadpool(
+                        audio_archive.store, temp_audio_path, audio_file.filename, result["duration"],
+                        session_id, transcript_messages[0].id
+                    )
             
             message = "Audio processed and saved to session"
         else:
@@ -477,34 +1253,269 @@ async def process_audio(
             transcript=result["transcript"],
             summary=result["summary"],
             target_language=result["target_language"],
-            message=message
+            message=message,
+            confidence=confidence,
+            segments=[
+                TranscriptSegmentOut(**segment, low_confidence=segment["confidence"] < LOW_CONFIDENCE_THRESHOLD)
+                for segment in segments
+            ],
+            protocols=protocol_index.search(caller_text, k=PROTOCOL_MATCHES),
+            audio_sha256=audio_sha256,
+            turns=[SpeakerTurn(**turn) for turn in result["turns"] or []]
         )
         
     finally:
-        # Clean up temporary file
-        os.unlink(temp_audio_path)
+        # Clean up temporary file (unless it was moved into the archive)
+        if os.path.exists(temp_audio_path):
+            os.unlink(temp_audio_path)
+
+# -------- Recordings / Playback --------
+@app.get("/sessions/{session_id}/recordings")
+def get_recordings(session_id: int, db: Session = Depends(get_db)):
+    """Archived recordings of a call, oldest first"""
+    recordings = db.query(AudioRecording).filter(AudioRecording.session_id == session_id).order_by(AudioRecording.id).all()
+    return {
+        "session_id": session_id,
+        "recordings": [
+            {
+                "id": recording.id,
+                "message_id": recording.message_id,
+                "filename": recording.filename,
+                "sha256": recording.sha256,
+                "created_at": recording.created_at,
+                "url": f"/audio/{recording.sha256}"
+            }
+            for recording in recordings
+        ]
+    }
+
+@app.get("/audio/{sha256}")
+def play_audio(sha256: str, db: Session = Depends(get_db)):
+    """Archived audio; Range requests are answered with 206 partial content"""
+    blob = audio_archive.open_blob(db, sha256.lower())
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Recording not found or evicted")
+    media_type = "audio/ogg" if blob.codec == "opus" else mimetypes.guess_type(blob.path)[0] or "application/octet-stream"
+    # The bytes change when the original is replaced by its Opus transcode, so the codec is part of the ETag
+    headers = {"Cache-Control": "private, max-age=86400, immutable", "ETag": f'"{blob.sha256}-{blob.codec}"'}
+    if AUDIO_ACCEL_REDIRECT:
+        # nginx serves the file itself (sendfile, with its own Range support)
+        headers["X-Accel-Redirect"] = AUDIO_ACCEL_REDIRECT.rstrip("/") + "/" + blob.path.replace(os.sep, "/")
+        return Response(media_type=media_type, headers=headers)
+    return FileResponse(audio_archive.absolute(blob.path), media_type=media_type, headers=headers)
+
+@app.get("/audio-archive")
+def audio_archive_report():
+    """Archive size, audio hours and storage cost per call hour"""
+    return audio_archive.report()
+
+# -------- Session History --------
+@app.get("/sessions/{session_id}")
+def get_session(session_id: int, db: Session = Depends(get_db)):
+    """A call with its caller, messages, segments, guide and recordings, from the database or cold storage"""
+    session_store.flush(session_id)
+    record = load_hot_session(db, session_id)
+    if record is None:
+        try:
+            record = cold_storage.load_session(db, session_id)
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    if record is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return record
+
+@app.get("/sessions/{session_id}/events")
+def get_session_events(session_id: int, after_id: int = 0, limit: int = 500, db: Session = Depends(get_db)):
+    """The call's event log in append order, from after_id (for incremental consumers)"""
+    session_store.flush(session_id)
+    events = (
+        db.query(SessionEvent)
+        .filter(SessionEvent.session_id == session_id, SessionEvent.id > after_id)
+        .order_by(SessionEvent.id)
+        .limit(max(1, min(limit, 5000)))
+        .all()
+    )
+    return {
+        "session_id": session_id,
+        "events": [
+            {"id": e.id, "type": e.type, "payload": e.payload, "created_at": e.created_at} for e in events
+        ],
+    }
+
+@app.get("/sessions/{session_id}/state")
+def get_session_state(session_id: int, db: Session = Depends(get_db)):
+    """Current state of a call: its latest snapshot plus a replay of the events after it"""
+    session_store.flush(session_id)
+    state = event_log.snapshot_session(db, session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No events for this session")
+    db.commit()  # keeps the snapshot if the replay was long enough to take one
+    return state
+
+@app.get("/cold-storage")
+def cold_storage_report(db: Session = Depends(get_db)):
+    """Archived session count, day range and size on disk"""
+    return cold_storage.report(db)
+
+class SegmentsResponse(BaseModel):
+    session_id: int
+    segments: List[dict]
+
+@app.get("/sessions/{session_id}/segments", response_model=SegmentsResponse)
+def get_segments(
+    session_id: int,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    message_id: Optional[int] = None,
+    low_confidence_only: bool = False,
+    db: Session = Depends(get_db)
+):
+    """Transcript segments of a session overlapping [start, end] (seconds into the recording)"""
+    query = db.query(TranscriptSegment).filter(TranscriptSegment.session_id == session_id)
+    if message_id is not None:
+        query = query.filter(TranscriptSegment.message_id == message_id)
+    if end is not None:
+        query = query.filter(TranscriptSegment.start_time <= end)
+    if start is not None:
+        query = query.filter(TranscriptSegment.end_time >= start)
+    if low_confidence_only:
+        query = query.filter(TranscriptSegment.confidence < LOW_CONFIDENCE_THRESHOLD)
+
+    segments = query.order_by(TranscriptSegment.message_id, TranscriptSegment.start_time).all()
+    return SegmentsResponse(
+        session_id=session_id,
+        segments=[
+            {
+                "message_id": segment.message_id,
+                "start": segment.start_time,
+                "end": segment.end_time,
+                "text": segment.text,
+                "confidence": segment.confidence,
+                "low_confidence": segment.confidence is not None and segment.confidence < LOW_CONFIDENCE_THRESHOLD
+            }
+            for segment in segments
+        ]
+    )
+
+# -------- Transcript Search --------
 
-@app.post("/transcribe-only")
+class SearchHit(BaseModel):
+    message_id: int
+    session_id: int
+    sender_type: str
+    created_at: Optional[str] = None
+    session_status: Optional[str] = None
+    snippet: str
+    rank: float
+
+class SearchResponse(BaseModel):
+    query: str
+    page: int
+    page_size: int
+    has_more: bool
+    results: List[SearchHit]
+
+@app.get("/search", response_model=SearchResponse)
+def search_transcripts(
+    q: str,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    language: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    db: Session = Depends(get_db)
+):
+    """Full-text search over all call messages, best matches first"""
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    hits = search_messages(
+        db, q,
+        status=status,
+        date_from=date_from,
+        date_to=date_to,
+        language=language,
+        limit=page_size + 1,
+        offset=(page - 1) * page_size
+    )
+    return SearchResponse(
+        query=q,
+        page=page,
+        page_size=page_size,
+        has_more=len(hits) > page_size,
+        results=[SearchHit(**hit) for hit in hits[:page_size]]
+    )
+
+@app.post("/transcribe-only", dependencies=[Depends(admit_tool)])
 async def transcribe_only(audio_file: UploadFile = File(...)):
     """Just transcribe audio without summarization"""
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
+    with stage("upload_read"), tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
         content = await audio_file.read()
         temp_file.write(content)
         temp_audio_path = temp_file.name
     
     try:
-        transcript = transcribe_audio(temp_audio_path)
+        transcript = await run_in_threadpool(transcribe_audio, temp_audio_path)
         return {"transcript": transcript}
     finally:
         os.unlink(temp_audio_path)
 
-@app.post("/translate-text")
+@app.post("/translate-text", dependencies=[Depends(admit_tool)])
 def translate_text(text: str, target_language: str = "french"):
     """Translate text using Claude"""
     translated = translate_with_claude(text, target_language)
     return {"original": text, "translated": translated, "target_language": target_language}
 
+# -------- Batch Translation Endpoint --------
+
+class TranslateItem(BaseModel):
+    text: str
+    target_language: str = "french"
+    session_id: Optional[int] = None
+
+class TranslateBatchRequest(BaseModel):
+    items: List[TranslateItem] = Field(max_length=TRANSLATE_BATCH_MAX_ITEMS)  # one admission slot, bounded Claude work
+
+class TranslatedItem(BaseModel):
+    session_id: Optional[int] = None
+    original: str
+    translated: Optional[str] = None  # None when this message could not be translated
+    target_language: str
+    cached: bool
+    error: Optional[str] = None
+
+class TranslateBatchResponse(BaseModel):
+    items: List[TranslatedItem]
+    cache: dict
+
+@app.post("/translate-batch", response_model=TranslateBatchResponse, dependencies=[Depends(admit_tool)])
+def translate_batch(data: TranslateBatchRequest):
+    """Translate many messages (possibly from different sessions) in as few Claude calls as possible"""
+    if not claude:
+        raise HTTPException(status_code=500, detail="Claude API not configured")
+
+    # Group by language so each Claude request has a single target
+    by_language = {}
+    for index, item in enumerate(data.items):
+        by_language.setdefault(item.target_language.lower(), []).append(index)
+
+    out = [None] * len(data.items)
+    for language, indexes in by_language.items():
+        results = translate_texts(claude, CLAUDE_MODEL, [data.items[i].text for i in indexes], language)
+        for i, (translated, cached, error) in zip(indexes, results):
+            item = data.items[i]
+            out[i] = TranslatedItem(
+                session_id=item.session_id,
+                original=item.text,
+                translated=translated,
+                target_language=item.target_language,
+                cached=cached,
+                error=error
+            )
+
+    return TranslateBatchResponse(items=out, cache=translation_cache.stats())
+
 @app.get("/test-backend")
 def test_backend():
     """Simple test endpoint"""
@@ -527,6 +1538,8 @@ def seed_agent(db: Session = Depends(get_db)):
         for agent in agents:
             agent.status = "available"
         db.commit()
+        call_stats.rebuild(db)
+        agent_directory.rebuild(agents)
         return {"message": f"Set {agent_count} agents to available", "agents": [{"name": agent.fullname, "status": agent.status} for agent in agents]}
     
     # Create test agent
@@ -540,6 +1553,8 @@ def seed_agent(db: Session = Depends(get_db)):
     db.add(agent)
     db.commit()
     db.refresh(agent)
+    call_stats.agent_status_changed(None, agent.status)
+    agent_directory.update(agent)
     
     return {"message": "Agent created successfully", "agent": {"id": agent.id, "name": agent.fullname, "status": agent.status}}
 
@@ -566,7 +1581,12 @@ def generate_suggestions(session_id: int, db: Session = Depends(get_db)):
         )
         db.add(session_guide)
 
+    event_log.append(db, session_id, "suggestions_updated", {
+        "question_suggestions": questions,
+        "department_suggestions": session_guide.department_suggestions
+    })
     db.commit()
+    session_store.set_guide(session_id, questions)
     return {"message": "Suggestions generated and saved", "questions": questions}
 
 
@@ -592,18 +1612,24 @@ class RecommendationsResponse(BaseModel):
     recommendations: List[AIRecommendation]
     message: str
 
-def generate_ai_recommendations(transcript: str, summary: List[str] = None) -> List[dict]:
-    """Generate AI recommendations based on transcript and summary"""
-    try:
-        # Combine transcript and summary for context
-        context = f"Emergency Call Transcript: {transcript}"
-        if summary:
-            context += f"\n\nSummary Points: {', '.join(summary)}"
-        
-        prompt = f"""
-Based on this emergency call transcript, generate 3-5 specific recommendations for what information should be ADDED to the situation summary.
+RECOMMENDATIONS_TOOL = items_tool(
+    "record_recommendations",
+    "Record the recommendations for the situation summary.",
+    {
+        "type": "object",
+        "properties": {
+            "type": {"type": "string", "enum": ["advice", "warning", "protocol"]},
+            "priority": {"type": "string", "enum": ["high", "medium", "low"]},
+            "title": {"type": "string", "minLength": 1},
+            "content": {"type": "string", "minLength": 1},
+            "confidence": {"type": "integer", "minimum": 1, "maximum": 100},
+        },
+        "required": ["type", "priority", "title", "content", "confidence"],
+    },
+)
 
-{context}
+RECOMMENDATIONS_INSTRUCTIONS = """
+Based on the emergency call transcript you are given, generate 3-5 specific recommendations for what information should be ADDED to the situation summary.
 
 Each recommendation should suggest specific details, facts, or observations from the audio that should be included in the written situation summary to help emergency responders understand the scene better.
 
@@ -614,48 +1640,64 @@ For each recommendation, provide:
 4. Content: Specific text or information that should be added to the summary
 5. Confidence: 1-100 based on how clearly this info is mentioned in the audio
 
+If relevant local protocols are listed with the transcript, base 'protocol' recommendations on them instead of describing procedures from memory.
+
 Focus on:
 - Specific details mentioned in the audio that aren't in the current summary
 - Missing critical information that should be documented
 - Location specifics, victim conditions, hazards, timeline details
 - Information that would help dispatchers and responders
 
-Format as JSON array with this structure:
-[
-  {{
-    "type": "advice",
-    "priority": "high", 
-    "title": "Add Victim Count Details",
-    "content": "Include that there are 2 occupants trapped - one responsive, one unresponsive. This helps medical teams prepare appropriate resources.",
-    "confidence": 95
-  }},
-  {{
-    "type": "warning",
-    "priority": "high", 
-    "title": "Document Fire Hazard",
-    "content": "Add 'Engine compartment showing smoke - potential fire risk' to alert fire department of immediate hazard.",
-    "confidence": 88
-  }}
-]
-
-Provide only the JSON array, no other text.
+Examples:
+- advice, high, "Add Victim Count Details": "Include that there are 2 occupants trapped - one responsive, one unresponsive. This helps medical teams prepare appropriate resources." (confidence 95)
+- warning, high, "Document Fire Hazard": "Add 'Engine compartment showing smoke - potential fire risk' to alert fire department of immediate hazard." (confidence 88)
+
+Record the recommendations with the record_recommendations tool.
 """
 
-        response = claude.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": prompt}]
+def fit_transcript(transcript: str, prompt: str) -> str:
+    """Trim a transcript to TRANSCRIPT_TOKEN_BUDGET, counting what was dropped per prompt kind"""
+    trimmed, original_tokens, kept_tokens = trim_transcript(transcript, TRANSCRIPT_TOKEN_BUDGET, EMERGENCY_KEYWORDS)
+    if kept_tokens < original_tokens:
+        TRANSCRIPTS_TRIMMED.inc(prompt=prompt)
+        TRANSCRIPT_TOKENS_DROPPED.inc(original_tokens - kept_tokens, prompt=prompt)
+    return trimmed
+
+def build_call_context(transcript: str, summary: List[str] = None, protocols: List[dict] = None) -> str:
+    """Transcript (trimmed to TRANSCRIPT_TOKEN_BUDGET), summary points and matched protocols: the per-call part of a prompt"""
+    context = f"Emergency Call Transcript: {fit_transcript(transcript, 'call_context')}"
+    if summary:
+        context += f"\n\nSummary Points: {', '.join(summary)}"
+    if protocols:
+        context += f"\n\nRelevant local protocols:\n{protocol_context(protocols)}"
+    return context
+
+def protocol_recommendations(protocols: List[dict]) -> List[dict]:
+    """Matched protocols as recommendation items (used when Claude is unavailable)"""
+    return [
+        {
+            "type": "protocol",
+            "priority": protocol["priority"],
+            "title": protocol["title"],
+            "content": " ".join(protocol["steps"][:3]),
+            "confidence": min(95, int(50 + 5 * protocol["score"]))
+        }
+        for protocol in protocols
+    ]
+
+def generate_ai_recommendations(transcript: str, summary: List[str] = None) -> List[dict]:
+    """Generate AI recommendations based on transcript and summary"""
+    protocols = protocol_index.search(transcript, k=PROTOCOL_MATCHES)
+    try:
+        recommendations = generate_items(
+            claude,
+            "claude-3-5-sonnet-20241022",
+            1000,
+            RECOMMENDATIONS_TOOL,
+            build_call_context(transcript, summary, protocols),
+            system=cached_system(RECOMMENDATIONS_INSTRUCTIONS)
         )
         
-        # Parse Claude's response
-        recommendations_text = response.content[0].text.strip()
-        
-        # Remove any markdown formatting if present
-        if recommendations_text.startswith('```json'):
-            recommendations_text = recommendations_text.replace('```json', '').replace('```', '').strip()
-        
-        recommendations = json.loads(recommendations_text)
-        
         # Add unique IDs
         for i, rec in enumerate(recommendations):
             rec['id'] = f"ai-rec-{i+1}"
@@ -664,10 +1706,9 @@ Provide only the JSON array, no other text.
         
     except Exception as e:
         print(f"Error generating AI recommendations: {e}")
-        # Return fallback recommendations
-        return [
+        # Return fallback recommendations, led by the locally matched protocols
+        fallback = protocol_recommendations(protocols) + [
             {
-                "id": "ai-rec-1",
                 "type": "advice",
                 "priority": "high",
                 "title": "Assess Scene Safety",
@@ -675,7 +1716,6 @@ Provide only the JSON array, no other text.
                 "confidence": 85
             },
             {
-                "id": "ai-rec-2", 
                 "type": "protocol",
                 "priority": "medium",
                 "title": "Establish Communication",
@@ -683,13 +1723,17 @@ Provide only the JSON array, no other text.
                 "confidence": 90
             }
         ]
+        for i, rec in enumerate(fallback):
+            rec['id'] = f"ai-rec-{i+1}"
+        return fallback
 
-@app.post("/generate-recommendations", response_model=RecommendationsResponse)
+@app.post("/generate-recommendations", response_model=RecommendationsResponse, dependencies=[Depends(admit_tool)])
 async def generate_recommendations(request: RecommendationRequest):
     """Generate AI recommendations based on emergency call transcript"""
     
     try:
-        recommendations = generate_ai_recommendations(
+        recommendations = await run_in_threadpool(
+            generate_ai_recommendations,
             transcript=request.transcript,
             summary=request.summary
         )
@@ -717,18 +1761,23 @@ class AgentSuggestionsResponse(BaseModel):
     suggestions: List[AgentSuggestion]
     message: str
 
-def generate_agent_communication_suggestions(transcript: str, summary: List[str] = None) -> List[dict]:
-    """Generate suggestions for what the agent should say to the caller"""
-    try:
-        # Combine transcript and summary for context
-        context = f"Emergency Call Transcript: {transcript}"
-        if summary:
-            context += f"\n\nSummary Points: {', '.join(summary)}"
-        
-        prompt = f"""
-Based on this emergency call transcript, generate 4-6 specific suggestions for what the human emergency agent should SAY to the caller to help them and gather more information.
+AGENT_SUGGESTIONS_TOOL = items_tool(
+    "record_agent_suggestions",
+    "Record what the agent should say to the caller.",
+    {
+        "type": "object",
+        "properties": {
+            "category": {"type": "string", "enum": ["safety", "medical", "location", "reassurance"]},
+            "suggestion": {"type": "string", "minLength": 1},
+            "priority": {"type": "integer", "minimum": 1, "maximum": 10},
+            "reasoning": {"type": "string", "minLength": 1},
+        },
+        "required": ["category", "suggestion", "priority", "reasoning"],
+    },
+)
 
-{context}
+AGENT_SUGGESTIONS_INSTRUCTIONS = """
+Based on the emergency call transcript you are given, generate 4-6 specific suggestions for what the human emergency agent should SAY to the caller to help them and gather more information.
 
 Each suggestion should be something the agent can directly say to the caller. Focus on:
 - Reassuring and calming the caller
@@ -742,40 +1791,25 @@ For each suggestion, provide:
 3. Priority: 1-10 (10 = most urgent to say)
 4. Reasoning: Why this is important to communicate
 
-Format as JSON array with this structure:
-[
-  {{
-    "category": "reassurance",
-    "suggestion": "I understand this is very frightening. You're doing great by calling us. Help is on the way.",
-    "priority": 9,
-    "reasoning": "Caller sounds panicked and needs immediate reassurance to stay calm and cooperative"
-  }},
-  {{
-    "category": "safety", 
-    "suggestion": "Please stay at a safe distance from the vehicle due to the smoke. Do not attempt to move the victims unless there's immediate danger.",
-    "priority": 10,
-    "reasoning": "Critical safety instruction to prevent caller from becoming another victim"
-  }}
-]
-
-Provide only the JSON array, no other text.
+Examples:
+- reassurance, priority 9: "I understand this is very frightening. You're doing great by calling us. Help is on the way." (Caller sounds panicked and needs immediate reassurance to stay calm and cooperative)
+- safety, priority 10: "Please stay at a safe distance from the vehicle due to the smoke. Do not attempt to move the victims unless there's immediate danger." (Critical safety instruction to prevent caller from becoming another victim)
+
+Record the suggestions with the record_agent_suggestions tool.
 """
 
-        response = claude.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": prompt}]
+def generate_agent_communication_suggestions(transcript: str, summary: List[str] = None) -> List[dict]:
+    """Generate suggestions for what the agent should say to the caller"""
+    try:
+        suggestions = generate_items(
+            claude,
+            "claude-3-5-sonnet-20241022",
+            1000,
+            AGENT_SUGGESTIONS_TOOL,
+            build_call_context(transcript, summary),
+            system=cached_system(AGENT_SUGGESTIONS_INSTRUCTIONS)
         )
         
-        # Parse Claude's response
-        suggestions_text = response.content[0].text.strip()
-        
-        # Remove any markdown formatting if present
-        if suggestions_text.startswith('```json'):
-            suggestions_text = suggestions_text.replace('```json', '').replace('```', '').strip()
-        
-        suggestions = json.loads(suggestions_text)
-        
         # Add unique IDs
         for i, suggestion in enumerate(suggestions):
             suggestion['id'] = f"agent-comm-{i+1}"
@@ -802,12 +1836,13 @@ Provide only the JSON array, no other text.
             }
         ]
 
-@app.post("/generate-agent-suggestions", response_model=AgentSuggestionsResponse)
+@app.post("/generate-agent-suggestions", response_model=AgentSuggestionsResponse, dependencies=[Depends(admit_tool)])
 async def generate_agent_suggestions(request: RecommendationRequest):
     """Generate suggestions for what the agent should say to the caller"""
     
     try:
-        suggestions = generate_agent_communication_suggestions(
+        suggestions = await run_in_threadpool(
+            generate_agent_communication_suggestions,
             transcript=request.transcript,
             summary=request.summary
         )
@@ -826,10 +1861,11 @@ async def generate_agent_suggestions(request: RecommendationRequest):
 # ----------------------------------------------------------------------------
 # ----------------------------------------------------------------------------
 # ----------------------------------------------------------------------------
+EMERGENCY_KEYWORDS = ["heart attack", "unconscious", "severe bleeding", "not breathing"]
+
 def detect_emergency_keywords(message: str) -> bool:
-    keywords = ["heart attack", "unconscious", "severe bleeding", "not breathing"]
     message_lower = message.lower()
-    return any(keyword in message_lower for keyword in keywords)
+    return any(keyword in message_lower for keyword in EMERGENCY_KEYWORDS)
 
 
 
@@ -838,3 +1874,5 @@ def detect_emergency_keywords(message: str) -> bool:
 
 
 # ----------------------------------------------------------------------------
+
+record_startup_phase("imports", time.perf_counter() - _import_started)
@@ -0,0 +1,272 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are kept in memory and rendered by
+`render_metrics()` for the /metrics endpoint. `stage()` times one step of the
+hot path (upload read, decode, Whisper inference, Claude request, JSON parse,
+DB commit) into a shared histogram and, when a trace is active, into that
+trace's stage breakdown so one call can be followed across requests by its
+X-Trace-Id.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+import time
+import uuid
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the (unlabelled) value lazily at scrape time"""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                return [f"{self.name} {float(self._function())}"]
+            except Exception as e:
+                print(f"Metric {self.name} collection failed: {e}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# -------- Application metrics --------
+REQUEST_DURATION = Histogram(
+    "sosai_http_request_duration_seconds", "HTTP request latency by endpoint", ("method", "route", "status"))
+INFLIGHT_REQUESTS = Gauge("sosai_inflight_requests", "HTTP requests currently being served")
+INFLIGHT_JOBS = Gauge("sosai_inflight_jobs", "Transcription / Claude jobs currently running", ("kind",))
+ACTIVE_SESSIONS = Gauge("sosai_active_sessions", "Chat sessions with status ongoing or emergency")
+STAGE_DURATION = Histogram("sosai_stage_duration_seconds", "Hot-path stage latency", ("stage",))
+CLAUDE_REQUESTS = Counter("sosai_claude_requests_total", "Claude API requests", ("model", "outcome"))
+STARTUP_PHASE = Gauge("sosai_startup_phase_seconds", "Duration of each startup phase", ("phase",))
+CLAUDE_TOKENS = Counter("sosai_claude_tokens_total", "Claude tokens used", ("model", "direction"))
+TRANSCRIPTS_TRIMMED = Counter("sosai_transcripts_trimmed_total", "Transcripts cut down to TRANSCRIPT_TOKEN_BUDGET", ("prompt",))
+TRANSCRIPT_TOKENS_DROPPED = Counter("sosai_transcript_tokens_dropped_total", "Transcript tokens left out of prompts", ("prompt",))
+
+
+# -------- Tracing --------
+_current_trace: ContextVar[Optional[dict]] = ContextVar("sosai_trace", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def begin_trace(trace_id: str):
+    """Start collecting stage timings for the current request; returns a reset token"""
+    return _current_trace.set({"trace_id": trace_id, "stages": []})
+
+
+def end_trace(token) -> Optional[dict]:
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    return trace
+
+
+def current_trace() -> Optional[dict]:
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time one hot-path stage into STAGE_DURATION and the active trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["stages"].append((name, elapsed))
+
+
+@contextmanager
+def inflight(kind: str):
+    INFLIGHT_JOBS.inc(kind=kind)
+    try:
+        yield
+    finally:
+        INFLIGHT_JOBS.dec(kind=kind)
+
+
+# -------- Claude client instrumentation --------
+class _InstrumentedMessages:
+    def __init__(self, messages):
+        self._messages = messages
+        self.recent = deque(maxlen=200)  # (timestamp, ok) of the latest requests
+
+    def create(self, **kwargs):
+        model = kwargs.get("model", "")
+        with stage("claude_request"), inflight("claude"):
+            try:
+                response = self._messages.create(**kwargs)
+            except Exception:
+                CLAUDE_REQUESTS.inc(model=model, outcome="error")
+                self.recent.append((time.time(), False))
+                raise
+        CLAUDE_REQUESTS.inc(model=model, outcome="ok")
+        self.recent.append((time.time(), True))
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            tokens = {
+                direction: getattr(usage, field, 0) or 0
+                for direction, field in (
+                    ("input", "input_tokens"),
+                    ("output", "output_tokens"),
+                    ("cache_read", "cache_read_input_tokens"),
+                    ("cache_write", "cache_creation_input_tokens"),
+                )
+            }
+            for direction, count in tokens.items():
+                CLAUDE_TOKENS.inc(count, model=model, direction=direction)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.setdefault("claude_calls", []).append(dict(tokens, model=model))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._messages, name)
+
+
+class InstrumentedClient:
+    """Wraps an Anthropic client so every messages.create is timed and its token usage counted"""
+
+    def __init__(self, client):
+        self._client = client
+        self.messages = _InstrumentedMessages(client.messages)
+
+    def recent_error_rate(self, window: float = 300.0):
+        """Share of failed requests in the last `window` seconds, or None without traffic"""
+        cutoff = time.time() - window
+        outcomes = [ok for ts, ok in list(self.messages.recent) if ts >= cutoff]
+        if not outcomes:
+            return None
+        return outcomes.count(False) / len(outcomes)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -5,7 +5,7 @@ Created on Sat Jul 26 13:33:40 2025
 @author: parsa
 """
 
-from sqlalchemy import Column, Integer, String, Float, Text, Boolean, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, Integer, String, Float, Text, Boolean, ForeignKey, DateTime, JSON, Index
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 
@@ -70,6 +70,91 @@ class ChatSessionGuide(Base):
     question_suggestions = Column(JSON)  # [{"question": "...", "priority": 1, "status": "not_asked"}]
     department_suggestions = Column(JSON)  # ["emergency", "neurology"]
 
+# ----------------------
+# Table: transcript_segment
+# ----------------------
+class TranscriptSegment(Base):
+    __tablename__ = "transcript_segment"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("chat_session.id"))
+    message_id = Column(Integer, ForeignKey("chat_message.id"))
+    start_time = Column(Float)  # seconds from the start of the recording
+    end_time = Column(Float)
+    text = Column(Text)
+    confidence = Column(Float)  # exp(avg_logprob) * (1 - no_speech_prob)
+
+    __table_args__ = (
+        Index("ix_transcript_segment_session_time", "session_id", "start_time"),
+        Index("ix_transcript_segment_message", "message_id"),
+    )
+
+# ----------------------
+# Table: audio_blob
+# ----------------------
+class AudioBlob(Base):
+    __tablename__ = "audio_blob"
+    sha256 = Column(String(64), primary_key=True)  # hash of the uploaded bytes
+    path = Column(String, nullable=True)  # relative to the archive root, NULL once evicted
+    codec = Column(String)  # original / opus
+    original_size = Column(Integer)
+    stored_size = Column(Integer)
+    duration = Column(Float)  # seconds of audio
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow)
+    evicted_at = Column(DateTime, nullable=True)
+
+# ----------------------
+# Table: audio_recording
+# ----------------------
+class AudioRecording(Base):
+    __tablename__ = "audio_recording"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("chat_session.id"))
+    message_id = Column(Integer, ForeignKey("chat_message.id"))
+    sha256 = Column(String(64), ForeignKey("audio_blob.sha256"))
+    filename = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_audio_recording_session", "session_id"),
+    )
 
+# ----------------------
+# Table: archived_session
+# ----------------------
+class ArchivedSession(Base):
+    __tablename__ = "archived_session"
+    session_id = Column(Integer, primary_key=True)  # chat_session.id before it moved to cold storage
+    day = Column(String(10))  # partition (YYYY-MM-DD of started_at)
+    user_agent_id = Column(Integer)
+    started_at = Column(DateTime)
+    ended_at = Column(DateTime)
+    handle_seconds = Column(Float)
+    message_count = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.utcnow)
 
+# ----------------------
+# Table: session_event
+# ----------------------
+class SessionEvent(Base):
+    __tablename__ = "session_event"
+    id = Column(Integer, primary_key=True)  # global append order
+    session_id = Column(Integer, ForeignKey("chat_session.id"))
+    type = Column(String)  # call_started / agent_assigned / message_added / status_changed / suggestions_updated / call_ended
+    payload = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_session_event_session", "session_id", "id"),
+        {"sqlite_autoincrement": True},  # ids are never handed out twice, even after archiving
+    )
+
+# ----------------------
+# Table: session_snapshot
+# ----------------------
+class SessionSnapshot(Base):
+    __tablename__ = "session_snapshot"
+    session_id = Column(Integer, primary_key=True)
+    last_event_id = Column(Integer)  # state includes every event up to this id
+    state = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
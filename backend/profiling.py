@@ -0,0 +1,183 @@
+"""
+On-demand diagnostics for a running worker.
+
+Nothing here costs anything until it is switched on:
+
+- SamplingProfiler: for a bounded number of seconds a background thread reads
+  the stack of every other thread (sys._current_frames) at a fixed interval
+  and counts identical stacks. The result is in the folded format read by
+  flamegraph.pl and speedscope ("thread;outer (file:line);...;leaf count").
+  Time spent in Whisper, ffmpeg subprocesses, SQLAlchemy or socket reads to
+  Claude shows up under the frames that wait for it.
+- MemoryTracer: tracemalloc, started on demand, with a baseline snapshot and
+  diffs against it to find allocations that keep growing (e.g. upload
+  buffers in process_audio).
+- SlowRequestLog: the last N requests slower than a threshold, with their
+  stage breakdown, filled by the tracing middleware.
+"""
+
+from collections import Counter as StackCounts, deque
+from datetime import datetime
+from threading import Lock
+from typing import List, Optional
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from metrics import Counter
+
+SLOW_REQUESTS = Counter("sosai_slow_requests_total", "Requests slower than SLOW_REQUEST_MS", ("route",))
+
+# Leaf frames of threads that are parked rather than working (idle pool workers, the event loop)
+_IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+# -------- CPU / wall-clock sampling --------
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_seconds = max_seconds
+        self._lock = Lock()  # one profile per process at a time
+
+    def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> dict:
+        """Sample every thread for `seconds`; blocks the calling thread until done"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running in this worker")
+        try:
+            seconds = max(0.1, min(seconds, self.max_seconds))
+            stacks = StackCounts()
+            started = time.perf_counter()
+            self._sample(stacks, seconds, interval, include_idle)
+            return {
+                "seconds": round(time.perf_counter() - started, 3),
+                "interval_ms": interval * 1000,
+                "samples": sum(stacks.values()),
+                "folded": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+            }
+        finally:
+            self._lock.release()
+
+    def _sample(self, stacks: StackCounts, seconds: float, interval: float, include_idle: bool):
+        me = threading.get_ident()  # the sampling thread itself is left out
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if not include_idle and leaf in _IDLE_LEAVES:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+
+
+# -------- Memory --------
+class MemoryTracer:
+    def __init__(self):
+        self._lock = Lock()
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_at: Optional[datetime] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 10):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(max(1, frames))
+            self._take_baseline()
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self.baseline = self.baseline_at = None
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def _take_baseline(self):
+        self.baseline = self._snapshot()
+        self.baseline_at = datetime.utcnow()
+
+    def diff(self, limit: int = 20, group_by: str = "lineno", filename: Optional[str] = None, rebase: bool = False) -> dict:
+        """Allocations that grew since the baseline, largest growth first"""
+        with self._lock:
+            if not tracemalloc.is_tracing() or self.baseline is None:
+                raise RuntimeError("tracemalloc is not running (POST /admin/tracemalloc/start first)")
+            current = self._snapshot()
+            baseline = self.baseline
+            if filename:
+                keep = (tracemalloc.Filter(True, f"*{filename}"),)
+                current, baseline = current.filter_traces(keep), baseline.filter_traces(keep)
+            stats = current.compare_to(baseline, group_by)
+            traced, peak = tracemalloc.get_traced_memory()
+            result = {
+                "baseline_at": self.baseline_at,
+                "traced_bytes": traced,
+                "peak_bytes": peak,
+                "top": [
+                    {
+                        "where": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                        "size_diff_bytes": stat.size_diff,
+                        "size_bytes": stat.size,
+                        "count_diff": stat.count_diff,
+                        "count": stat.count,
+                    }
+                    for stat in stats[:limit]
+                ],
+            }
+            if rebase:
+                self._take_baseline()
+            return result
+
+
+# -------- Slow requests --------
+class SlowRequestLog:
+    def __init__(self, threshold_ms: float, size: int = 200):
+        self.threshold = threshold_ms / 1000 if threshold_ms > 0 else None
+        self._entries = deque(maxlen=size)
+
+    def record(self, method: str, path: str, route: str, status: int, elapsed: float, trace: dict):
+        entry = {
+            "at": datetime.utcnow(),
+            "trace_id": trace.get("trace_id"),
+            "method": method,
+            "path": path,
+            "route": route,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 1),
+            "stages": [{"stage": name, "ms": round(duration * 1000, 1)} for name, duration in trace.get("stages", [])],
+            "claude_calls": trace.get("claude_calls", []),
+        }
+        self._entries.append(entry)
+        SLOW_REQUESTS.inc(route=route)
+        stages = " ".join(f"{s['stage']}={s['ms']}ms" for s in entry["stages"])
+        print(f"Slow request {method} {path} {status} {entry['duration_ms']}ms {stages}")
+
+    def recent(self, limit: int = 50, route: Optional[str] = None) -> List[dict]:
+        entries = [e for e in reversed(self._entries) if route is None or e["route"] == route]
+        return entries[:limit]
@@ -0,0 +1,88 @@
+"""
+Prompt assembly helpers: token counting, transcript trimming and cacheable
+instruction prefixes.
+
+Static instructions are sent as a system block marked with cache_control so
+Anthropic can reuse the processed prefix between calls. Only the transcript
+changes from call to call. Transcripts are trimmed to a token budget: sentences
+that mention an emergency keyword are always kept, and the rest of the budget
+goes to the most recent sentences, so long calls never hit the context limit.
+"""
+
+from typing import List, Tuple
+import re
+
+TRIM_MARKER = "[…]"
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_encoder = None
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:  # tiktoken missing or its vocabulary cannot be downloaded
+            print(f"tiktoken unavailable, estimating tokens from length: {e}")
+            _encoder = False
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken's cl100k_base (a close proxy for Claude's tokenizer)"""
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def cached_system(instructions: str) -> List[dict]:
+    """System prompt block that Anthropic may cache between calls"""
+    return [{"type": "text", "text": instructions.strip(), "cache_control": {"type": "ephemeral"}}]
+
+
+def trim_transcript(transcript: str, budget: int, keywords: List[str]) -> Tuple[str, int, int]:
+    """
+    Fit a transcript into `budget` tokens. Returns (text, original_tokens, kept_tokens).
+    Keyword-flagged sentences are kept first, then the most recent ones;
+    the original order is preserved and gaps are marked with TRIM_MARKER.
+    """
+    original_tokens = count_tokens(transcript)
+    if original_tokens <= budget:
+        return transcript, original_tokens, original_tokens
+
+    sentences = [s.strip() for s in _SENTENCE_RE.split(transcript) if s.strip()]
+    costs = [count_tokens(s) + 1 for s in sentences]
+    keep = set()
+    remaining = budget
+
+    flagged = [i for i, s in enumerate(sentences) if any(k in s.lower() for k in keywords)]
+    for i in reversed(flagged):  # newest flagged first if even those don't all fit
+        if costs[i] <= remaining:
+            keep.add(i)
+            remaining -= costs[i]
+
+    for i in reversed(range(len(sentences))):
+        if i in keep:
+            continue
+        if costs[i] > remaining:
+            break
+        keep.add(i)
+        remaining -= costs[i]
+
+    if not keep:
+        # Not even the last sentence fits: keep the tail of the transcript
+        text = f"{TRIM_MARKER} {transcript[-budget * 4:]}"
+        return text, original_tokens, count_tokens(text)
+
+    parts = []
+    previous = -1
+    for i in sorted(keep):
+        if i != previous + 1:
+            parts.append(TRIM_MARKER)
+        parts.append(sentences[i])
+        previous = i
+    text = " ".join(parts)
+    return text, original_tokens, count_tokens(text)
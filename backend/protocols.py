@@ -0,0 +1,158 @@
+"""
+Local retrieval of emergency protocols.
+
+The protocol corpus is a directory of short markdown files:
+
+    # Title
+    keywords: comma, separated, trigger phrases (any language)
+    priority: high | medium | low
+
+    One instruction per line...
+
+It is indexed with BM25 at startup. Titles and keywords are weighted above the
+instructions, and a keyword phrase found verbatim in the query adds a bonus.
+Queries take well under a millisecond, so every new transcript segment can be
+matched without a Claude round trip. The matches are also given to the
+recommendations prompt, so the model cites real protocols instead of
+inventing them.
+"""
+
+from collections import Counter as TermCounts
+from typing import Dict, List, Optional
+import math
+import os
+import re
+import unicodedata
+
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 3
+KEYWORD_WEIGHT = 2
+PHRASE_BONUS = 1.5  # per keyword phrase found verbatim in the query
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "do", "for", "from", "has", "have", "he", "her",
+    "his", "i", "if", "in", "into", "is", "it", "its", "me", "my", "no", "not", "of", "on", "or",
+    "our", "she", "so", "that", "the", "their", "them", "there", "they", "this", "to", "up", "was",
+    "we", "were", "what", "with", "you", "your",
+    "au", "aux", "ce", "ces", "dans", "de", "des", "du", "elle", "en", "est", "et", "il", "je",
+    "la", "le", "les", "ma", "mon", "ne", "nous", "ou", "par", "pas", "pour", "que", "qui", "sa",
+    "se", "son", "sur", "un", "une", "vous",
+}
+# Negations such as "not" / "pas" are ignored as single terms but still count inside
+# keyword phrases ("not breathing", "ne respire pas"), which match on the raw words.
+
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def words(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def stem(word: str) -> str:
+    """Very light suffix stripping: "bleeding" / "bleeds" -> "bleed" """
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    return [stem(w) for w in words(text) if len(w) > 1 and w not in STOP_WORDS]
+
+
+def parse_protocol(protocol_id: str, text: str) -> dict:
+    title, keywords, priority, steps = protocol_id, [], "medium", []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("# "):
+            title = line[2:].strip()
+        elif line.lower().startswith("keywords:"):
+            keywords = [k.strip() for k in line.split(":", 1)[1].split(",") if k.strip()]
+        elif line.lower().startswith("priority:"):
+            priority = line.split(":", 1)[1].strip().lower()
+        else:
+            steps.append(line)
+    return {"id": protocol_id, "title": title, "keywords": keywords, "priority": priority, "steps": steps}
+
+
+class ProtocolIndex:
+    def __init__(self, protocols: List[dict]):
+        self.protocols = protocols
+        self.postings: Dict[str, Dict[int, int]] = {}  # term -> {doc: weighted term frequency}
+        self.lengths: List[int] = []
+        self.phrases: List[List[tuple]] = []  # per doc: keyword phrases as word tuples
+        for doc, protocol in enumerate(protocols):
+            counts = TermCounts(terms(" ".join(protocol["steps"])))
+            for term in terms(protocol["title"]):
+                counts[term] += TITLE_WEIGHT
+            for term in terms(" ".join(protocol["keywords"])):
+                counts[term] += KEYWORD_WEIGHT
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[doc] = count
+            self.lengths.append(sum(counts.values()))
+            self.phrases.append([tuple(words(k)) for k in protocol["keywords"] if len(words(k)) > 1])
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(protocols) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    @classmethod
+    def load(cls, directory: str) -> "ProtocolIndex":
+        protocols = []
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".md"):
+                    with open(os.path.join(directory, name), encoding="utf-8") as f:
+                        protocols.append(parse_protocol(name[:-3], f.read()))
+        else:
+            print(f"Protocol directory {directory} not found, protocol retrieval disabled")
+        print(f"Protocol index: {len(protocols)} protocols")
+        return cls(protocols)
+
+    def __len__(self):
+        return len(self.protocols)
+
+    def search(self, text: str, k: int = 3, min_score: float = 2.0) -> List[dict]:
+        """Top-k protocols for a transcript (segment), best first"""
+        if not self.protocols or not text:
+            return []
+        scores: Dict[int, float] = {}
+        matched: Dict[int, set] = {}
+        for term in set(terms(text)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for doc, tf in docs.items():
+                norm = K1 * (1 - B + B * self.lengths[doc] / self.average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+                matched.setdefault(doc, set()).add(term)
+
+        query = " " + " ".join(words(text)) + " "
+        for doc, phrases in enumerate(self.phrases):
+            for phrase in phrases:
+                if f" {' '.join(phrase)} " in query:
+                    scores[doc] = scores.get(doc, 0.0) + PHRASE_BONUS * len(phrase)
+                    matched.setdefault(doc, set()).add(" ".join(phrase))
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [
+            dict(self.protocols[doc], score=round(score, 2), matched=sorted(matched[doc]))
+            for doc, score in ranked[:k]
+            if score >= min_score
+        ]
+
+
+def protocol_context(matches: List[dict], max_steps: int = 4) -> Optional[str]:
+    """Matched protocols as prompt text, or None when nothing matched"""
+    if not matches:
+        return None
+    return "\n\n".join(
+        f"{match['title']} (priority {match['priority']}):\n" + "\n".join(f"- {step}" for step in match["steps"][:max_steps])
+        for match in matches
+    )
@@ -0,0 +1,229 @@
+"""
+Full-text search over call transcripts (SQLite FTS5).
+
+Messages are indexed in external-content FTS5 tables that point back at
+chat_message, so the text is stored only once. English messages go through
+the porter stemmer ("bleeding" matches "bleed"); every other language uses
+unicode61 with diacritics folded ("epaule" matches "épaule"). The index is
+written in the same transaction as the message (see send_message and
+process_audio) and backfilled once when the tables are first created.
+
+bm25() scores of the two tables come from different corpus statistics and
+cannot be compared, so each table is ranked on its own and the two rankings
+are interleaved by reciprocal-rank fusion: a hit at position p scores
+1 / (RRF_K + p).
+
+Other databases have no FTS5: search falls back to a case-insensitive
+substring match on chat_message, newest first, ranked by position alone.
+"""
+
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+import re
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+# index table -> FTS5 tokenizer
+FTS_TABLES = {
+    "message_fts_en": "porter unicode61 remove_diacritics 2",
+    "message_fts": "unicode61 remove_diacritics 2",
+}
+STEMMED_LANGUAGES = {"english", "en"}
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def fts_table_for(language: Optional[str]) -> str:
+    return "message_fts_en" if (language or "").strip().lower() in STEMMED_LANGUAGES else "message_fts"
+
+
+def search_supported(engine) -> bool:
+    return engine.dialect.name == "sqlite"
+
+
+def init_search_index(engine):
+    """Create the FTS tables if needed and backfill them from existing messages"""
+    if not search_supported(engine):
+        print(f"Full-text search disabled: {engine.dialect.name} is not supported")
+        return
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        for table, tokenizer in FTS_TABLES.items():
+            if table in existing:
+                continue
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {table} USING fts5("
+                f"message, content='chat_message', content_rowid='id', tokenize='{tokenizer}')"
+            ))
+            _backfill(conn, table)
+
+
+def _language_condition(table: str) -> str:
+    # The language of a message is its sender's language (AI summaries follow the caller)
+    language = (
+        "CASE WHEN m.sender_type = 'agent' THEN a.language ELSE c.language END"
+    )
+    stemmed = ", ".join(f"'{l}'" for l in sorted(STEMMED_LANGUAGES))
+    return f"lower(coalesce({language}, '')) {'IN' if table == 'message_fts_en' else 'NOT IN'} ({stemmed})"
+
+
+def _backfill(conn, table: str):
+    condition = _language_condition(table)
+    conn.execute(text(
+        f"INSERT INTO {table}(rowid, message) "
+        f"SELECT m.id, m.message FROM chat_message m "
+        f"JOIN chat_session s ON s.id = m.session_id "
+        f"LEFT JOIN user_caller c ON c.id = s.user_caller_id "
+        f"LEFT JOIN user_agent a ON a.id = s.user_agent_id "
+        f"WHERE m.message IS NOT NULL AND {condition}"
+    ))
+
+
+def index_messages(db: Session, messages: Iterable[Tuple[int, str, Optional[str]]]):
+    """Add (message_id, text, language) rows to the index inside the caller's transaction"""
+    if not search_supported(db.get_bind()):
+        return
+    by_table = {}
+    for message_id, message, language in messages:
+        if message:
+            by_table.setdefault(fts_table_for(language), []).append({"id": message_id, "message": message})
+    for table, rows in by_table.items():
+        db.execute(text(f"INSERT INTO {table}(rowid, message) VALUES (:id, :message)"), rows)
+
+
+def unindex_messages(db: Session, messages: Iterable[Tuple[int, str]]):
+    """
+    Remove (message_id, text) rows from the index inside the caller's transaction.
+    An external-content table can only forget a row given its original text, and
+    only in the table that indexed it, which is looked up in its _docsize table.
+    """
+    if not search_supported(db.get_bind()):
+        return
+    texts = {message_id: message for message_id, message in messages if message}
+    ids = list(texts)
+    for table in FTS_TABLES:
+        indexed = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            indexed += db.execute(
+                text(f"SELECT id FROM {table}_docsize WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": chunk}
+            ).scalars().all()
+        if indexed:
+            db.execute(
+                text(f"INSERT INTO {table}({table}, rowid, message) VALUES ('delete', :id, :message)"),
+                [{"id": message_id, "message": texts[message_id]} for message_id in indexed]
+            )
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, a trailing * keeps prefix search"""
+    terms = []
+    for token in _TOKEN_RE.findall(query):
+        word = token.rstrip("*")
+        terms.append(f'"{word}"*' if token.endswith("*") else f'"{word}"')
+    return " ".join(terms)
+
+
+def search_messages(
+    db: Session,
+    query: str,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    language: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0
+) -> List[dict]:
+    """Ranked matches (best first) with highlighted snippets"""
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    filters = []
+    params = {"match": match, "limit": limit, "offset": offset, "window": limit + offset, "k": RRF_K}
+    if status:
+        filters.append("s.status = :status")
+        params["status"] = status
+    if date_from:
+        filters.append("m.created_at >= :date_from")
+        params["date_from"] = date_from.isoformat(sep=" ")
+    if date_to:
+        filters.append("m.created_at <= :date_to")
+        params["date_to"] = date_to.isoformat(sep=" ")
+    if not search_supported(db.get_bind()):
+        return _search_like(db, query, filters, params, language)
+    where = "".join(f" AND {f}" for f in filters)
+    tables = [fts_table_for(language)] if language else list(FTS_TABLES)
+
+    # Each table's own best `window` hits, numbered by its bm25 order
+    selects = [
+        f"SELECT ranked.*, 1.0 / (:k + ROW_NUMBER() OVER (ORDER BY ranked.score)) AS fused FROM ("
+        f"SELECT {table}.rowid AS message_id, bm25({table}) AS score, "
+        f"snippet({table}, 0, '[', ']', '…', 12) AS snippet, "
+        f"m.session_id, m.sender_type, m.created_at, s.status "
+        f"FROM {table} "
+        f"JOIN chat_message m ON m.id = {table}.rowid "
+        f"JOIN chat_session s ON s.id = m.session_id "
+        f"WHERE {table} MATCH :match{where} "
+        f"ORDER BY score LIMIT :window) AS ranked"
+        for table in tables
+    ]
+    sql = (
+        f"SELECT * FROM ({' UNION ALL '.join(selects)}) AS hits "
+        f"ORDER BY hits.fused DESC, hits.message_id DESC LIMIT :limit OFFSET :offset"
+    )
+    rows = db.execute(text(sql), params).mappings().all()
+    return _hits(rows)
+
+
+def _hits(rows) -> List[dict]:
+    return [
+        {
+            "message_id": row["message_id"],
+            "session_id": row["session_id"],
+            "sender_type": row["sender_type"],
+            "created_at": row["created_at"],
+            "session_status": row["status"],
+            "snippet": row["snippet"],
+            "rank": row["fused"],
+        }
+        for row in rows
+    ]
+
+
+def _search_like(db: Session, query: str, filters: List[str], params: dict, language: Optional[str]) -> List[dict]:
+    """Substring fallback for databases without FTS5: every word must appear, newest first"""
+    words = [token.rstrip("*").lower() for token in _TOKEN_RE.findall(query)]
+    for i, word in enumerate(words):
+        escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filters.append(f"lower(m.message) LIKE :word{i} ESCAPE '\\'")
+        params[f"word{i}"] = f"%{escaped}%"
+    if language:
+        filters.append(_language_condition(fts_table_for(language)))
+    rows = db.execute(text(
+        "SELECT m.id AS message_id, m.message, m.session_id, m.sender_type, m.created_at, s.status "
+        "FROM chat_message m "
+        "JOIN chat_session s ON s.id = m.session_id "
+        "LEFT JOIN user_caller c ON c.id = s.user_caller_id "
+        "LEFT JOIN user_agent a ON a.id = s.user_agent_id "
+        f"WHERE {' AND '.join(filters)} "
+        "ORDER BY m.created_at DESC, m.id DESC LIMIT :limit OFFSET :offset"
+    ), params).mappings().all()
+    return _hits([
+        dict(row, snippet=_snippet(row["message"], words), fused=1.0 / (RRF_K + params["offset"] + position))
+        for position, row in enumerate(rows, start=1)
+    ])
+
+
+def _snippet(message: str, words: List[str], size: int = 12) -> str:
+    """Up to `size` words around the first match, matches in [brackets] as FTS5 snippet() does"""
+    pattern = re.compile("|".join(re.escape(word) for word in words), re.IGNORECASE)
+    tokens = message.split()
+    first = next((i for i, token in enumerate(tokens) if pattern.search(token)), 0)
+    start = max(0, min(first - size // 2, len(tokens) - size))
+    window = " ".join(tokens[start:start + size])
+    window = pattern.sub(lambda m: f"[{m.group(0)}]", window)
+    return ("…" if start > 0 else "") + window + ("…" if start + size < len(tokens) else "")
@@ -0,0 +1,285 @@
+"""
+In-memory store for active calls with write-behind message persistence.
+
+A live call is read many times (every send_message checks the session, every
+live-feed poll reads all messages) and only ever grows by appending, so the
+session metadata, its message tail and its question guide are kept in memory
+from start_call until end_call. New messages are appended to the tail at once
+and queued; a background thread writes the queue every `flush_interval`
+seconds in one transaction, together with their full-text index rows. That
+interval is the durability window: at most that much acknowledged chat can
+be lost if the process dies. The queue is also flushed when it reaches
+`max_pending`, when a call ends and at shutdown. Each flushed message and
+each status change is appended to the session event log (event_log.py) in
+the same transaction.
+
+Each worker process has its own store, so with several workers the store
+must be disabled (every write goes straight to the database) unless
+requests for a session are routed to the same worker. A disabled store reads
+only the session columns each request needs; the message tail and guide are
+loaded only for the live feed.
+"""
+
+from bisect import insort
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional
+import time
+
+from metrics import Counter, Gauge
+from models import ChatMessage, ChatSession, ChatSessionGuide, UserAgent, UserCaller
+from search import index_messages
+import event_log
+
+WRITE_BEHIND_FLUSHED = Counter("sosai_write_behind_messages_total", "Messages persisted by the write-behind queue")
+WRITE_BEHIND_FAILURES = Counter("sosai_write_behind_failures_total", "Write-behind flushes that failed and were retried")
+WRITE_BEHIND_PENDING = Gauge("sosai_write_behind_pending", "Messages acknowledged but not yet persisted")
+CACHED_SESSIONS = Gauge("sosai_cached_sessions", "Active sessions held in memory")
+
+
+class ActiveSession:
+    __slots__ = (
+        "id", "status", "user_agent_id", "started_at", "caller_language", "agent_language",
+        "messages", "complete", "question_suggestions", "last_access",
+    )
+
+    def __init__(self, session, caller_language: Optional[str], agent_language: Optional[str]):
+        self.id = session.id
+        self.status = session.status
+        self.user_agent_id = session.user_agent_id
+        self.started_at = session.started_at
+        self.caller_language = caller_language
+        self.agent_language = agent_language
+        self.messages: List[dict] = []  # by created_at, oldest first
+        self.complete = True  # False once the tail no longer holds every message (or was never loaded)
+        self.question_suggestions = None
+        self.last_access = time.monotonic()
+
+    def language_of(self, sender_type: str) -> Optional[str]:
+        """Agent messages are in the agent's language, everything else in the caller's"""
+        return self.agent_language if sender_type == "agent" else self.caller_language
+
+
+def _message_dict(message: ChatMessage) -> dict:
+    return {
+        "sender_type": message.sender_type,
+        "message": message.message,
+        "confidence_score": message.confidence_score,
+        "unresolved": message.unresolved,
+        "created_at": message.created_at,
+    }
+
+
+class SessionStore:
+    def __init__(
+        self,
+        session_factory: Callable,
+        enabled: bool = True,
+        flush_interval: float = 0.2,
+        max_pending: int = 500,
+        tail_limit: int = 1000,
+        idle_seconds: float = 3600.0
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.tail_limit = tail_limit
+        self.idle_seconds = idle_seconds
+        self._sessions: Dict[int, ActiveSession] = {}
+        self._pending: List[dict] = []  # {"session_id", "row", "language"}
+        self._lock = Lock()
+        self._flush_lock = Lock()  # one flush at a time keeps the database in append order
+        self._stop = Event()
+        self._thread = None
+        WRITE_BEHIND_PENDING.set_function(lambda: len(self._pending))
+        CACHED_SESSIONS.set_function(lambda: len(self._sessions))
+
+    # -------- Lifecycle --------
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="session-write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and persist everything still queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                pass  # already logged; the batch stays queued for the next round
+            self._evict_idle()
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            pending = {item["session_id"] for item in self._pending}
+            for session_id in [s.id for s in self._sessions.values() if s.last_access < cutoff and s.id not in pending]:
+                del self._sessions[session_id]
+
+    # -------- Reads --------
+    def get(self, session_id: int, with_tail: bool = False) -> Optional[ActiveSession]:
+        """
+        The session from memory, loading it on first use; None if it does not exist.
+        A disabled store loads the message tail and guide only when `with_tail` is set.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.monotonic()
+                return session
+        session = self._load(session_id, with_tail or self.enabled)
+        if session is not None and self.enabled and session.status != "completed":
+            with self._lock:
+                session = self._sessions.setdefault(session_id, session)
+        return session
+
+    def _load(self, session_id: int, with_tail: bool) -> Optional[ActiveSession]:
+        db = self.session_factory()
+        try:
+            row = (
+                db.query(
+                    ChatSession.id, ChatSession.status, ChatSession.user_agent_id, ChatSession.started_at,
+                    UserCaller.language.label("caller_language"), UserAgent.language.label("agent_language")
+                )
+                .outerjoin(UserCaller, UserCaller.id == ChatSession.user_caller_id)
+                .outerjoin(UserAgent, UserAgent.id == ChatSession.user_agent_id)
+                .filter(ChatSession.id == session_id).first()
+            )
+            if row is None:
+                return None
+            session = ActiveSession(row, row.caller_language, row.agent_language)
+            if not with_tail:
+                session.complete = False
+                return session
+            messages = (
+                db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+                .order_by(ChatMessage.created_at.desc()).limit(self.tail_limit + 1).all()
+            )
+            session.complete = len(messages) <= self.tail_limit
+            session.messages = [_message_dict(m) for m in reversed(messages[:self.tail_limit])]
+            guide = db.query(ChatSessionGuide).filter(ChatSessionGuide.session_id == session_id).first()
+            session.question_suggestions = guide.question_suggestions if guide else None
+            return session
+        finally:
+            db.close()
+
+    # -------- Writes --------
+    def add(self, session: ChatSession, caller_language: Optional[str], agent_language: Optional[str]):
+        """Start tracking a call that was just created"""
+        if self.enabled:
+            with self._lock:
+                self._sessions[session.id] = ActiveSession(session, caller_language, agent_language)
+
+    def _append_tail(self, session: ActiveSession, message: dict):
+        # Audio turns are backdated to when they were spoken, so keep created_at order rather than arrival order
+        if session.messages and message["created_at"] < session.messages[-1]["created_at"]:
+            insort(session.messages, message, key=lambda m: m["created_at"])
+        else:
+            session.messages.append(message)
+        if len(session.messages) > self.tail_limit:
+            del session.messages[0]
+            session.complete = False
+
+    def append_message(
+        self,
+        session: ActiveSession,
+        sender_type: str,
+        message: str,
+        confidence_score: Optional[float] = None,
+        unresolved: bool = False
+    ):
+        """Acknowledge a message now and persist it within the durability window"""
+        row = {
+            "session_id": session.id,
+            "sender_type": sender_type,
+            "message": message,
+            "confidence_score": confidence_score,
+            "unresolved": unresolved,
+            "created_at": datetime.utcnow(),
+        }
+        with self._lock:
+            self._append_tail(session, {k: v for k, v in row.items() if k != "session_id"})
+            session.last_access = time.monotonic()
+            self._pending.append({"session_id": session.id, "row": row, "language": session.language_of(sender_type)})
+            backlog = len(self._pending)
+        if not self.enabled:
+            self.flush(session.id)
+        elif backlog >= self.max_pending:
+            self.flush()  # the flusher is falling behind: write on the request thread
+
+    def add_persisted(self, session_id: int, messages: List[ChatMessage]):
+        """Messages that were written to the database directly (e.g. audio transcripts)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                for message in messages:
+                    self._append_tail(session, _message_dict(message))
+
+    def set_status(self, session_id: int, status: str):
+        """Status changes are rare and important, so they are written immediately"""
+        db = self.session_factory()
+        try:
+            db.query(ChatSession).filter(ChatSession.id == session_id).update({"status": status})
+            event_log.append(db, session_id, "status_changed", {"status": status})
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.status = status
+
+    def set_guide(self, session_id: int, question_suggestions: list):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.question_suggestions = question_suggestions
+
+    def flush(self, session_id: Optional[int] = None) -> int:
+        """Persist queued messages (all, or one session's) in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if session_id is None:
+                    batch, self._pending = self._pending, []
+                else:
+                    batch = [item for item in self._pending if item["session_id"] == session_id]
+                    self._pending = [item for item in self._pending if item["session_id"] != session_id]
+            if not batch:
+                return 0
+            db = self.session_factory()
+            try:
+                rows = [ChatMessage(**item["row"]) for item in batch]
+                db.add_all(rows)
+                db.flush()
+                index_messages(db, [(row.id, row.message, item["language"]) for row, item in zip(rows, batch)])
+                event_log.append_rows(db, [event_log.message_event(row) for row in rows])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                # The flusher retries a queued batch; a disabled store writes through, so the
+                # request fails with it and nothing is left behind to be written twice on retry
+                if self.enabled:
+                    with self._lock:
+                        self._pending = batch + self._pending
+                WRITE_BEHIND_FAILURES.inc()
+                print(f"Write-behind flush of {len(batch)} message(s) failed: {e}")
+                raise
+            finally:
+                db.close()
+            WRITE_BEHIND_FLUSHED.inc(len(batch))
+            return len(batch)
+
+    def end(self, session_id: int):
+        """Persist the call's queued messages and drop it from memory"""
+        self.flush(session_id)
+        with self._lock:
+            self._sessions.pop(session_id, None)
@@ -0,0 +1,512 @@
+"""
+Gateway in front of the regional shards (see sharding.py).
+
+- POST /start-call goes to the caller's home shard. If that shard answers
+  503 (no free agent, overloaded) or cannot be reached, the call goes to the
+  next shard the overflow policy allows. The response adds `shard` and
+  `overflow`.
+- Requests for a session (a /live-feed/{id}-style path, ?session_id= or a
+  JSON body with session_id) go to the shard encoded in the id.
+- /stats, /audio-archive and /cold-storage add up every shard, /agents lists
+  them all and /search merges every shard's hits by rank. /shards reports
+  each shard's readiness. /audio/{sha256} is tried on each shard in turn.
+- Anything else goes to the shard named in an X-Shard header, or to the
+  default shard (tools that hold no call data: translation, protocols,
+  hospitals).
+
+Bodies are streamed in both directions, so audio uploads and Range playback
+are never buffered whole in the router. Only JSON request bodies, which may
+carry the session id, are read before routing.
+
+Run it (from backend/):
+    SHARDS_FILE=data/shards.json uvicorn shard_router:app --port 8000
+
+Local test, with one SQLite file per shard:
+    python shard_router.py --local --agents 2
+starts a backend per shard of the map (shard_<name>.db, uploads/<name>,
+archive/<name>) on ports 8001, 8002, ... and the router on 8000.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import anyio.from_thread
+import requests
+
+from geo import Gazetteer
+from metrics import Counter, render_metrics
+from sharding import OVERFLOW_POLICIES, Shard, ShardMap
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARDS_FILE = os.getenv("SHARDS_FILE", os.path.join(BACKEND_DIR, "data", "shards.json"))
+SHARD_OVERFLOW = os.getenv("SHARD_OVERFLOW")  # overrides the map's policy: nearest / neighbours / none
+SHARD_CONNECT_TIMEOUT = float(os.getenv("SHARD_CONNECT_TIMEOUT", "2"))
+SHARD_READ_TIMEOUT = float(os.getenv("SHARD_READ_TIMEOUT", "300"))  # audio processing can take minutes
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(BACKEND_DIR, "data", "gazetteer.csv"))
+
+SHARD_CALLS = Counter("sosai_shard_calls_total", "Calls started per shard", ("shard", "route"))  # route: home / overflow
+SHARD_REJECTED = Counter("sosai_shard_rejected_calls_total", "Calls no allowed shard could take", ("home",))
+SHARD_ERRORS = Counter("sosai_shard_errors_total", "Requests that could not reach a shard", ("shard",))
+
+# Paths that carry a session id; the rest are routed by ?session_id= or the JSON body
+_SESSION_PATH_RE = re.compile(r"^/(?:live-feed|end-call|generate-suggestions|sessions)/(\d+)(?:/|$)")
+_DROPPED_REQUEST_HEADERS = {"host", "content-length", "connection", "transfer-encoding", "x-shard"}
+_PASSED_RESPONSE_HEADERS = {
+    "content-type", "content-length", "content-encoding", "content-range", "accept-ranges", "content-disposition",
+    "cache-control", "etag", "last-modified", "x-trace-id", "server-timing", "x-claude-tokens", "retry-after",
+}
+_STREAM_CHUNK = 64 * 1024
+_SEARCH_PAGE_LIMIT = 100  # page_size cap of a backend's /search
+
+shard_map: Optional[ShardMap] = None
+_clients: Dict[str, requests.Session] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global shard_map
+    shard_map = ShardMap.load(SHARDS_FILE, Gazetteer.load(GAZETTEER_PATH), SHARD_OVERFLOW)
+    for shard in shard_map.shards:
+        _clients[shard.name] = requests.Session()
+    print(f"Shard router: {len(shard_map.shards)} shard(s), overflow={shard_map.overflow}, default={shard_map.default.name}")
+    yield
+    for client in _clients.values():
+        client.close()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:8080", "http://127.0.0.1:8080", "http://localhost:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+# -------- Forwarding --------
+def forward(shard: Shard, method: str, path: str, query: str, headers: dict, body, stream: bool = False) -> requests.Response:
+    """`body` is bytes or an iterable of chunks; with `stream` the response body is left unread"""
+    url = f"{shard.url}{path}" + (f"?{query}" if query else "")
+    try:
+        return _clients[shard.name].request(
+            method, url, headers=headers, data=body, stream=stream,
+            timeout=(SHARD_CONNECT_TIMEOUT, SHARD_READ_TIMEOUT), allow_redirects=False
+        )
+    except requests.RequestException:
+        SHARD_ERRORS.inc(shard=shard.name)
+        raise
+
+
+def _request_headers(request: Request) -> dict:
+    return {k: v for k, v in request.headers.items() if k.lower() not in _DROPPED_REQUEST_HEADERS}
+
+
+class RequestBody:
+    """
+    The client's body as the iterable requests sends, pulled chunk by chunk
+    from the event loop by the worker thread that forwards it. Its length (when
+    the client sent Content-Length) keeps the upstream request un-chunked.
+    """
+
+    def __init__(self, request: Request, length: int):
+        self._chunks = request.stream()
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            try:
+                chunk = anyio.from_thread.run(self._chunks.__anext__)
+            except StopAsyncIteration:
+                return
+            if chunk:
+                yield chunk
+
+
+def _request_body(request: Request):
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit():
+        return RequestBody(request, int(length)) if int(length) else b""
+    if "transfer-encoding" in request.headers:
+        return iter(RequestBody(request, 0))  # no length: sent chunked
+    return b""
+
+
+def _chunks(upstream: requests.Response):
+    try:
+        yield from upstream.raw.stream(_STREAM_CHUNK, decode_content=False)
+    finally:
+        upstream.close()  # back to the pool, also when the client went away mid-stream
+
+
+def _response(upstream: requests.Response, shard: Shard) -> Response:
+    """Stream a (stream=True) upstream response back as it arrives, still encoded"""
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() in _PASSED_RESPONSE_HEADERS}
+    headers["X-Shard"] = shard.name
+    return StreamingResponse(_chunks(upstream), status_code=upstream.status_code, headers=headers)
+
+
+async def proxy(shard: Shard, request: Request, body: Optional[bytes] = None) -> Response:
+    """Forward the request (its body streamed unless already read) and stream the answer back"""
+    try:
+        upstream = await run_in_threadpool(
+            forward, shard, request.method, request.url.path, request.url.query, _request_headers(request),
+            _request_body(request) if body is None else body, True
+        )
+    except requests.RequestException:
+        raise HTTPException(status_code=502, detail=f"Shard {shard.name} is unreachable")
+    return _response(upstream, shard)
+
+
+async def fan_out(path: str, query: str = "") -> List[tuple]:
+    """GET `path` on every shard concurrently: [(shard, json or None)]"""
+    def get(shard):
+        try:
+            upstream = forward(shard, "GET", path, query, {}, b"")
+            return upstream.json() if upstream.ok else None
+        except (requests.RequestException, ValueError):
+            return None
+    results = await asyncio.gather(*(run_in_threadpool(get, shard) for shard in shard_map.shards))
+    return list(zip(shard_map.shards, results))
+
+
+def _is_json(request: Request) -> bool:
+    return request.headers.get("content-type", "").startswith("application/json")
+
+
+def session_id_of(request: Request, body: bytes) -> Optional[int]:
+    match = _SESSION_PATH_RE.match(request.url.path)
+    if match:
+        return int(match.group(1))
+    value = request.query_params.get("session_id")
+    if value is None and body and _is_json(request):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        value = payload.get("session_id") if isinstance(payload, dict) else None
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+# -------- Start a call --------
+@app.post("/start-call")
+async def start_call(request: Request):
+    """Start the call on the caller's home shard, overflowing to other shards when it has no free agent"""
+    body = await request.body()
+    try:
+        location = json.loads(body)["location"]
+    except (ValueError, TypeError, KeyError):
+        return await proxy(shard_map.default, request, body)  # let the backend reject it with a 422
+
+    candidates = shard_map.candidates(location if isinstance(location, str) else None)
+    home = candidates[0]
+    headers = _request_headers(request)
+    tried = []
+    for shard in candidates:
+        try:
+            upstream = await run_in_threadpool(forward, shard, "POST", "/start-call", request.url.query, headers, body, True)
+        except requests.RequestException:
+            tried.append(f"{shard.name}=unreachable")
+            continue
+        if upstream.status_code == 503:
+            upstream.close()
+            tried.append(f"{shard.name}=503")
+            continue
+        if upstream.status_code != 200:
+            return _response(upstream, shard)
+        route = "home" if shard is home else "overflow"
+        SHARD_CALLS.inc(shard=shard.name, route=route)
+        if route == "overflow":
+            print(f"Call from {location!r} overflowed from {home.name} to {shard.name} ({', '.join(tried)})")
+        data = upstream.json()
+        upstream.close()
+        data.update(shard=shard.name, overflow=shard is not home)
+        return JSONResponse(data, headers={"X-Shard": shard.name})
+
+    SHARD_REJECTED.inc(home=home.name)
+    print(f"Call from {location!r} rejected: {', '.join(tried)} (overflow={shard_map.overflow})")
+    raise HTTPException(status_code=503, detail="No available agents at the moment")
+
+
+# -------- Aggregates --------
+@app.get("/stats")
+async def get_stats():
+    """Dashboard aggregates of every shard added up, with the per-shard figures"""
+    per_shard = await fan_out("/stats")
+    calls, agents = {}, {"total": 0, "available": 0, "occupied": 0}
+    handled, handle_time = 0, 0.0
+    for _, stats in per_shard:
+        if stats is None:
+            continue
+        for status, count in stats["calls"].items():
+            calls[status] = calls.get(status, 0) + count
+        for key in agents:
+            agents[key] += stats["agents"][key]
+        handled += stats["handled_calls"]
+        handle_time += (stats["average_handle_time_s"] or 0.0) * stats["handled_calls"]
+    agents["occupancy"] = round(agents["occupied"] / agents["total"], 3) if agents["total"] else 0.0
+    return {
+        "calls": calls,
+        "agents": agents,
+        "average_handle_time_s": round(handle_time / handled, 1) if handled else None,
+        "handled_calls": handled,
+        "shards": {shard.name: stats for shard, stats in per_shard},  # None: shard unreachable
+    }
+
+
+@app.get("/agents")
+async def get_agents():
+    """Agents of every shard (agent ids are only unique within a shard)"""
+    agents = []
+    for shard, result in await fan_out("/agents"):
+        agents += [dict(agent, shard=shard.name) for agent in (result or {}).get("agents", [])]
+    return {"agents": agents}
+
+
+@app.get("/search")
+async def search(request: Request, q: str, page: int = 1, page_size: int = 20):
+    """
+    Full-text search on every shard, merged by rank. Each shard ranks its own
+    hits by fused rank, so the merged page takes the best `page * page_size`
+    of every shard. Session ids are unique across shards; message ids are
+    only unique within the `shard` a hit names.
+    """
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), _SEARCH_PAGE_LIMIT)
+    window = page * page_size
+    filters = [(k, v) for k, v in request.query_params.multi_items() if k not in ("page", "page_size")]
+
+    def top_hits(shard):
+        """(the shard's best `window` hits, whether it has more), or None if it failed"""
+        hits, size = [], min(window, _SEARCH_PAGE_LIMIT)
+        for shard_page in range(1, -(-window // size) + 1):
+            try:
+                upstream = forward(shard, "GET", "/search", urlencode(filters + [("page", shard_page), ("page_size", size)]), {}, b"")
+                result = upstream.json() if upstream.ok else None
+            except (requests.RequestException, ValueError):
+                result = None
+            if result is None:
+                return None
+            hits += [dict(hit, shard=shard.name) for hit in result["results"]]
+            if not result["has_more"]:
+                return hits, False
+        return hits[:window], True
+
+    per_shard = await asyncio.gather(*(run_in_threadpool(top_hits, shard) for shard in shard_map.shards))
+    hits, has_more = [], False
+    for result in per_shard:
+        if result is not None:
+            hits += result[0]
+            has_more = has_more or result[1]
+    hits.sort(key=lambda hit: (hit["rank"], hit.get("created_at") or "", hit["session_id"]), reverse=True)
+    return {
+        "query": q,
+        "page": page,
+        "page_size": page_size,
+        "has_more": has_more or len(hits) > window,
+        "results": hits[window - page_size:window],
+        "unavailable_shards": [shard.name for shard, result in zip(shard_map.shards, per_shard) if result is None],
+    }
+
+
+@app.get("/audio-archive")
+async def audio_archive_report():
+    """Recording archives of every shard added up, with the per-shard reports"""
+    per_shard = await fan_out("/audio-archive")
+    stored_bytes, audio_hours, max_bytes = 0, 0.0, 0
+    for _, report in per_shard:
+        if report is not None:
+            stored_bytes += report["stored_bytes"]
+            audio_hours += report["audio_hours"]
+            max_bytes += report["max_bytes"] or 0
+    return {
+        "stored_bytes": stored_bytes,
+        "audio_hours": round(audio_hours, 3),
+        "bytes_per_call_hour": round(stored_bytes / audio_hours) if audio_hours else None,
+        "max_bytes": max_bytes,
+        "shards": {shard.name: report for shard, report in per_shard},  # None: shard unreachable
+    }
+
+
+@app.get("/cold-storage")
+async def cold_storage_report():
+    """Cold storage of every shard added up, with the per-shard reports"""
+    per_shard = await fan_out("/cold-storage")
+    reports = [report for _, report in per_shard if report is not None]
+    oldest = [report["oldest_day"] for report in reports if report["oldest_day"]]
+    newest = [report["newest_day"] for report in reports if report["newest_day"]]
+    return {
+        "archived_sessions": sum(report["archived_sessions"] or 0 for report in reports),
+        "oldest_day": min(oldest, default=None),
+        "newest_day": max(newest, default=None),
+        "bytes": sum(report["bytes"] for report in reports),
+        "shards": {shard.name: report for shard, report in per_shard},  # None: shard unreachable
+    }
+
+
+@app.get("/shards")
+async def get_shards():
+    """The shard map with each shard's readiness"""
+    def ready(shard):
+        try:
+            return forward(shard, "GET", "/health/ready", "", {}, b"").status_code == 200
+        except requests.RequestException:
+            return False
+    states = await asyncio.gather(*(run_in_threadpool(ready, shard) for shard in shard_map.shards))
+    return {
+        "overflow": shard_map.overflow,
+        "shards": [dict(shard.to_dict(), ready=state) for shard, state in zip(shard_map.shards, states)],
+    }
+
+
+@app.get("/audio/{sha256}")
+async def play_audio(sha256: str, request: Request):
+    """Recordings live in the archive of the shard that took the call: ask each shard in turn"""
+    for shard in shard_map.shards:
+        try:
+            upstream = await run_in_threadpool(
+                forward, shard, "GET", request.url.path, request.url.query, _request_headers(request), b"", True
+            )
+        except requests.RequestException:
+            continue
+        if upstream.status_code != 404:
+            return _response(upstream, shard)
+        upstream.close()
+    raise HTTPException(status_code=404, detail="Recording not found")
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# -------- Everything else --------
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def route(path: str, request: Request):
+    body = await request.body() if _is_json(request) else None  # small, and may name the session
+    session_id = session_id_of(request, body)
+    if session_id is not None:
+        shard = shard_map.for_session(session_id)
+        if shard is None:
+            raise HTTPException(status_code=404, detail="Chat session not found")
+    elif request.headers.get("x-shard"):
+        shard = shard_map.by_name.get(request.headers["x-shard"])
+        if shard is None:
+            raise HTTPException(status_code=404, detail=f"Unknown shard {request.headers['x-shard']}")
+    else:
+        shard = shard_map.default
+    return await proxy(shard, request, body)
+
+
+# -------- Local shards --------
+def seed_agents(database_url: str, shard: Shard, count: int):
+    """`count` agents spread over the shard's regions, if its database has none yet"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base, UserAgent
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine, tables=[UserAgent.__table__])
+    db = sessionmaker(bind=engine)()
+    try:
+        if db.query(UserAgent).count() == 0:
+            regions = shard.regions or ["Paris"]
+            db.add_all([
+                UserAgent(fullname=f"Agent {shard.name} {i + 1}", sex="female", status="available", language="french",
+                          hospital_location=regions[i % len(regions)])
+                for i in range(count)
+            ])
+            db.commit()
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def run_local(port: int, agents: int, overflow: Optional[str]):
+    """One backend process per shard, each on its own SQLite file, and the router in this process"""
+    global SHARDS_FILE, SHARD_OVERFLOW
+    import uvicorn
+
+    with open(SHARDS_FILE, encoding="utf-8") as f:
+        config = json.load(f)
+    processes = []
+    try:
+        for offset, entry in enumerate(sorted(config["shards"], key=lambda entry: entry["index"]), 1):
+            name = entry["name"]
+            entry["url"] = f"http://127.0.0.1:{port + offset}"
+            database_url = f"sqlite:///{os.path.join(BACKEND_DIR, f'shard_{name}.db')}"
+            if agents:
+                seed_agents(database_url, Shard(entry["index"], name, entry["url"], entry.get("regions", []), []), agents)
+            env = dict(
+                os.environ, DATABASE_URL=database_url, SHARD_INDEX=str(entry["index"]), SHARD_NAME=name,
+                AUDIO_ARCHIVE_DIR=os.path.join("uploads", name), COLD_STORAGE_DIR=os.path.join("archive", name)
+            )
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port + offset)],
+                cwd=BACKEND_DIR, env=env
+            ))
+        for entry in config["shards"]:
+            for _ in range(300):
+                try:
+                    requests.get(f"{entry['url']}/health/live", timeout=1)
+                    break
+                except requests.RequestException:
+                    time.sleep(0.2)
+            else:
+                raise RuntimeError(f"Shard {entry['name']} did not start")
+            print(f"Shard {entry['name']} (index {entry['index']}) up at {entry['url']}")
+
+        local_map = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        json.dump(config, local_map)
+        local_map.close()
+        SHARDS_FILE, SHARD_OVERFLOW = local_map.name, overflow or SHARD_OVERFLOW
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # uvicorn re-raises it on exit: still stop the shards
+        uvicorn.run(app, host="127.0.0.1", port=port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Route requests to regional shards")
+    parser.add_argument("--local", action="store_true", help="Also start one backend per shard on local SQLite files")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--agents", type=int, default=0, help="With --local: agents to create in each empty shard")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=None)
+    args = parser.parse_args()
+
+    global SHARD_OVERFLOW
+    if args.local:
+        run_local(args.port, args.agents, args.overflow)
+    else:
+        import uvicorn
+
+        SHARD_OVERFLOW = args.overflow or SHARD_OVERFLOW
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
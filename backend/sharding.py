@@ -0,0 +1,148 @@
+"""
+Regional shards: which call center (database + agent pool) serves a call.
+
+Each region runs its own backend (main.py) with its own database, agents,
+audio archive and cold storage. shard_router.py sits in front of them. The
+shard is encoded in the session id, so requests for an existing call are
+routed with no lookup:
+
+    session_id = shard_index * SESSION_ID_SPAN + local sequence
+
+Shard 0 starts at 1, so an existing single-database deployment becomes
+shard 0 with its ids unchanged. A shard's index must never change once it
+has served calls.
+
+New calls go to the shard owning the caller's region: the region named in
+the caller's location, else the shard whose nearest region is closest to the
+geocoded location, else the default shard. When that shard has no free agent
+(or is down) the overflow policy decides where the call goes instead:
+
+- "nearest": every other shard, closest to the caller first
+- "neighbours": only the shard's configured `neighbours`, in order
+- "none": the caller gets the home shard's 503
+
+The shard map is a JSON file (SHARDS_FILE, see data/shards.json):
+
+    {"overflow": "nearest",
+     "shards": [{"index": 0, "name": "nord", "url": "http://10.0.0.1:8000",
+                 "regions": ["Paris", "Lille"], "neighbours": ["ouest"], "default": true}, ...]}
+"""
+
+from typing import Dict, List, Optional
+import json
+
+from sqlalchemy import func, select
+
+from geo import Gazetteer, haversine_km, normalize
+
+SESSION_ID_SPAN = 10 ** 12  # ids stay below 2**53 (exact in JavaScript) for up to 9000 shards
+OVERFLOW_POLICIES = ("nearest", "neighbours", "none")
+
+
+def shard_of(session_id: int) -> int:
+    return session_id // SESSION_ID_SPAN
+
+
+def session_id_base(shard_index: int) -> int:
+    return shard_index * SESSION_ID_SPAN
+
+
+def next_session_id(model, shard_index: int):
+    """
+    SQL expression for the next id in a shard's range, used as the primary key
+    of a new chat_session. It is evaluated inside the INSERT, so concurrent
+    inserts cannot pick the same id.
+    """
+    base = session_id_base(shard_index)
+    in_range = select(func.max(model.id)).where(model.id.between(base, base + SESSION_ID_SPAN - 1)).scalar_subquery()
+    return select(func.coalesce(in_range, base) + 1).scalar_subquery()
+
+
+class Shard:
+    def __init__(self, index: int, name: str, url: str, regions: List[str], neighbours: List[str], default: bool = False):
+        self.index = index
+        self.name = name
+        self.url = url.rstrip("/")
+        self.regions = regions
+        self.neighbours = neighbours
+        self.default = default
+        self.points = []  # geocoded regions
+
+    def to_dict(self) -> dict:
+        return {"index": self.index, "name": self.name, "url": self.url, "regions": self.regions,
+                "neighbours": self.neighbours, "default": self.default}
+
+
+class ShardMap:
+    def __init__(self, shards: List[Shard], overflow: str, gazetteer: Gazetteer):
+        if not shards:
+            raise ValueError("The shard map has no shards")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r} (expected one of {', '.join(OVERFLOW_POLICIES)})")
+        self.shards = sorted(shards, key=lambda shard: shard.index)
+        self.by_index: Dict[int, Shard] = {}
+        self.by_name: Dict[str, Shard] = {}
+        self.by_region: Dict[str, Shard] = {}
+        for shard in self.shards:
+            if shard.index in self.by_index or shard.name in self.by_name:
+                raise ValueError(f"Duplicate shard index or name: {shard.index} / {shard.name}")
+            self.by_index[shard.index] = shard
+            self.by_name[shard.name] = shard
+            for region in shard.regions:
+                self.by_region[normalize(region)] = shard
+                point = gazetteer.geocode(region)
+                if point is not None:
+                    shard.points.append(point)
+        for shard in self.shards:
+            unknown = set(shard.neighbours) - set(self.by_name)
+            if unknown:
+                raise ValueError(f"Shard {shard.name} lists unknown neighbours: {', '.join(sorted(unknown))}")
+        self.default = next((shard for shard in self.shards if shard.default), self.shards[0])
+        self.max_words = max((len(region.split()) for region in self.by_region), default=0)
+        self.overflow = overflow
+        self.gazetteer = gazetteer
+
+    @classmethod
+    def load(cls, path: str, gazetteer: Gazetteer, overflow: Optional[str] = None) -> "ShardMap":
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        shards = [
+            Shard(int(entry["index"]), entry["name"], entry["url"], entry.get("regions", []),
+                  entry.get("neighbours", []), bool(entry.get("default")))
+            for entry in config["shards"]
+        ]
+        return cls(shards, overflow or config.get("overflow", "nearest"), gazetteer)
+
+    # -------- Routing --------
+    def for_session(self, session_id: int) -> Optional[Shard]:
+        return self.by_index.get(shard_of(session_id))
+
+    def _distance(self, shard: Shard, point) -> float:
+        return min((haversine_km(point, p) for p in shard.points), default=float("inf"))
+
+    def home(self, location: Optional[str]) -> Shard:
+        """The shard owning the caller's region"""
+        words = normalize(location or "").split()
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            # Later words first, as in Gazetteer.geocode: "12 rue de Rivoli, Paris"
+            for start in range(len(words) - size, -1, -1):
+                shard = self.by_region.get(" ".join(words[start:start + size]))
+                if shard is not None:
+                    return shard
+        point = self.gazetteer.geocode(location or "")
+        if point is None:
+            return self.default
+        return min(self.shards, key=lambda shard: (self._distance(shard, point), shard.index))
+
+    def candidates(self, location: Optional[str]) -> List[Shard]:
+        """Home shard first, then the shards the overflow policy allows, in the order to try them"""
+        home = self.home(location)
+        if self.overflow == "none":
+            return [home]
+        if self.overflow == "neighbours":
+            return [home] + [self.by_name[name] for name in home.neighbours if name != home.name]
+        point = self.gazetteer.geocode(location or "") or (home.points[0] if home.points else None)
+        others = [shard for shard in self.shards if shard is not home]
+        if point is not None:
+            others.sort(key=lambda shard: (self._distance(shard, point), shard.index))
+        return [home] + others
@@ -0,0 +1,351 @@
+"""
+Synthetic call traffic for capacity planning.
+
+Replays scripted calls (data/call_scripts.jsonl) and the bundled recordings
+against the real endpoints on a simulated clock, so an hour of traffic can be
+played in a minute with --speedup 60. Calls arrive as a Poisson process,
+wait in an emergency-first queue until /start-call gets them an agent (the
+backend answers 503 when none is free), send their script spread over a
+lognormal handle time, optionally upload a recording, and end. Queue depth
+and agent occupancy are sampled from /stats.
+
+The report gives, per agent count: answer-time percentiles and SLA breach
+rates per call class, abandoned calls, queue depth, agent utilization and the
+latency of every endpoint under that load (HTTP 429 = admission control shed
+the request).
+
+Usage (from backend/):
+    python simulate_traffic.py --agents 4 6 8 --arrival-rate 90 --handle-time 180 --duration 60 --speedup 60
+    python simulate_traffic.py --url http://localhost:8000 --agents 12 --arrival-rate 240 --emergency-ratio 0.3
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Condition, Event, Lock, Thread
+import argparse
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+import requests
+
+from benchmark import DEFAULT_AUDIO, percentile, start_local_server, summarize
+
+DEFAULT_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "call_scripts.jsonl")
+ENDPOINTS = ["start_call", "send_message", "process_audio", "end_call"]
+
+
+def load_scripts(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class SimClock:
+    """Simulated seconds since start; real time runs `speedup` times slower"""
+
+    def __init__(self, speedup: float):
+        self.speedup = speedup
+        self.started = time.perf_counter()
+
+    def now(self) -> float:
+        return (time.perf_counter() - self.started) * self.speedup
+
+    def sleep_until(self, sim_time: float, stop: Event = None) -> bool:
+        """Sleep until the simulated time; False if `stop` was set first"""
+        delay = (sim_time - self.now()) / self.speedup
+        if delay <= 0:
+            return True
+        if stop is not None:
+            return not stop.wait(delay)
+        time.sleep(delay)
+        return True
+
+
+# -------- Scenario --------
+class Simulation:
+    def __init__(self, base_url: str, args, agents: int, scripts: list, seed: int):
+        self.base_url = base_url
+        self.args = args
+        self.agents = agents
+        self.scripts = scripts
+        self.random = random.Random(seed)
+        self.clock = None
+        self.queue = []  # (priority, arrival order, call)
+        self.order = itertools.count()
+        self.active = 0
+        self.condition = Condition()
+        self.lock = Lock()
+        self.calls = []
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.http_errors = {}
+        self.samples = []
+        self.done = Event()
+
+    # -------- HTTP --------
+    def _request(self, endpoint: str, method: str, path: str, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, f"{self.base_url}{path}", timeout=300, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, "connection_error"
+        with self.lock:
+            self.latencies[endpoint].append(time.perf_counter() - started)
+            if status not in expected:
+                key = f"{endpoint}:{status}"
+                self.http_errors[key] = self.http_errors.get(key, 0) + 1
+        return response if status == 200 else None
+
+    # -------- Arrivals and queue --------
+    def _new_call(self, index: int, arrived_at: float) -> dict:
+        emergency = self.random.random() < self.args.emergency_ratio
+        pool = [s for s in self.scripts if s.get("emergency") == emergency] or self.scripts
+        mean, sigma = self.args.handle_time, self.args.handle_time_sigma
+        return {
+            "index": index,
+            "script": self.random.choice(pool),
+            "emergency": emergency,
+            "arrived_at": arrived_at,
+            # lognormal with the requested mean
+            "handle_time": self.random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma),
+            "audio": self.random.choice(self.args.audio) if self.random.random() < self.args.audio_ratio else None,
+            "answered_at": None,
+            "abandoned": False,
+        }
+
+    def _arrivals(self):
+        sim_time, index = 0.0, 0
+        end = self.args.duration * 60
+        while True:
+            sim_time += self.random.expovariate(self.args.arrival_rate / 3600)
+            if sim_time >= end or not self.clock.sleep_until(sim_time, self.done):
+                break
+            call = self._new_call(index, self.clock.now())
+            index += 1
+            with self.condition:
+                self.calls.append(call)
+                heapq.heappush(self.queue, (0 if call["emergency"] else 1, next(self.order), call))
+                self.condition.notify_all()
+
+    def _dispatch(self, pool: ThreadPoolExecutor):
+        """Offer the head of the queue to /start-call whenever a call arrives or ends"""
+        retry = self.args.retry_interval
+        while not self.done.is_set():
+            with self.condition:
+                self.condition.wait(timeout=retry / self.clock.speedup)
+                now = self.clock.now()
+                if self.args.patience:
+                    for _, _, call in self.queue:
+                        if now - call["arrived_at"] > self.args.patience:
+                            call["abandoned"] = True
+                    self.queue = [item for item in self.queue if not item[2]["abandoned"]]
+                    heapq.heapify(self.queue)
+            while True:
+                with self.condition:
+                    if not self.queue:
+                        break
+                    item = heapq.heappop(self.queue)
+                call = item[2]
+                response = self._start_call(call)
+                with self.condition:
+                    if response is None:
+                        heapq.heappush(self.queue, item)
+                        break  # no agent free (or an error): wait for the next change
+                    call["answered_at"] = self.clock.now()
+                    self.active += 1
+                pool.submit(self._run_call, call, response.json()["session_id"])
+
+    def _start_call(self, call: dict):
+        script = call["script"]
+        # 503 = no agent free right now: the call stays queued, so it is not an error
+        return self._request("start_call", "POST", "/start-call", expected=(200, 503), json={
+            "fullname": f"Sim Caller {call['index']}",
+            "phone_number": f"+100{call['index']:07d}",
+            "language": script.get("language", "english"),
+            "location": script.get("location", "Paris"),
+            "sex": "female" if call["index"] % 2 else "male",
+        })
+
+    # -------- Calls in progress --------
+    def _run_call(self, call: dict, session_id: int):
+        try:
+            messages = call["script"]["messages"]
+            steps = len(messages) + 1
+            for i, message in enumerate(messages):
+                if call["audio"] and i == len(messages) // 2:
+                    with open(call["audio"], "rb") as f:
+                        self._request(
+                            "process_audio", "POST", "/process-audio",
+                            params={"session_id": session_id, "target_language": "english"},
+                            files={"audio_file": (os.path.basename(call["audio"]), f)},
+                        )
+                self._request("send_message", "POST", "/send-message", json=dict(message, session_id=session_id))
+                self.clock.sleep_until(call["answered_at"] + call["handle_time"] * (i + 1) / steps)
+            self.clock.sleep_until(call["answered_at"] + call["handle_time"])
+            self._request("end_call", "POST", f"/end-call/{session_id}")
+        finally:
+            with self.condition:
+                call["ended_at"] = self.clock.now()
+                self.active -= 1
+                self.condition.notify_all()
+
+    # -------- Sampling --------
+    def _sample(self):
+        while True:
+            stats = {}
+            try:
+                stats = requests.get(f"{self.base_url}/stats", timeout=10).json()
+            except (requests.RequestException, ValueError):
+                pass
+            agents = stats.get("agents", {})
+            staffed = agents.get("available", 0) + agents.get("occupied", 0)
+            with self.condition:
+                self.samples.append({
+                    "t": round(self.clock.now(), 1),
+                    "queue_depth": len(self.queue),
+                    "active_calls": self.active,
+                    "agents_occupied": agents.get("occupied"),
+                    "utilization": round(agents.get("occupied", 0) / staffed, 3) if staffed else None,
+                })
+            if not self.clock.sleep_until(self.clock.now() + self.args.sample_interval, self.done):
+                break
+
+    # -------- Run --------
+    def run(self) -> dict:
+        self.clock = SimClock(self.args.speedup)
+        with ThreadPoolExecutor(max_workers=self.agents + 4, thread_name_prefix="sim-call") as pool:
+            threads = [
+                Thread(target=self._dispatch, args=(pool,), daemon=True),
+                Thread(target=self._sample, daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+            self._arrivals()
+            # Drain: callers still waiting get up to `patience` (or one handle time) to be answered
+            drain_until = self.clock.now() + (self.args.patience or self.args.handle_time)
+            while self.clock.now() < drain_until:
+                with self.condition:
+                    if not self.queue:
+                        break
+                time.sleep(0.05)
+            self.done.set()
+            with self.condition:
+                self.condition.notify_all()
+            for thread in threads:
+                thread.join()
+            with self.condition:
+                for call in self.calls:
+                    call["abandoned"] = call["answered_at"] is None
+                self.queue = []
+        return self.report()
+
+    def report(self) -> dict:
+        classes = {}
+        for label, emergency, sla in (("emergency", True, self.args.emergency_sla), ("standard", False, self.args.sla)):
+            calls = [c for c in self.calls if c["emergency"] == emergency]
+            waits = [c["answered_at"] - c["arrived_at"] for c in calls if c["answered_at"] is not None]
+            breaches = sum(1 for c in calls if c["abandoned"] or (c["answered_at"] is not None and c["answered_at"] - c["arrived_at"] > sla))
+            classes[label] = {
+                "offered": len(calls),
+                "answered": len(waits),
+                "abandoned": sum(1 for c in calls if c["abandoned"]),
+                "sla_s": sla,
+                "sla_breach_rate": round(breaches / len(calls), 3) if calls else 0.0,
+                "wait_p50_s": round(percentile(waits, 50), 1),
+                "wait_p95_s": round(percentile(waits, 95), 1),
+                "wait_max_s": round(max(waits), 1) if waits else 0.0,
+            }
+        depths = [s["queue_depth"] for s in self.samples]
+        utilization = [s["utilization"] for s in self.samples if s["utilization"] is not None]
+        handled = [c["handle_time"] for c in self.calls if c["answered_at"] is not None]
+        return {
+            "agents": self.agents,
+            "offered_load_erlangs": round(self.args.arrival_rate * self.args.handle_time / 3600, 2),
+            "calls": classes,
+            "queue_depth": {"mean": round(sum(depths) / len(depths), 2) if depths else 0.0, "max": max(depths, default=0)},
+            "agent_utilization": round(sum(utilization) / len(utilization), 3) if utilization else None,
+            "mean_handle_time_s": round(sum(handled) / len(handled), 1) if handled else None,
+            "endpoints": {endpoint: summarize(values) for endpoint, values in self.latencies.items()},
+            "http_errors": self.http_errors,
+            "timeline": self.samples,
+        }
+
+
+# -------- Local staffing --------
+def staff_local_agents(count: int):
+    """In-process server only: exactly `count` agents on duty, every other agent off duty"""
+    import main
+    from models import UserAgent
+
+    db = main.SessionLocal()
+    try:
+        agents = db.query(UserAgent).order_by(UserAgent.id).all()
+        for i, agent in enumerate(agents):
+            agent.status = "available" if i < count else "off_duty"
+        db.commit()
+        main.call_stats.rebuild(db)
+        main.agent_directory.rebuild([agent for agent in agents if agent.status == "available"])
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic call traffic for capacity planning")
+    parser.add_argument("--url", help="Drive an already running server (its agents are used as they are)")
+    parser.add_argument("--agents", type=int, nargs="+", default=[4], help="Agent counts to compare (in-process server)")
+    parser.add_argument("--arrival-rate", type=float, default=60, help="Calls per hour")
+    parser.add_argument("--duration", type=float, default=60, help="Simulated minutes of arrivals")
+    parser.add_argument("--speedup", type=float, default=60, help="Simulated seconds per real second")
+    parser.add_argument("--handle-time", type=float, default=180, help="Mean handle time in seconds")
+    parser.add_argument("--handle-time-sigma", type=float, default=0.5, help="Lognormal shape of handle times")
+    parser.add_argument("--emergency-ratio", type=float, default=0.2)
+    parser.add_argument("--sla", type=float, default=30, help="Target answer time for standard calls (s)")
+    parser.add_argument("--emergency-sla", type=float, default=10, help="Target answer time for emergency calls (s)")
+    parser.add_argument("--patience", type=float, default=120, help="Callers hang up after waiting this long (s, 0 = never)")
+    parser.add_argument("--retry-interval", type=float, default=2, help="Simulated seconds between queue retries")
+    parser.add_argument("--sample-interval", type=float, default=10, help="Simulated seconds between samples")
+    parser.add_argument("--audio-ratio", type=float, default=0.1, help="Fraction of calls that upload a recording")
+    parser.add_argument("--audio", nargs="+", default=DEFAULT_AUDIO)
+    parser.add_argument("--scripts", default=DEFAULT_SCRIPTS)
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--claude-latency", type=float, default=0.5)
+    parser.add_argument("--claude-jitter", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="simulation_results.json")
+    args = parser.parse_args()
+
+    scripts = load_scripts(args.scripts)
+    if args.url:
+        base_url = args.url.rstrip("/")
+        levels = args.agents[:1]
+    else:
+        base_url = start_local_server(args.claude_latency, args.claude_jitter, args.whisper_model, max(args.agents))
+        levels = args.agents
+
+    results = []
+    for agents in levels:
+        if not args.url:
+            staff_local_agents(agents)
+        report = Simulation(base_url, args, agents, scripts, args.seed).run()
+        results.append(report)
+        standard, emergency = report["calls"]["standard"], report["calls"]["emergency"]
+        print(f"agents={agents:<3} load={report['offered_load_erlangs']}E  "
+              f"utilization={report['agent_utilization']}  queue max={report['queue_depth']['max']}  "
+              f"SLA breaches: emergency {emergency['sla_breach_rate']:.1%} standard {standard['sla_breach_rate']:.1%}  "
+              f"abandoned={emergency['abandoned'] + standard['abandoned']}")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "levels": results,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
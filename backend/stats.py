@@ -0,0 +1,144 @@
+"""
+Operational aggregates for the dashboards, maintained incrementally.
+
+Endpoints report each state change (call started, status changed, call
+ended, agent status changed) right after they commit it, so /stats is served
+from memory without scanning chat_session or user_agent. The counters are
+rebuilt from the database at startup and, to bound drift when several
+worker processes each keep their own copy, again every `resync_seconds` by
+a background thread. A rebuild is a handful of SQL aggregates; no request
+ever waits for one.
+"""
+
+from threading import Event, Lock, Thread
+import time
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+
+from models import ArchivedSession, ChatSession, UserAgent
+
+
+def duration_seconds(dialect: str, started, ended):
+    """SQL expression for `ended - started` in seconds (date arithmetic differs on every dialect)"""
+    if dialect == "sqlite":
+        return (func.julianday(ended) - func.julianday(started)) * 86400.0
+    if dialect in ("mysql", "mariadb"):
+        return func.timestampdiff(literal_column("SECOND"), started, ended)
+    return func.extract("epoch", ended - started)
+
+
+class CallStats:
+    def __init__(self, resync_seconds: float = 300.0):
+        self.resync_seconds = resync_seconds
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.sessions_by_status = {}
+        self.agents_by_status = {}
+        self.handle_time_total = 0.0
+        self.handled_calls = 0
+        self.rebuilt_at = 0.0
+
+    # -------- Rebuild --------
+    def rebuild(self, db: Session):
+        sessions = dict(db.query(ChatSession.status, func.count(ChatSession.id)).group_by(ChatSession.status).all())
+        agents = dict(db.query(UserAgent.status, func.count(UserAgent.id)).group_by(UserAgent.status).all())
+        handled, handle_seconds = db.query(
+            func.count(ChatSession.ended_at),
+            func.sum(duration_seconds(db.get_bind().dialect.name, ChatSession.started_at, ChatSession.ended_at))
+        ).one()
+        # Calls moved to cold storage still count as completed and handled
+        archived, archived_seconds = db.query(
+            func.count(ArchivedSession.session_id), func.sum(ArchivedSession.handle_seconds)
+        ).one()
+        if archived:
+            sessions["completed"] = sessions.get("completed", 0) + archived
+        with self._lock:
+            self._reset()
+            self.sessions_by_status = {status or "unknown": count for status, count in sessions.items()}
+            self.agents_by_status = {status or "unknown": count for status, count in agents.items()}
+            self.handled_calls = handled + archived
+            self.handle_time_total = round(float(handle_seconds or 0.0) + (archived_seconds or 0.0), 3)
+            self.rebuilt_at = time.time()
+
+    # -------- Background resync --------
+    def start(self, session_factory):
+        if self.resync_seconds and self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, args=(session_factory,), name="stats-resync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, session_factory):
+        while not self._stop.wait(self.resync_seconds):
+            db = session_factory()
+            try:
+                self.rebuild(db)
+            except Exception as e:
+                print(f"Stats resync failed: {e}")
+            finally:
+                db.close()
+
+    # -------- Incremental updates --------
+    def _move(self, counts: dict, old, new):
+        if old is not None:
+            counts[old] = max(0, counts.get(old, 0) - 1)
+        if new is not None:
+            counts[new] = counts.get(new, 0) + 1
+
+    def call_started(self, status: str = "ongoing"):
+        with self._lock:
+            self._move(self.sessions_by_status, None, status)
+
+    def session_status_changed(self, old: str, new: str):
+        if old == new:
+            return
+        with self._lock:
+            self._move(self.sessions_by_status, old, new)
+
+    def call_ended(self, old_status: str, handle_seconds: float):
+        with self._lock:
+            self._move(self.sessions_by_status, old_status, "completed")
+            self.handled_calls += 1
+            self.handle_time_total += max(0.0, handle_seconds)
+
+    def agent_status_changed(self, old, new):
+        if old == new:
+            return
+        with self._lock:
+            self._move(self.agents_by_status, old, new)
+
+    # -------- Read --------
+    @property
+    def active_sessions(self) -> int:
+        return self.sessions_by_status.get("ongoing", 0) + self.sessions_by_status.get("emergency", 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            agents_total = sum(self.agents_by_status.values())
+            occupied = self.agents_by_status.get("occupied", 0)
+            return {
+                "calls": {
+                    "ongoing": self.sessions_by_status.get("ongoing", 0),
+                    "emergency": self.sessions_by_status.get("emergency", 0),
+                    "completed": self.sessions_by_status.get("completed", 0),
+                },
+                "agents": {
+                    "total": agents_total,
+                    "available": self.agents_by_status.get("available", 0),
+                    "occupied": occupied,
+                    "occupancy": round(occupied / agents_total, 3) if agents_total else 0.0,
+                },
+                "average_handle_time_s": round(self.handle_time_total / self.handled_calls, 1) if self.handled_calls else None,
+                "handled_calls": self.handled_calls,
+                "rebuilt_at": self.rebuilt_at,
+            }
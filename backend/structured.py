@@ -0,0 +1,219 @@
+"""
+Schema-constrained generation through Claude tool use.
+
+Instead of asking for "only the JSON array" and parsing whatever text comes
+back, each generator forces a single tool call whose input_schema describes
+the list it wants. Every item is checked against that schema. Items that fail
+are sent back once with only their field errors, and the model answers
+through a repair tool keyed by item index, so the valid items are never
+regenerated. Items that are still invalid after the repair are dropped, and
+every failure is counted in sosai_structured_output_failures_total.
+"""
+
+from typing import Dict, List, Optional
+import json
+
+from metrics import Counter, stage
+
+STRUCTURED_OUTPUT_FAILURES = Counter(
+    "sosai_structured_output_failures_total",
+    "Structured Claude outputs that failed schema validation",
+    ("tool", "outcome"),
+)
+
+_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+class StructuredOutputError(RuntimeError):
+    pass
+
+
+# -------- Schemas --------
+def items_tool(name: str, description: str, item_schema: dict) -> dict:
+    """Tool whose input is {"items": [item, ...]}"""
+    return {
+        "name": name,
+        "description": description,
+        "input_schema": {
+            "type": "object",
+            "properties": {"items": {"type": "array", "items": item_schema}},
+            "required": ["items"],
+        },
+    }
+
+
+def repair_tool(tool: dict) -> dict:
+    """Companion tool used to resend corrected items by their original index"""
+    item_schema = tool["input_schema"]["properties"]["items"]["items"]
+    return {
+        "name": f"{tool['name']}_fixes",
+        "description": f"Resend corrected versions of the invalid {tool['name']} items, keyed by their index.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "fixes": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"index": {"type": "integer"}, "item": item_schema},
+                        "required": ["index", "item"],
+                    },
+                }
+            },
+            "required": ["fixes"],
+        },
+    }
+
+
+def validate(value, schema: dict, path: str = "") -> List[str]:
+    """Errors for `value` against the JSON schema subset the tools use (type, enum, bounds, required)"""
+    label = path or "value"
+    expected = _TYPES.get(schema.get("type"))
+    if expected and (not isinstance(value, expected) or (isinstance(value, bool) and schema["type"] != "boolean")):
+        return [f"{label}: expected {schema['type']}, got {type(value).__name__}"]
+
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{label}: must be one of {schema['enum']}, got {value!r}")
+    if "minimum" in schema and isinstance(value, (int, float)) and value < schema["minimum"]:
+        errors.append(f"{label}: must be >= {schema['minimum']}, got {value}")
+    if "maximum" in schema and isinstance(value, (int, float)) and value > schema["maximum"]:
+        errors.append(f"{label}: must be <= {schema['maximum']}, got {value}")
+    if "minLength" in schema and isinstance(value, str) and len(value.strip()) < schema["minLength"]:
+        errors.append(f"{label}: must not be empty")
+
+    if isinstance(value, dict):
+        for field in schema.get("required", []):
+            if field not in value:
+                errors.append(f"{path + '.' if path else ''}{field}: missing")
+        for field, field_schema in schema.get("properties", {}).items():
+            if field in value:
+                errors.extend(validate(value[field], field_schema, f"{path + '.' if path else ''}{field}"))
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+# -------- Generation --------
+def _tool_call(response, name: str):
+    for block in response.content:
+        if getattr(block, "type", None) == "tool_use" and block.name == name:
+            return block
+    return None
+
+
+def _coerce(value, schema: dict):
+    """Fix harmless drift such as numbers sent as strings ("8" -> 8) before validating"""
+    if schema.get("type") == "object" and isinstance(value, dict):
+        return {
+            field: _coerce(item, schema.get("properties", {}).get(field, {}))
+            for field, item in value.items()
+        }
+    if schema.get("type") in ("integer", "number") and isinstance(value, str):
+        try:
+            number = float(value.strip())
+        except ValueError:
+            return value
+        return int(number) if schema["type"] == "integer" and number.is_integer() else number
+    if schema.get("type") == "string" and isinstance(value, str) and "enum" in schema:
+        return value.strip().lower()
+    return value
+
+
+def generate_items(
+    client,
+    model: str,
+    max_tokens: int,
+    tool: dict,
+    content: str,
+    system: Optional[list] = None,
+) -> List:
+    """
+    Force a call to `tool` and return its schema-valid items in order.
+    Invalid items get one targeted repair round; raises StructuredOutputError
+    when the call yields no valid item at all.
+    """
+    item_schema = tool["input_schema"]["properties"]["items"]["items"]
+    fixes_tool = repair_tool(tool)
+    extra = {"system": system} if system else {}
+    messages = [{"role": "user", "content": content}]
+
+    response = client.messages.create(
+        model=model,
+        max_tokens=max_tokens,
+        tools=[tool, fixes_tool],
+        tool_choice={"type": "tool", "name": tool["name"]},
+        messages=messages,
+        **extra,
+    )
+    with stage("json_parse"):
+        call = _tool_call(response, tool["name"])
+        raw = call.input.get("items") if call is not None and isinstance(call.input, dict) else None
+        if not isinstance(raw, list):
+            STRUCTURED_OUTPUT_FAILURES.inc(tool=tool["name"], outcome="no_items")
+            raise StructuredOutputError(f"Claude did not call {tool['name']} with an items list")
+
+        items: Dict[int, object] = {}
+        invalid: Dict[int, List[str]] = {}
+        for index, item in enumerate(raw):
+            item = _coerce(item, item_schema)
+            errors = validate(item, item_schema)
+            if errors:
+                invalid[index] = errors
+            else:
+                items[index] = item
+
+    if invalid:
+        report = "\n".join(f"item {index}: {'; '.join(errors)}" for index, errors in invalid.items())
+        print(f"{tool['name']}: {len(invalid)} of {len(raw)} item(s) invalid, requesting fixes\n{report}")
+        invalid_count = len(invalid)
+        response = client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            tools=[tool, fixes_tool],
+            tool_choice={"type": "tool", "name": fixes_tool["name"]},
+            messages=messages + [
+                {"role": "assistant", "content": [
+                    {"type": "tool_use", "id": call.id, "name": call.name, "input": call.input}
+                ]},
+                {"role": "user", "content": [{
+                    "type": "tool_result",
+                    "tool_use_id": call.id,
+                    "is_error": True,
+                    "content": (
+                        f"These items do not match the schema:\n{report}\n\n"
+                        f"Call {fixes_tool['name']} with a corrected version of only these items, "
+                        f"keeping their index. The other items were accepted."
+                    ),
+                }]},
+            ],
+            **extra,
+        )
+        with stage("json_parse"):
+            fixes = _tool_call(response, fixes_tool["name"])
+            for fix in (fixes.input.get("fixes") or []) if fixes is not None and isinstance(fixes.input, dict) else []:
+                index = fix.get("index") if isinstance(fix, dict) else None
+                if index not in invalid:
+                    continue
+                item = _coerce(fix.get("item"), item_schema)
+                if not validate(item, item_schema):
+                    items[index] = item
+                    del invalid[index]
+
+        repaired = invalid_count - len(invalid)
+        if repaired:
+            STRUCTURED_OUTPUT_FAILURES.inc(repaired, tool=tool["name"], outcome="repaired")
+        if invalid:
+            STRUCTURED_OUTPUT_FAILURES.inc(len(invalid), tool=tool["name"], outcome="dropped")
+
+    if not items:
+        raise StructuredOutputError(f"{tool['name']} returned no valid items: {json.dumps(raw)[:200]}")
+    return [items[index] for index in sorted(items)]
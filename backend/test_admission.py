@@ -0,0 +1,105 @@
+"""Admission control: priority ordering, shedding and per-client rate limiting"""
+
+import asyncio
+
+import pytest
+
+from admission import (
+    AdmissionController, Overloaded, TokenBucket,
+    PRIORITY_EMERGENCY, PRIORITY_ONGOING, PRIORITY_TOOL
+)
+
+
+def controller(slots=1, queue_limit=10, deadline=5.0, rate=0.0, burst=10):
+    return AdmissionController(
+        slots=slots,
+        queue_limits={PRIORITY_EMERGENCY: queue_limit, PRIORITY_ONGOING: queue_limit, PRIORITY_TOOL: queue_limit},
+        deadlines={PRIORITY_EMERGENCY: deadline, PRIORITY_ONGOING: deadline, PRIORITY_TOOL: deadline},
+        rate_limiter=TokenBucket(rate=rate, burst=burst)
+    )
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def scenario():
+        admission = controller(slots=1)
+        await admission.acquire(PRIORITY_ONGOING, "a")  # holds the only slot
+        served = []
+
+        async def wait(name, priority):
+            await admission.acquire(priority, name)
+            served.append(name)
+            admission.release(0.0)
+
+        tasks = []
+        for name, priority in [("tool", PRIORITY_TOOL), ("ongoing-1", PRIORITY_ONGOING),
+                               ("emergency", PRIORITY_EMERGENCY), ("ongoing-2", PRIORITY_ONGOING)]:
+            tasks.append(asyncio.create_task(wait(name, priority)))
+            await asyncio.sleep(0)
+        assert admission.queued() == 4
+        admission.release(0.0)
+        await asyncio.gather(*tasks)
+        assert admission.in_use == 0
+        return served
+
+    assert asyncio.run(scenario()) == ["emergency", "ongoing-1", "ongoing-2", "tool"]
+
+
+def test_full_queue_and_deadline_are_shed():
+    async def scenario():
+        admission = controller(slots=1, queue_limit=1, deadline=0.05)
+        await admission.acquire(PRIORITY_ONGOING, "a")
+        waiter = asyncio.create_task(admission.acquire(PRIORITY_TOOL, "b"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as full:
+            await admission.acquire(PRIORITY_TOOL, "c")
+        assert full.value.reason == "queue_full" and full.value.retry_after >= 1
+        with pytest.raises(Overloaded) as late:
+            await waiter
+        assert late.value.reason == "deadline"
+        assert admission.queued() == 0
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_is_per_client_and_spares_emergencies():
+    async def scenario():
+        admission = controller(slots=10, rate=0.1, burst=2)
+        for _ in range(2):
+            await admission.acquire(PRIORITY_TOOL, "10.0.0.1")
+        with pytest.raises(Overloaded) as limited:
+            await admission.acquire(PRIORITY_TOOL, "10.0.0.1")
+        assert limited.value.reason == "rate_limited" and limited.value.retry_after >= 1
+        await admission.acquire(PRIORITY_TOOL, "10.0.0.2")  # another client has its own bucket
+        await admission.acquire(PRIORITY_EMERGENCY, "10.0.0.1")  # emergencies are never rate limited
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("admission.time.monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=1.0, burst=1)
+    assert bucket.allow("a") is None
+    assert bucket.allow("a") == 1
+    now[0] += 1.0
+    assert bucket.allow("a") is None
+
+
+def test_callers_behind_the_proxy_get_their_own_bucket(main, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "admission", controller(slots=4, rate=0.001, burst=1))
+    proxy = TestClient(main.app, client=("127.0.0.1", 40000))
+    batch = {"items": [{"text": "bonjour"}]}
+
+    def post(client, caller):
+        return client.post("/translate-batch", json=batch, headers={"X-Forwarded-For": caller}).status_code
+
+    # 500: admitted, then Claude is not configured in tests
+    assert post(proxy, "203.0.113.1") == 500
+    assert post(proxy, "203.0.113.1") == 429
+    assert post(proxy, "203.0.113.2") == 500
+    # An untrusted peer cannot choose its key
+    direct = TestClient(main.app, client=("198.51.100.7", 40000))
+    assert post(direct, "203.0.113.3") == 500
+    assert post(direct, "203.0.113.4") == 429
@@ -0,0 +1,213 @@
+"""Audio archive: deduplication, races between workers, access batching, eviction and transcoding"""
+
+from datetime import datetime, timedelta
+from threading import Barrier, Thread
+import math
+import os
+import shutil
+import struct
+import subprocess
+import time
+import wave
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from audio_archive import ARCHIVE_EVENTS, AudioArchive
+from models import AudioBlob, AudioRecording, Base
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'archive.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def archive(tmp_path, factory, **kwargs):
+    kwargs.setdefault("max_bytes", 0)
+    kwargs.setdefault("max_age_days", 0)
+    return AudioArchive(str(tmp_path / "uploads"), factory, transcode=False, **kwargs)
+
+
+def upload(tmp_path, content: bytes, name: str) -> str:
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def stored_files(tmp_path):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), tmp_path / "uploads")
+        for directory, _, names in os.walk(tmp_path / "uploads") for name in names
+    )
+
+
+def rows(factory, model):
+    db = factory()
+    try:
+        return db.query(model).all()
+    finally:
+        db.close()
+
+
+def test_same_recording_is_stored_once(tmp_path, factory):
+    store = archive(tmp_path, factory)
+    deduplicated = ARCHIVE_EVENTS.value(event="deduplicated")
+    first = upload(tmp_path, b"RIFF call audio", "a.wav")
+    second = upload(tmp_path, b"RIFF call audio", "b.wav")
+
+    sha256 = store.store(first, "call.wav", 12.0, session_id=None)
+    assert store.store(second, "again.WAV", 12.0, session_id=None) == sha256
+
+    assert not os.path.exists(first) and not os.path.exists(second)
+    assert stored_files(tmp_path) == [os.path.join("objects", sha256[:2], f"{sha256}.wav")]
+    [blob] = rows(factory, AudioBlob)
+    assert (blob.codec, blob.stored_size, blob.duration) == ("original", len(b"RIFF call audio"), 12.0)
+    assert store.total_bytes == len(b"RIFF call audio")
+    assert ARCHIVE_EVENTS.value(event="deduplicated") == deduplicated + 1
+
+
+def test_concurrent_workers_create_one_blob(tmp_path, factory):
+    workers = [archive(tmp_path, factory) for _ in range(4)]
+    barrier = Barrier(len(workers))
+    paths = [upload(tmp_path, b"same bytes from four uploads", f"{i}.mp3") for i in range(len(workers))]
+
+    def run(worker, path):
+        barrier.wait()
+        worker.store(path, "call.mp3", 3.0)
+
+    threads = [Thread(target=run, args=pair) for pair in zip(workers, paths)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(rows(factory, AudioBlob)) == 1
+    assert len(stored_files(tmp_path)) == 1
+    assert sum(worker.total_bytes for worker in workers) == len(b"same bytes from four uploads")
+
+
+def test_upload_that_loses_the_insert_is_a_duplicate(tmp_path, factory):
+    winner, loser = archive(tmp_path, factory), archive(tmp_path, factory)
+    place = loser._place
+
+    def place_after_the_winner(path, relative):
+        # The other worker commits the row between our lookup and our insert
+        winner.store(upload(tmp_path, b"raced", "winner.ogg"), "call.ogg", 1.0)
+        return place(path, relative)
+
+    loser._place = place_after_the_winner
+    sha256 = loser.store(upload(tmp_path, b"raced", "loser.m4a"), "call.m4a", 1.0, session_id=7)
+
+    [blob] = rows(factory, AudioBlob)
+    assert blob.path.endswith(".ogg")
+    assert stored_files(tmp_path) == [blob.path]
+    assert [(r.session_id, r.sha256) for r in rows(factory, AudioRecording)] == [(7, sha256)]
+    assert (winner.total_bytes, loser.total_bytes) == (len(b"raced"), 0)
+
+
+def test_playback_batches_access_times_off_the_request(tmp_path, factory):
+    store = archive(tmp_path, factory, access_flush_seconds=3600)
+    sha256 = store.store(upload(tmp_path, b"audio", "a.wav"), "a.wav", 1.0)
+    [before] = rows(factory, AudioBlob)
+
+    db = factory()
+    assert store.open_blob(db, sha256).sha256 == sha256
+    assert not db.dirty
+    db.close()
+    assert rows(factory, AudioBlob)[0].last_accessed_at == before.last_accessed_at
+
+    assert store.flush_access() == 1
+    assert rows(factory, AudioBlob)[0].last_accessed_at > before.last_accessed_at
+    assert store.open_blob(factory(), "0" * 64) is None
+
+
+def test_evicted_blob_is_revived_by_a_new_upload(tmp_path, factory):
+    store = archive(tmp_path, factory, max_bytes=10)
+    small = store.store(upload(tmp_path, b"small", "small.wav"), "small.wav", 1.0)
+    time.sleep(0.01)
+    store.store(upload(tmp_path, b"large enough to evict", "large.wav"), "large.wav", 1.0)
+    store.enforce_budget()
+    assert {blob.sha256: blob.path for blob in rows(factory, AudioBlob)}[small] is None
+
+    store.enforce_budget = lambda: 0
+    assert store.store(upload(tmp_path, b"small", "again.wav"), "small.wav", 1.0) == small
+    blob = {blob.sha256: blob for blob in rows(factory, AudioBlob)}[small]
+    assert blob.path is not None and blob.evicted_at is None
+    assert os.path.exists(store.absolute(blob.path))
+
+
+def test_budget_covers_what_every_worker_stored(tmp_path, factory):
+    first, second = archive(tmp_path, factory, max_bytes=25), archive(tmp_path, factory, max_bytes=25)
+    first.enforce_budget = second.enforce_budget = lambda: 0  # check the budget by hand below
+    old = first.store(upload(tmp_path, b"0123456789" * 2, "old.wav"), "old.wav", 1.0)
+    time.sleep(0.01)
+    new = second.store(upload(tmp_path, b"abcdefghij" * 2, "new.wav"), "new.wav", 1.0)
+    assert (first.total_bytes, second.total_bytes) == (20, 20)  # each under budget on its own
+
+    del first.enforce_budget, second.enforce_budget
+    assert first.enforce_budget() == 1
+    assert {blob.sha256: blob.path is not None for blob in rows(factory, AudioBlob)} == {old: False, new: True}
+    assert second.enforce_budget() == 0  # already evicted: not evicted or counted again
+    assert first.total_bytes == second.total_bytes == 20
+    assert len(stored_files(tmp_path)) == 1
+
+
+def test_age_limit_is_applied_without_new_uploads(tmp_path, factory):
+    store = archive(tmp_path, factory, max_age_days=30, budget_seconds=0.05)
+    store.store(upload(tmp_path, b"old call", "old.wav"), "old.wav", 1.0)
+    db = factory()
+    db.query(AudioBlob).update({"created_at": datetime.utcnow() - timedelta(days=31)})
+    db.commit()
+    db.close()
+    store.start()
+    try:
+        deadline = time.time() + 5
+        while rows(factory, AudioBlob)[0].path is not None and time.time() < deadline:
+            time.sleep(0.02)
+        assert rows(factory, AudioBlob)[0].path is None and stored_files(tmp_path) == []
+        assert store.total_bytes == 0
+    finally:
+        store.stop()
+
+
+def test_superseded_files_are_unlinked_after_the_grace_period(tmp_path, factory):
+    store = archive(tmp_path, factory, retire_seconds=0.05)
+    first, second = tmp_path / "first.wav", tmp_path / "second.wav"
+    first.write_bytes(b"1")
+    second.write_bytes(b"2")
+    store._retire(str(first))
+    assert first.exists()
+    time.sleep(0.2)
+    assert not first.exists()
+
+    store.retire_seconds = 3600
+    store._retire(str(second))
+    store.stop()
+    assert not second.exists()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="transcoding needs ffmpeg")
+def test_stereo_upload_stays_stereo_after_transcoding(tmp_path, factory):
+    path = tmp_path / "call.wav"
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"".join(
+            struct.pack("<hh", int(8000 * math.sin(i * 0.17)), int(8000 * math.sin(i * 0.29))) for i in range(16000)
+        ))
+    store = AudioArchive(str(tmp_path / "uploads"), factory, max_bytes=0, max_age_days=0)
+    store.store(str(path), "call.wav", 1.0)
+    store._executor.shutdown(wait=True)  # let the background transcode finish
+
+    [blob] = rows(factory, AudioBlob)
+    assert blob.codec == "opus" and blob.path.endswith(".opus")
+    probe = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=channels", "-of", "csv=p=0",
+         store.absolute(blob.path)],
+        capture_output=True, text=True, check=True
+    )
+    assert probe.stdout.strip() == "2"
@@ -0,0 +1,15 @@
+"""Benchmark statistics: nearest-rank percentiles"""
+
+import random
+
+from benchmark import percentile
+
+
+def test_nearest_rank_percentiles():
+    values = list(range(1, 101))
+    random.Random(7).shuffle(values)
+    assert [percentile(values, p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert percentile(list(range(1, 21)), 95) == 19
+    assert percentile(list(range(1, 11)), 50) == 5
+    assert percentile([3.0], 99) == 3.0 and percentile([], 50) == 0.0
+    assert percentile([1, 2, 3], 0) == 1
@@ -0,0 +1,62 @@
+"""Dual-channel recordings: per-speaker turns interleaved by time"""
+
+import math
+import shutil
+import struct
+import wave
+
+import pytest
+
+
+def segment(start, end, text, avg_logprob=-0.1, no_speech_prob=0.0):
+    return {"start": start, "end": end, "text": text, "avg_logprob": avg_logprob, "no_speech_prob": no_speech_prob}
+
+
+def test_turns_follow_the_conversation_across_channels(main):
+    caller = {"language": "fr", "segments": [
+        segment(0.0, 2.0, " Allô, mon père est tombé."),
+        segment(2.1, 3.0, " Il ne répond plus."),
+        segment(7.0, 8.0, " Rue de la Paix."),
+        segment(9.0, 9.5, "  "),
+    ]}
+    agent = {"language": "en", "segments": [
+        segment(3.5, 5.0, " Is he breathing?"),
+        segment(5.2, 6.5, " Where are you?"),
+    ]}
+    turns = main.interleave_turns([("caller", caller), ("agent", agent)])
+
+    assert [(t["speaker"], t["language"], t["text"]) for t in turns] == [
+        ("caller", "fr", "Allô, mon père est tombé. Il ne répond plus."),
+        ("agent", "en", "Is he breathing? Where are you?"),
+        ("caller", "fr", "Rue de la Paix."),
+    ]
+    assert [(t["start"], t["end"]) for t in turns] == [(0.0, 3.0), (3.5, 6.5), (7.0, 8.0)]
+    assert all(0 < t["confidence"] <= 1 for t in turns)
+
+
+def test_overlapping_speech_is_ordered_by_start_time(main):
+    turns = main.interleave_turns([
+        ("caller", {"segments": [segment(1.0, 4.0, "help"), segment(4.5, 5.0, "please")]}),
+        ("agent", {"segments": [segment(2.0, 3.0, "okay")]}),
+    ])
+    assert [(t["speaker"], t["text"]) for t in turns] == [("caller", "help"), ("agent", "okay"), ("caller", "please")]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="decoding channels needs ffmpeg")
+def test_only_distinct_audible_channels_are_split(main, tmp_path):
+    def write(name, left, right):
+        path = tmp_path / name
+        with wave.open(str(path), "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(b"".join(struct.pack("<hh", left(i), right(i)) for i in range(16000)))
+        return str(path)
+
+    tone = lambda i: int(8000 * math.sin(i * 0.17))
+    other = lambda i: int(8000 * math.sin(i * 0.29))
+    silent = lambda i: 0
+
+    assert [speaker for speaker, _ in main.split_speaker_channels(write("both.wav", tone, other))] == ["caller", "agent"]
+    assert [speaker for speaker, _ in main.split_speaker_channels(write("agent.wav", silent, other))] == ["agent"]
+    assert main.split_speaker_channels(write("same.wav", tone, tone)) is None
@@ -0,0 +1,119 @@
+"""Cold storage: archiving completed calls to Parquet and reading them back"""
+
+from datetime import datetime, timedelta
+import os
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cold_storage import ColdStorage, load_hot_session
+from models import (
+    ArchivedSession, AudioRecording, Base, ChatMessage, ChatSession, ChatSessionGuide, SessionEvent,
+    TranscriptSegment, UserCaller,
+)
+from search import index_messages, init_search_index, search_messages
+from stats import CallStats
+import event_log
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'hot.db'}")
+    Base.metadata.create_all(bind=engine)
+    init_search_index(engine)
+    return sessionmaker(bind=engine)
+
+
+def add_call(db, name: str, ended_days_ago: float, status: str = "completed") -> int:
+    started = datetime.utcnow() - timedelta(days=ended_days_ago, minutes=5)
+    caller = UserCaller(fullname=name, language="french", location="Lyon")
+    db.add(caller)
+    db.flush()
+    session = ChatSession(user_caller_id=caller.id, user_agent_id=1, status=status, started_at=started,
+                          ended_at=started + timedelta(minutes=5) if status == "completed" else None)
+    db.add(session)
+    db.flush()
+    messages = [
+        ChatMessage(session_id=session.id, sender_type="caller", message=f"{name} a de la fièvre",
+                    confidence_score=0.9, unresolved=False, created_at=started + timedelta(seconds=10)),
+        ChatMessage(session_id=session.id, sender_type="agent", message="depuis quand ?",
+                    unresolved=True, created_at=started + timedelta(seconds=20)),
+    ]
+    db.add_all(messages)
+    db.flush()
+    index_messages(db, [(m.id, m.message, "french") for m in messages])
+    db.add_all([
+        TranscriptSegment(session_id=session.id, message_id=messages[0].id, start_time=0.0, end_time=1.5,
+                          text=messages[0].message, confidence=0.8),
+        ChatSessionGuide(session_id=session.id, question_suggestions=[{"question": "Âge ?", "status": "asked"}],
+                         department_suggestions=None),
+        AudioRecording(session_id=session.id, message_id=messages[0].id, sha256="ab" * 32, filename="call.mp3"),
+    ])
+    event_log.append(db, session.id, "call_started", {"caller": {"fullname": name}}, at=started)
+    event_log.append_rows(db, [event_log.message_event(m) for m in messages])
+    db.commit()
+    return session.id
+
+
+def comparable(record: dict) -> dict:
+    return {key: value for key, value in record.items() if key not in ("storage", "archived_at")}
+
+
+def test_archived_call_reads_back_exactly_as_it_was(tmp_path, factory):
+    db = factory()
+    old = [add_call(db, f"Caller {i}", ended_days_ago=40) for i in range(3)]
+    recent = add_call(db, "Recent", ended_days_ago=1)
+    live = add_call(db, "Live", ended_days_ago=0, status="ongoing")
+    before = {session_id: load_hot_session(db, session_id) for session_id in old}
+    db.close()
+
+    storage = ColdStorage(str(tmp_path / "archive"), factory)
+    result = storage.archive(older_than_days=30, batch_size=2)
+    assert (result["archived_sessions"], result["batches"]) == (3, 2)
+
+    db = factory()
+    for session_id in old:
+        assert load_hot_session(db, session_id) is None
+        record = storage.load_session(db, session_id)
+        assert record["storage"] == "archive" and record["archived_at"] is not None
+        assert comparable(record) == comparable(before[session_id])
+    assert load_hot_session(db, recent) is not None and load_hot_session(db, live) is not None
+    assert storage.load_session(db, recent) is None
+
+    # Archived rows left the hot tables and the search index
+    for model in (ChatMessage, TranscriptSegment, ChatSessionGuide, AudioRecording, SessionEvent):
+        assert {row.session_id for row in db.query(model)} == {recent, live}
+    assert {hit["session_id"] for hit in search_messages(db, "fièvre")} == {recent, live}
+
+    # ...but still count on the dashboard
+    stats = CallStats()
+    stats.rebuild(db)
+    assert stats.sessions_by_status == {"completed": 4, "ongoing": 1}
+    assert stats.handled_calls == 4
+    assert stats.handle_time_total == pytest.approx(4 * 300)
+    assert db.get(ArchivedSession, old[0]).message_count == 2
+    db.close()
+
+
+def test_rows_written_twice_are_read_once(tmp_path, factory):
+    db = factory()
+    session_id = add_call(db, "Once", ended_days_ago=40)
+    add_call(db, "Newest", ended_days_ago=1)
+    db.close()
+    storage = ColdStorage(str(tmp_path / "archive"), factory)
+    storage.archive(older_than_days=30)
+
+    # A batch re-run after a crash before its commit leaves a second copy of the files
+    for directory, _, names in os.walk(storage.root):
+        for name in names:
+            shutil.copy(os.path.join(directory, name), os.path.join(directory, "part-rerun.parquet"))
+
+    db = factory()
+    record = storage.load_session(db, session_id)
+    assert len(record["messages"]) == 2 and len(record["events"]) == 3 and len(record["segments"]) == 1
+    assert storage.report(db)["archived_sessions"] == 1
+    db.close()
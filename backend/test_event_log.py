@@ -0,0 +1,80 @@
+"""Session event log: replay, snapshots and backfill agree with the tables"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, ChatMessage, ChatSession, SessionEvent, SessionSnapshot, UserAgent, UserCaller
+from stats import CallStats
+import event_log
+
+
+def assert_replay_matches_tables(db):
+    projected = event_log.project_stats(event_log.replay(db, batch_size=3))
+    stats = CallStats()
+    stats.rebuild(db)
+    assert projected["sessions_by_status"] == stats.sessions_by_status
+    assert projected["handled_calls"] == stats.handled_calls
+    assert abs(projected["handle_time_total"] - stats.handle_time_total) < 0.01
+
+
+def test_replaying_the_calls_log_matches_call_stats(main):
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main.app)
+    db = main.SessionLocal()
+    db.add_all([UserAgent(fullname=f"Agent {i}", hospital_location="Paris", status="available", language="french")
+                for i in range(3)])
+    db.commit()
+    db.close()
+
+    caller = {"phone_number": "0600000000", "language": "french", "location": "Paris", "sex": "female"}
+    ids = [client.post("/start-call", json=dict(caller, fullname=f"Caller {i}")).json()["session_id"] for i in range(3)]
+    for session_id in ids:
+        for text in ("bonjour", "il est tombé"):
+            assert client.post("/send-message", json={"session_id": session_id, "sender_type": "caller", "message": text}).status_code == 200
+    client.post("/send-message", json={"session_id": ids[1], "sender_type": "caller", "message": "he is unconscious"})
+    for session_id in ids[:2]:
+        assert client.post(f"/end-call/{session_id}").status_code == 200
+
+    db = main.SessionLocal()
+    assert_replay_matches_tables(db)
+
+    # A finished call's snapshot is its whole history; a live call is replayed from the log
+    state = client.get(f"/sessions/{ids[1]}/state").json()
+    assert state["status"] == "completed" and len(state["messages"]) == 3
+    assert db.get(SessionSnapshot, ids[1]).state == state
+    _, replayed, _ = event_log.load_state(db, ids[1])
+    assert replayed == 0
+    live = client.get(f"/sessions/{ids[2]}/state").json()
+    assert live["status"] == "ongoing" and [m["message"] for m in live["messages"]] == ["bonjour", "il est tombé"]
+    db.close()
+
+
+def test_backfilled_history_matches_call_stats(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'log.db'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    started = datetime(2025, 3, 1, 8, 0)
+    agent = UserAgent(fullname="Agent", language="french", status="occupied")
+    db.add(agent)
+    db.flush()
+    for i, (status, minutes) in enumerate([("completed", 4), ("completed", 11), ("emergency", None), ("ongoing", None)]):
+        caller = UserCaller(fullname=f"Caller {i}", language="french")
+        db.add(caller)
+        db.flush()
+        session = ChatSession(user_caller_id=caller.id, user_agent_id=agent.id, status=status, started_at=started,
+                              ended_at=started + timedelta(minutes=minutes) if minutes else None)
+        db.add(session)
+        db.flush()
+        db.add(ChatMessage(session_id=session.id, sender_type="caller", message="allô", created_at=started))
+    db.commit()
+
+    event_log.init_event_log(factory)
+    assert_replay_matches_tables(db)
+    backfilled = db.query(SessionEvent).count()
+    event_log.init_event_log(factory)  # only once
+    assert db.query(SessionEvent).count() == backfilled
+    db.close()
@@ -0,0 +1,98 @@
+"""Grid index searches and nearest-agent claims"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+import time
+
+from geo import GridIndex, haversine_km
+
+
+def test_nearest_matches_a_full_scan():
+    index = GridIndex()
+    points = {i: (40 + (i * 7 % 97) / 10, -5 + (i * 13 % 89) / 10) for i in range(300)}
+    for key, point in points.items():
+        index.add(key, point)
+    index.remove(0)
+    query = (45.0, 2.0)
+    expected = sorted((haversine_km(query, p), key) for key, p in points.items() if key != 0)[:5]
+    assert index.nearest(query, 5) == expected
+
+
+def test_search_wraps_around_the_antimeridian():
+    index = GridIndex()
+    index.add("fiji", (-17.8, 179.9))
+    index.add("far", (-17.8, -175.0))  # same side as the query, but farther
+    distance, key = index.nearest((-17.8, -179.9), 1)[0]
+    assert key == "fiji" and distance < 25
+    assert [key for _, key in index.nearest((-17.8, -179.9), 2)] == ["fiji", "far"]
+
+
+def test_concurrent_calls_never_claim_the_same_agent(main):
+    from models import UserAgent
+
+    db = main.SessionLocal()
+    db.query(UserAgent).update({"status": "offline"})
+    agents = [
+        UserAgent(fullname=f"Agent {i}", hospital_location=city, status="available", language="french")
+        for i, city in enumerate(["Paris", "Paris", "Versailles", "Lyon"])
+    ]
+    db.add_all(agents)
+    db.commit()
+    main.agent_directory.rebuild(db.query(UserAgent).filter(UserAgent.status == "available").all())
+    db.close()
+
+    callers = 8
+    barrier = Barrier(callers)
+
+    def claim(_):
+        session = main.SessionLocal()
+        try:
+            barrier.wait()
+            agent, distance_km = main.claim_nearest_agent(session, "Paris", "french")
+            return agent.id if agent else None
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(callers) as pool:
+        claimed = list(pool.map(claim, range(callers)))
+
+    winners = [agent_id for agent_id in claimed if agent_id is not None]
+    assert sorted(winners) == sorted(agent.id for agent in agents)
+    assert claimed.count(None) == callers - len(agents)
+    db = main.SessionLocal()
+    assert db.query(UserAgent).filter(UserAgent.status == "available").count() == 0
+    db.close()
+
+
+def test_agents_changed_by_another_worker_are_picked_up(main):
+    from models import UserAgent
+
+    db = main.SessionLocal()
+    db.query(UserAgent).update({"status": "offline"})
+    taken, freed = UserAgent(fullname="Taken", hospital_location="Paris", status="available", language="french"), \
+        UserAgent(fullname="Freed", hospital_location="Lyon", status="offline", language="french")
+    db.add_all([taken, freed])
+    db.commit()
+    main.agent_directory.rebuild(main.available_agents(db))
+
+    # Another worker claims one agent and frees the other; this worker's directory is not told
+    db.query(UserAgent).filter(UserAgent.id == taken.id).update({"status": "occupied"})
+    db.query(UserAgent).filter(UserAgent.id == freed.id).update({"status": "available"})
+    db.commit()
+    agent, _ = main.claim_nearest_agent(db, "Paris", "french")
+    assert agent.id == freed.id
+    assert main.agent_directory.available() == 0
+    assert main.claim_nearest_agent(db, "Paris", "french") == (None, None)
+
+    # The periodic refresh brings in agents freed elsewhere without waiting for a miss
+    db.query(UserAgent).filter(UserAgent.id == taken.id).update({"status": "available"})
+    db.commit()
+    main.agent_directory.start(main.load_available_agents, 0.05)
+    try:
+        deadline = time.time() + 5
+        while main.agent_directory.available() == 0 and time.time() < deadline:
+            time.sleep(0.02)
+        assert main.agent_directory.candidates("Paris", "french") == [(taken.id, 0.0)]
+    finally:
+        main.agent_directory.stop()
+    db.close()
@@ -0,0 +1,85 @@
+"""Full-text search across the stemmed (English) and unstemmed indexes"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, ChatMessage, ChatSession, UserAgent, UserCaller
+from search import index_messages, init_search_index, search_messages, unindex_messages
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(bind=engine)
+    init_search_index(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_call(db, language: str, messages, status: str = "ongoing"):
+    caller = UserCaller(fullname="Caller", language=language)
+    agent = UserAgent(fullname="Agent", language="french", status="occupied")
+    db.add_all([caller, agent])
+    db.flush()
+    session = ChatSession(user_caller_id=caller.id, user_agent_id=agent.id, status=status)
+    db.add(session)
+    db.flush()
+    rows = [ChatMessage(session_id=session.id, sender_type="caller", message=text) for text in messages]
+    db.add_all(rows)
+    db.flush()
+    index_messages(db, [(row.id, row.message, language) for row in rows])
+    db.commit()
+    return session, rows
+
+
+def test_english_is_stemmed_and_french_folds_accents(db):
+    add_call(db, "english", ["He is bleeding a lot"])
+    add_call(db, "french", ["Il a mal à l'épaule"])
+    assert [hit["snippet"] for hit in search_messages(db, "bleed")] == ["He is [bleeding] a lot"]
+    assert [hit["snippet"] for hit in search_messages(db, "epaule")] == ["Il a mal à l'[épaule]"]
+
+
+def test_both_indexes_are_searched_and_interleaved(db):
+    _, english = add_call(db, "english", ["fire fire fire in the kitchen", "a small fire"])
+    _, french = add_call(db, "french", ["fire dans la cuisine", "le fire est éteint, fire fire"])
+    hits = search_messages(db, "fire")
+    assert len(hits) == 4
+    # Each index contributes its own best hit before anyone's second best
+    assert {hits[0]["message_id"], hits[1]["message_id"]} == {english[0].id, french[1].id}
+    assert hits[0]["rank"] == hits[1]["rank"] > hits[2]["rank"] > 0
+    assert search_messages(db, "fire", language="english")[0]["message_id"] == english[0].id
+
+
+def test_filters_and_pagination(db):
+    add_call(db, "french", ["douleur thoracique"], status="completed")
+    session, _ = add_call(db, "french", ["douleur au bras", "douleur au dos"], status="emergency")
+    assert {hit["session_id"] for hit in search_messages(db, "douleur", status="emergency")} == {session.id}
+    first = search_messages(db, "douleur", limit=2)
+    second = search_messages(db, "douleur", limit=2, offset=2)
+    assert len(first) == 2 and len(second) == 1
+    assert not {hit["message_id"] for hit in first} & {hit["message_id"] for hit in second}
+
+
+def test_prefix_search_and_unindex(db):
+    _, rows = add_call(db, "english", ["unconscious patient"])
+    assert len(search_messages(db, "uncons*")) == 1
+    unindex_messages(db, [(rows[0].id, rows[0].message)])
+    db.commit()
+    assert search_messages(db, "unconscious") == []
+
+
+def test_databases_without_fts5_fall_back_to_substring_match(db, monkeypatch):
+    import search
+
+    monkeypatch.setattr(search, "search_supported", lambda engine: False)
+    _, english = add_call(db, "english", ["Smoke_detector went off, fire in the kitchen"])
+    _, french = add_call(db, "french", ["Le FEU a pris dans la cuisine", "il y a du feu partout"], status="emergency")
+    assert [hit["message_id"] for hit in search_messages(db, "feu")] == [french[1].id, french[0].id]
+    assert search_messages(db, "feu")[1]["snippet"] == "Le [FEU] a pris dans la cuisine"
+    assert [hit["message_id"] for hit in search_messages(db, "fire kitchen", language="english")] == [english[0].id]
+    assert search_messages(db, "fire", language="french") == []
+    add_call(db, "english", ["smokeydetector"])  # _ is not a wildcard
+    assert [hit["message_id"] for hit in search_messages(db, "smoke_detector")] == [english[0].id]
+    assert [hit["message_id"] for hit in search_messages(db, "feu", status="emergency", limit=1, offset=1)] == [french[0].id]
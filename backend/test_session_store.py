@@ -0,0 +1,136 @@
+"""Active session store: write-behind flushing, disabled mode and the message tail"""
+
+from datetime import datetime, timedelta
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, ChatMessage, ChatSession, ChatSessionGuide, SessionEvent, UserAgent, UserCaller
+from search import init_search_index, search_messages
+from session_store import SessionStore
+import session_store
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'store.db'}")
+    Base.metadata.create_all(bind=engine)
+    init_search_index(engine)
+    return sessionmaker(bind=engine)
+
+
+def start_call(factory, store=None):
+    db = factory()
+    caller = UserCaller(fullname="Caller", language="english")
+    agent = UserAgent(fullname="Agent", language="french", status="occupied")
+    db.add_all([caller, agent])
+    db.flush()
+    session = ChatSession(user_caller_id=caller.id, user_agent_id=agent.id, status="ongoing")
+    db.add(session)
+    db.commit()
+    if store is not None:
+        store.add(session, caller.language, agent.language)
+    session_id = session.id
+    db.close()
+    return session_id
+
+
+def persisted(factory, session_id):
+    db = factory()
+    try:
+        return [m.message for m in db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.id)]
+    finally:
+        db.close()
+
+
+def test_messages_are_acknowledged_then_written_behind_in_one_batch(factory):
+    store = SessionStore(factory, enabled=True, flush_interval=60)
+    session_id = start_call(factory, store)
+    session = store.get(session_id)
+    store.append_message(session, "caller", "my father collapsed")
+    store.append_message(session, "agent", "est-il conscient ?")
+
+    assert [m["message"] for m in store.get(session_id).messages] == ["my father collapsed", "est-il conscient ?"]
+    assert persisted(factory, session_id) == []
+
+    assert store.flush() == 2
+    assert persisted(factory, session_id) == ["my father collapsed", "est-il conscient ?"]
+    db = factory()
+    assert [hit["session_id"] for hit in search_messages(db, "collapse")] == [session_id]  # stemmed as English
+    assert db.query(SessionEvent).filter(SessionEvent.type == "message_added").count() == 2
+    db.close()
+
+
+def test_failed_flush_keeps_the_batch_queued(factory, monkeypatch):
+    store = SessionStore(factory, enabled=True, flush_interval=60)
+    session_id = start_call(factory, store)
+    store.append_message(store.get(session_id), "caller", "hello")
+
+    def broken(db, rows):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(session_store, "index_messages", broken)
+    with pytest.raises(ConnectionError):
+        store.flush()
+    assert persisted(factory, session_id) == []
+    monkeypatch.undo()
+    store.end(session_id)
+    assert persisted(factory, session_id) == ["hello"]
+
+
+def test_disabled_store_fails_the_write_without_queueing_it(factory, monkeypatch):
+    store = SessionStore(factory, enabled=False)
+    session_id = start_call(factory, store)
+
+    def broken(db, rows):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(session_store, "index_messages", broken)
+    with pytest.raises(ConnectionError):
+        store.append_message(store.get(session_id), "caller", "hello")
+    monkeypatch.undo()
+    assert store.flush() == 0
+    store.append_message(store.get(session_id), "caller", "hello")  # the client's retry
+    assert persisted(factory, session_id) == ["hello"]
+
+
+def test_disabled_store_writes_through_and_reads_the_tail_only_on_request(factory):
+    store = SessionStore(factory, enabled=False)
+    session_id = start_call(factory, store)
+    db = factory()
+    db.add(ChatSessionGuide(session_id=session_id, question_suggestions=[{"question": "Address?", "status": "not_asked"}]))
+    db.commit()
+    db.close()
+
+    session = store.get(session_id)
+    assert (session.status, session.caller_language, session.agent_language) == ("ongoing", "english", "french")
+    assert session.messages == [] and not session.complete and session.question_suggestions is None
+
+    store.append_message(session, "caller", "help")
+    assert persisted(factory, session_id) == ["help"]
+    assert store.get(session_id) is not session  # nothing is cached
+
+    feed = store.get(session_id, with_tail=True)
+    assert feed.complete and [m["message"] for m in feed.messages] == ["help"]
+    assert feed.question_suggestions[0]["question"] == "Address?"
+    assert store.get(session_id + 1000) is None
+
+
+def test_tail_stays_in_created_at_order(factory):
+    store = SessionStore(factory, enabled=True, flush_interval=60, tail_limit=3)
+    session_id = start_call(factory, store)
+    session = store.get(session_id)
+    store.append_message(session, "agent", "what happened?")
+    time.sleep(0.01)
+    store.append_message(session, "agent", "stay with me")
+
+    # Audio turns arrive after the fact, dated to when they were spoken
+    spoken = session.messages[0]["created_at"] + timedelta(microseconds=1)
+    store.add_persisted(session_id, [
+        ChatMessage(sender_type="caller", message="he fell", created_at=spoken),
+        ChatMessage(sender_type="caller", message="before everything", created_at=datetime(2000, 1, 1)),
+    ])
+    assert [m["message"] for m in session.messages] == ["what happened?", "he fell", "stay with me"]
+    assert not session.complete
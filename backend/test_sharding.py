@@ -0,0 +1,231 @@
+"""Regional shards: session id encoding, shard selection and the router"""
+
+from threading import Thread
+import json
+import time
+
+import pytest
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from geo import Gazetteer
+from models import Base, ChatSession
+from sharding import SESSION_ID_SPAN, Shard, ShardMap, next_session_id, session_id_base, shard_of
+import shard_router
+
+GAZETTEER = Gazetteer([
+    {"name": "Paris", "lat": 48.8566, "lon": 2.3522, "kind": "city"},
+    {"name": "Nantes", "lat": 47.2184, "lon": -1.5536, "kind": "city"},
+    {"name": "Marseille", "lat": 43.2965, "lon": 5.3698, "kind": "city"},
+    {"name": "Orleans", "lat": 47.9030, "lon": 1.9093, "kind": "city"},
+])
+REGIONS = {"nord": ["Paris"], "ouest": ["Nantes"], "sud": ["Marseille"]}
+
+
+def shard_map(overflow="nearest", urls=None):
+    return ShardMap([
+        Shard(index, name, (urls or {}).get(name, f"http://{name}"), REGIONS[name],
+              [n for n in REGIONS if n != name], default=index == 0)
+        for index, name in enumerate(REGIONS)
+    ], overflow, GAZETTEER)
+
+
+# -------- Id encoding and shard selection --------
+def test_session_ids_carry_their_shard():
+    assert session_id_base(0) == 0 and shard_of(41) == 0
+    assert shard_of(session_id_base(2) + 1) == 2 and shard_of(session_id_base(3) - 1) == 2
+    assert shard_map().for_session(SESSION_ID_SPAN * 2 + 7).name == "sud"
+    assert shard_map().for_session(SESSION_ID_SPAN * 9) is None
+
+
+def test_next_session_id_stays_in_the_shard_range(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ids.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    for shard_index in (2, 0, 2, 1):
+        db.execute(insert(ChatSession).values(id=next_session_id(ChatSession, shard_index), status="ongoing"))
+    db.commit()
+    assert sorted(id for (id,) in db.query(ChatSession.id)) == [
+        1, SESSION_ID_SPAN + 1, 2 * SESSION_ID_SPAN + 1, 2 * SESSION_ID_SPAN + 2
+    ]
+    db.close()
+
+
+def test_start_call_numbers_sessions_in_its_shard(main, monkeypatch):
+    from models import UserAgent
+
+    db = main.SessionLocal()
+    db.add_all([UserAgent(fullname=f"Agent {i}", hospital_location="Lyon", status="available", language="french") for i in range(2)])
+    db.commit()
+    db.close()
+    monkeypatch.setattr(main, "SHARD_INDEX", 3)
+    client = TestClient(main.app)
+    caller = {"fullname": "Caller", "phone_number": "0600000000", "language": "french", "location": "Lyon", "sex": "male"}
+    first, second = (client.post("/start-call", json=caller).json()["session_id"] for _ in range(2))
+    assert first == 3 * SESSION_ID_SPAN + 1 and second == first + 1
+    assert client.post("/send-message", json={"session_id": second, "sender_type": "caller", "message": "allô"}).status_code == 200
+
+
+def test_home_shard_and_overflow_order():
+    shards = shard_map()
+    assert shards.home("12 rue de la Paix, Paris").name == "nord"
+    assert shards.home("Orleans").name == "nord"  # not a region: nearest region wins
+    assert shards.home("somewhere unknown").name == "nord"  # default
+    assert [s.name for s in shards.candidates("Paris")] == ["nord", "ouest", "sud"]
+    assert [s.name for s in shard_map("none").candidates("Marseille")] == ["sud"]
+    assert [s.name for s in shard_map("neighbours").candidates("Nantes")] == ["ouest", "nord", "sud"]
+
+
+# -------- Router --------
+AUDIO = bytes(range(256)) * 1024
+
+
+def fake_shard(index: int, name: str, state: dict, tmp_path) -> FastAPI:
+    """A backend standing in for one shard"""
+    app = FastAPI()
+    audio = tmp_path / f"{name}.ogg"
+    audio.write_bytes(AUDIO)
+
+    @app.post("/start-call")
+    async def start_call(request: Request):
+        if name in state["full"]:
+            raise HTTPException(status_code=503, detail="No available agents at the moment")
+        return {"session_id": session_id_base(index) + 1, "agent_name": f"Agent {name}", **await request.json()}
+
+    @app.get("/live-feed/{session_id}")
+    def live_feed(session_id: int):
+        return {"served_by": name, "session_id": session_id}
+
+    @app.post("/process-audio")
+    async def process_audio(request: Request, session_id: int):
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        return {"served_by": name, "bytes": size, "content_length": request.headers.get("content-length")}
+
+    @app.get("/audio/{sha256}")
+    def play(sha256: str):
+        if sha256 != name:
+            raise HTTPException(status_code=404, detail="Recording not found or evicted")
+        return FileResponse(audio, media_type="audio/ogg")
+
+    @app.get("/search")
+    def search(q: str, page: int = 1, page_size: int = 20):
+        hits = [
+            {"message_id": i, "session_id": session_id_base(index) + i, "sender_type": "caller",
+             "created_at": f"2025-01-0{i}", "snippet": f"[{q}] {name}", "rank": 1.0 / (60 + i + index)}
+            for i in range(1, 4)
+        ]
+        start = (page - 1) * page_size
+        return {"query": q, "page": page, "page_size": page_size, "has_more": len(hits) > start + page_size,
+                "results": hits[start:start + page_size]}
+
+    @app.get("/cold-storage")
+    def cold_storage():
+        return {"archived_sessions": index + 1, "oldest_day": f"2025-0{index + 1}-01", "newest_day": f"2025-0{index + 2}-01",
+                "bytes": 1000 * (index + 1), "root": f"/archive/{name}"}
+
+    @app.get("/audio-archive")
+    def audio_archive():
+        return {"stored_bytes": 3600, "audio_hours": 0.5, "bytes_per_call_hour": 7200, "max_bytes": 10000,
+                "max_age_days": 90, "transcoding": True}
+
+    return app
+
+
+@pytest.fixture(scope="module")
+def shard_urls(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("shards")
+    state = {"full": set()}
+    servers, urls = [], {}
+    for index, name in enumerate(REGIONS):
+        server = uvicorn.Server(uvicorn.Config(fake_shard(index, name, state, tmp_path), host="127.0.0.1", port=0, log_level="warning"))
+        Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+        urls[name] = f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}"
+        servers.append(server)
+    yield urls, state
+    for server in servers:
+        server.should_exit = True
+
+
+@pytest.fixture
+def router(shard_urls, tmp_path, monkeypatch):
+    urls, state = shard_urls
+    config = {"overflow": "nearest", "shards": [shard.to_dict() for shard in shard_map(urls=urls).shards]}
+    path = tmp_path / "shards.json"
+    path.write_text(json.dumps(config))
+    monkeypatch.setattr(shard_router, "SHARDS_FILE", str(path))
+    monkeypatch.setattr(shard_router, "Gazetteer", type("FixedGazetteer", (), {"load": staticmethod(lambda _: GAZETTEER)}))
+    state["full"].clear()
+    with TestClient(shard_router.app) as client:
+        yield client, state
+
+
+CALLER = {"fullname": "Caller", "phone_number": "0600000000", "language": "french", "sex": "female"}
+
+
+def test_call_overflows_to_the_nearest_shard_with_agents(router, monkeypatch):
+    client, state = router
+    home = client.post("/start-call", json=dict(CALLER, location="Paris")).json()
+    assert (home["shard"], home["overflow"], home["session_id"]) == ("nord", False, 1)
+
+    state["full"].add("nord")
+    overflowed = shard_router.SHARD_CALLS.value(shard="ouest", route="overflow")
+    response = client.post("/start-call", json=dict(CALLER, location="Paris"))
+    assert response.headers["x-shard"] == "ouest"
+    assert (response.json()["overflow"], response.json()["session_id"]) == (True, SESSION_ID_SPAN + 1)
+    assert shard_router.SHARD_CALLS.value(shard="ouest", route="overflow") == overflowed + 1
+
+    state["full"].update(REGIONS)
+    assert client.post("/start-call", json=dict(CALLER, location="Paris")).status_code == 503
+    state["full"] = {"nord"}
+    monkeypatch.setattr(shard_router.shard_map, "overflow", "none")
+    assert client.post("/start-call", json=dict(CALLER, location="Paris")).status_code == 503
+
+
+def test_session_requests_reach_the_shard_in_their_id(router):
+    client, _ = router
+    session_id = session_id_base(2) + 5
+    assert client.get(f"/live-feed/{session_id}").json() == {"served_by": "sud", "session_id": session_id}
+    assert client.get(f"/live-feed/{session_id_base(7)}").status_code == 404
+
+    upload = client.post(f"/process-audio?session_id={session_id_base(1) + 1}", files={"audio_file": ("a.mp3", AUDIO)})
+    assert upload.json()["served_by"] == "ouest"
+    assert upload.json()["bytes"] == int(upload.json()["content_length"]) > len(AUDIO)
+
+
+def test_playback_is_streamed_with_ranges(router):
+    client, _ = router
+    full = client.get("/audio/sud")
+    assert full.content == AUDIO and full.headers["content-length"] == str(len(AUDIO))
+    assert full.headers["accept-ranges"] == "bytes" and full.headers["x-shard"] == "sud"
+    part = client.get("/audio/ouest", headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == AUDIO[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(AUDIO)}"
+    assert client.get("/audio/nowhere").status_code == 404
+
+
+def test_search_and_reports_cover_every_shard(router):
+    client, _ = router
+    page = client.get("/search", params={"q": "fire", "page_size": 4}).json()
+    assert [(hit["shard"], hit["message_id"]) for hit in page["results"]] == [("nord", 1), ("nord", 2), ("ouest", 1), ("nord", 3)]
+    assert page["has_more"] and page["unavailable_shards"] == []
+    rest = client.get("/search", params={"q": "fire", "page_size": 4, "page": 2}).json()
+    last = client.get("/search", params={"q": "fire", "page_size": 4, "page": 3}).json()
+    assert len(rest["results"]) == 4 and rest["has_more"] and not last["has_more"]
+    assert [(hit["shard"], hit["message_id"]) for hit in last["results"]] == [("sud", 3)]
+    assert {(hit["shard"], hit["message_id"]) for hit in page["results"] + rest["results"] + last["results"]} == {
+        (name, i) for name in REGIONS for i in range(1, 4)
+    }
+
+    cold = client.get("/cold-storage").json()
+    assert (cold["archived_sessions"], cold["bytes"], cold["oldest_day"], cold["newest_day"]) == (6, 6000, "2025-01-01", "2025-04-01")
+    archive = client.get("/audio-archive").json()
+    assert (archive["stored_bytes"], archive["audio_hours"], archive["bytes_per_call_hour"]) == (10800, 1.5, 7200)
+    assert set(archive["shards"]) == set(REGIONS)
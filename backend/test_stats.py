@@ -0,0 +1,51 @@
+"""Dashboard aggregates rebuilt from the database"""
+
+from datetime import datetime, timedelta
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, ChatSession, UserAgent
+from stats import CallStats
+
+
+def test_rebuild_sums_handle_time_of_ended_calls(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    started = datetime(2025, 1, 1, 12, 0, 0)
+    db.add_all([
+        UserAgent(fullname="A", status="available"),
+        ChatSession(status="completed", started_at=started, ended_at=started + timedelta(seconds=90)),
+        ChatSession(status="completed", started_at=started, ended_at=started + timedelta(minutes=5)),
+        ChatSession(status="ongoing", started_at=started),
+    ])
+    db.commit()
+
+    stats = CallStats()
+    stats.rebuild(db)
+    assert stats.handled_calls == 2
+    assert stats.handle_time_total == 390.0
+    assert stats.sessions_by_status == {"completed": 2, "ongoing": 1}
+    assert stats.agents_by_status == {"available": 1}
+    db.close()
+
+
+def test_resync_runs_in_the_background(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    stats = CallStats(resync_seconds=0.05)
+    stats.start(factory)
+    try:
+        db = factory()
+        db.add(ChatSession(status="emergency"))  # committed behind the counters' back, e.g. by another worker
+        db.commit()
+        db.close()
+        deadline = time.time() + 5
+        while stats.active_sessions == 0 and time.time() < deadline:
+            time.sleep(0.02)
+        assert stats.snapshot()["calls"]["emergency"] == 1
+    finally:
+        stats.stop()
@@ -0,0 +1,89 @@
+"""Schema-constrained generation: validation, coercion and the one-shot repair round"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import begin_trace, end_trace
+from structured import STRUCTURED_OUTPUT_FAILURES, StructuredOutputError, generate_items, items_tool
+
+TOOL = items_tool("record_things", "Record things", {
+    "type": "object",
+    "properties": {
+        "kind": {"type": "string", "enum": ["advice", "warning"]},
+        "priority": {"type": "integer", "minimum": 1, "maximum": 10},
+        "text": {"type": "string", "minLength": 1},
+    },
+    "required": ["kind", "priority", "text"],
+})
+
+
+class ScriptedClaude:
+    """Answers each messages.create with the next tool input in `answers`"""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+        self.messages = SimpleNamespace(create=self.create)
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        name = kwargs["tool_choice"]["name"]
+        block = SimpleNamespace(type="tool_use", id=f"toolu_{len(self.requests)}", name=name, input=self.answers.pop(0))
+        return SimpleNamespace(content=[block])
+
+
+def generate(client):
+    return generate_items(client, "model", 512, TOOL, "transcript")
+
+
+def test_valid_items_are_coerced_and_returned_without_repair():
+    client = ScriptedClaude({"items": [{"kind": " Advice", "priority": "8", "text": "Stay on the line"}]})
+    assert generate(client) == [{"kind": "advice", "priority": 8, "text": "Stay on the line"}]
+    assert len(client.requests) == 1
+
+
+def test_only_invalid_items_are_sent_back_for_repair():
+    repaired = STRUCTURED_OUTPUT_FAILURES.value(tool="record_things", outcome="repaired")
+    client = ScriptedClaude(
+        {"items": [
+            {"kind": "advice", "priority": 5, "text": "first"},
+            {"kind": "urgent", "priority": 50, "text": "second"},
+            {"kind": "warning", "priority": 3, "text": "third"},
+        ]},
+        {"fixes": [{"index": 1, "item": {"kind": "warning", "priority": 10, "text": "second"}}]},
+    )
+    assert [item["text"] for item in generate(client)] == ["first", "second", "third"]
+    repair = client.requests[1]
+    assert repair["tool_choice"]["name"] == "record_things_fixes"
+    report = repair["messages"][-1]["content"][0]["content"]
+    assert "item 1:" in report and "item 0" not in report and "item 2" not in report
+    assert STRUCTURED_OUTPUT_FAILURES.value(tool="record_things", outcome="repaired") == repaired + 1
+
+
+def test_items_still_invalid_after_repair_are_dropped():
+    dropped = STRUCTURED_OUTPUT_FAILURES.value(tool="record_things", outcome="dropped")
+    client = ScriptedClaude(
+        {"items": [{"kind": "advice", "priority": 5, "text": "kept"}, {"kind": "advice", "text": ""}]},
+        {"fixes": [{"index": 1, "item": {"kind": "advice", "priority": 5, "text": " "}}, {"index": 0, "item": {}}]},
+    )
+    assert generate(client) == [{"kind": "advice", "priority": 5, "text": "kept"}]
+    assert STRUCTURED_OUTPUT_FAILURES.value(tool="record_things", outcome="dropped") == dropped + 1
+
+
+def test_no_valid_items_raises():
+    with pytest.raises(StructuredOutputError):
+        generate(ScriptedClaude({"text": "not a tool call"}))
+    with pytest.raises(StructuredOutputError):
+        generate(ScriptedClaude({"items": [{"kind": "advice"}]}, {"fixes": []}))
+
+
+def test_parsing_is_timed_as_its_own_stage():
+    client = ScriptedClaude(
+        {"items": [{"kind": "advice", "priority": 0, "text": "x"}]},
+        {"fixes": [{"index": 0, "item": {"kind": "advice", "priority": 1, "text": "x"}}]},
+    )
+    token = begin_trace("trace-1")
+    generate(client)
+    trace = end_trace(token)
+    assert [name for name, _ in trace["stages"]] == ["json_parse", "json_parse"]
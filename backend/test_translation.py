@@ -0,0 +1,109 @@
+"""Batched translation: alignment, deduplication, cache and partial failures"""
+
+from types import SimpleNamespace
+import json
+
+import pytest
+
+import translation
+from fake_claude import FakeClaude
+from metrics import begin_trace, end_trace, stage
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(translation, "translation_cache", translation.TranslationCache())
+
+
+class SkippingClaude(FakeClaude):
+    """Never answers the messages listed in `skip`"""
+
+    def __init__(self, skip=()):
+        super().__init__(latency=0.0, jitter=0.0)
+        self.skip = set(skip)
+        self.sent = []
+        create = self.messages.create
+
+        def create_skipping(**kwargs):
+            prompt = kwargs["messages"][-1]["content"]
+            self.sent.extend(item["text"] for item in json.loads(prompt[prompt.index("["):]))
+            response = create(**kwargs)
+            tool = response.content[0]
+            payload = {item["id"]: item["text"] for item in json.loads(prompt[prompt.index("["):])}
+            tool.input["translations"] = [t for t in tool.input["translations"] if payload[t["id"]] not in self.skip]
+            return response
+
+        self.messages.create = create_skipping
+
+
+def test_translations_stay_aligned_across_batches(monkeypatch):
+    monkeypatch.setattr(translation, "BATCH_TOKEN_BUDGET", 40)
+    texts = [f"message number {i} with some words" for i in range(12)]
+    results = translation.translate_texts(SkippingClaude(), "model", texts, "french")
+    assert [translated for translated, _, _ in results] == [f"[fr] {text}" for text in texts]
+
+
+def test_duplicates_and_whitespace_variants_are_sent_once():
+    client = SkippingClaude()
+    results = translation.translate_texts(client, "model", ["help", "help ", " help", "other"], "french")
+    assert client.sent == ["help", "other"]
+    assert [translated for translated, _, _ in results] == ["[fr] help"] * 3 + ["[fr] other"]
+
+
+def test_second_call_is_served_from_cache():
+    client = SkippingClaude()
+    translation.translate_texts(client, "model", ["help"], "french")
+    translated, cached, error = translation.translate_texts(client, "model", ["help "], "French")[0]
+    assert (translated, cached, error) == ("[fr] help", True, None)
+    assert client.sent == ["help"]
+
+
+def test_missing_translation_fails_alone_and_the_rest_is_cached():
+    client = SkippingClaude(skip={"broken"})
+    results = translation.translate_texts(client, "model", ["fine", "broken", "also fine"], "french")
+    assert results[0] == ("[fr] fine", False, None)
+    assert results[1][0] is None and results[1][2]
+    assert results[2] == ("[fr] also fine", False, None)
+    assert client.sent.count("broken") == 2  # retried once on its own
+    assert translation.translation_cache.get("fine", "french") == "[fr] fine"
+    assert translation.translation_cache.get("broken", "french") is None
+
+
+def test_failed_batch_reports_the_error_per_message():
+    client = SkippingClaude()
+
+    def fail(**kwargs):
+        raise ConnectionError("Claude is down")
+
+    client.messages.create = fail
+    results = translation.translate_texts(client, "model", ["a", "b"], "french")
+    assert [(translated, error) for translated, _, error in results] == [(None, "Claude is down")] * 2
+
+
+def test_parallel_batches_keep_the_request_trace(monkeypatch):
+    monkeypatch.setattr(translation, "BATCH_TOKEN_BUDGET", 20)
+    client = SkippingClaude()
+    create = client.messages.create
+
+    def timed(**kwargs):
+        with stage("claude_request"):
+            return create(**kwargs)
+
+    client.messages.create = timed
+    token = begin_trace("trace-1")
+    translation.translate_texts(client, "model", [f"message {i} padded out to a batch" for i in range(4)], "french")
+    trace = end_trace(token)
+    assert [name for name, _ in trace["stages"]].count("claude_request") == 4
+
+
+def test_blank_messages_are_returned_unchanged():
+    client = SkippingClaude()
+    assert translation.translate_texts(client, "model", ["  "], "french") == [("  ", False, None)]
+    assert client.sent == []
+
+
+def test_oversized_batch_is_rejected_before_any_claude_call(main):
+    from fastapi.testclient import TestClient
+
+    items = [{"text": f"message {i}"} for i in range(main.TRANSLATE_BATCH_MAX_ITEMS + 1)]
+    assert TestClient(main.app).post("/translate-batch", json={"items": items}).status_code == 422
@@ -0,0 +1,211 @@
+"""
+Batched translation helpers.
+
+Messages are deduplicated, looked up in a per-(text, language) cache and the
+misses are packed into token-budgeted Claude requests. Every line is sent with
+an ID and the model must answer through a tool call keyed by those IDs, so the
+result can never drift out of alignment with the input. A message the model
+still skips after a retry is reported as failed on its own; the rest of the
+batch is returned and cached.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+import contextvars
+import json
+
+# -------- Configuration --------
+BATCH_TOKEN_BUDGET = 1500      # input tokens per Claude request
+MAX_OUTPUT_TOKENS = 4096
+MAX_PARALLEL_BATCHES = 4
+CACHE_SIZE = 10000
+
+TRANSLATION_TOOL = {
+    "name": "record_translations",
+    "description": "Record the translation of every input message, keyed by its id.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "translations": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string"},
+                        "text": {"type": "string"},
+                    },
+                    "required": ["id", "text"],
+                },
+            }
+        },
+        "required": ["translations"],
+    },
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def normalize_text(text: str) -> str:
+    """The form a message is deduplicated, cached and sent to Claude in"""
+    return text.strip()
+
+
+# -------- Cache --------
+class TranslationCache:
+    """Thread-safe LRU cache of translations keyed by (text, target_language)"""
+
+    def __init__(self, max_size: int = CACHE_SIZE):
+        self.max_size = max_size
+        self._data: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, target_language: str) -> Tuple[str, str]:
+        return normalize_text(text), target_language.strip().lower()
+
+    def get(self, text: str, target_language: str):
+        key = self.key(text, target_language)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, text: str, target_language: str, translated: str):
+        key = self.key(text, target_language)
+        with self._lock:
+            self._data[key] = translated
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+translation_cache = TranslationCache()
+
+
+# -------- Batching --------
+def pack_batches(texts: List[str], token_budget: int = BATCH_TOKEN_BUDGET) -> List[List[str]]:
+    """Greedily pack texts into batches whose estimated size stays under the budget"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text) + 8  # id + JSON overhead
+        if current and current_tokens + tokens > token_budget:
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _request_batch(client, model: str, texts: List[str], target_language: str) -> Dict[str, str]:
+    """Send one batch to Claude and return {id: translation} for the ids it answered"""
+    payload = [{"id": str(i), "text": t} for i, t in enumerate(texts)]
+    prompt = (
+        f"Translate the text of each of the following messages into {target_language}. "
+        f"Preserve the tone and meaning as much as possible. "
+        f"Translate every message separately and keep its id.\n\n"
+        f"{json.dumps(payload, ensure_ascii=False)}"
+    )
+    max_tokens = min(MAX_OUTPUT_TOKENS, 2 * sum(estimate_tokens(t) for t in texts) + 16 * len(texts) + 100)
+
+    response = client.messages.create(
+        model=model,
+        max_tokens=max_tokens,
+        tools=[TRANSLATION_TOOL],
+        tool_choice={"type": "tool", "name": TRANSLATION_TOOL["name"]},
+        messages=[{"role": "user", "content": prompt}],
+    )
+
+    answered = {}
+    for block in response.content:
+        if getattr(block, "type", None) == "tool_use":
+            for item in block.input.get("translations", []):
+                if isinstance(item, dict) and "id" in item and isinstance(item.get("text"), str):
+                    answered[str(item["id"])] = item["text"].strip()
+
+    return {texts[int(i)]: answered[i] for i in answered if i.isdigit() and int(i) < len(texts)}
+
+
+def _translate_uncached(client, model: str, texts: List[str], target_language: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """({text: translation}, {text: error}) for the texts of batches that failed outright"""
+    batches = pack_batches(texts, BATCH_TOKEN_BUDGET)
+    results: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_BATCHES, len(batches))) as pool:
+        # Each batch runs in a copy of the caller's context, so its Claude call lands in the request's trace
+        futures = [
+            (batch, pool.submit(contextvars.copy_context().run, _request_batch, client, model, batch, target_language))
+            for batch in batches
+        ]
+        for batch, future in futures:
+            try:
+                results.update(future.result())
+            except Exception as e:
+                print(f"Translation batch of {len(batch)} message(s) failed: {e}")
+                errors.update((text, str(e)) for text in batch)
+    return results, errors
+
+
+def translate_texts(
+    client, model: str, texts: List[str], target_language: str
+) -> List[Tuple[Optional[str], bool, Optional[str]]]:
+    """
+    Translate texts into target_language, returning (translation, cached, error)
+    per input in the same order. Identical texts (after normalize_text) are
+    translated once; ids the model skipped are retried once on their own. A
+    message that still has no translation gets (None, False, error) and does
+    not affect the others.
+    """
+    results: Dict[str, str] = {}
+    cached = set()
+    pending = []
+    for text in dict.fromkeys(normalize_text(t) for t in texts):
+        if not text:
+            results[text] = text
+            continue
+        hit = translation_cache.get(text, target_language)
+        if hit is not None:
+            results[text] = hit
+            cached.add(text)
+        else:
+            pending.append(text)
+
+    errors: Dict[str, str] = {}
+    if pending:
+        translated, _ = _translate_uncached(client, model, pending, target_language)
+        missing = [t for t in pending if t not in translated]
+        if missing:
+            retried, errors = _translate_uncached(client, model, missing, target_language)
+            translated.update(retried)
+        for text, value in translated.items():
+            translation_cache.put(text, target_language, value)
+        results.update(translated)
+
+    out = []
+    for text in texts:
+        key = normalize_text(text)
+        if not key:
+            out.append((text, False, None))
+        elif key in results:
+            out.append((results[key], key in cached, None))
+        else:
+            out.append((None, False, errors.get(key, "Claude returned no translation for this message")))
+    return out